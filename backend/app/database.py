@@ -4,7 +4,12 @@ Using SQLite - no server required!
 """
 
 import os
-from sqlalchemy import create_engine
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -15,17 +20,114 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./medinsight.db")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite tuning profile, applied to every new connection (empty value = leave the default)
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),  # negative = KiB, i.e. 64 MiB
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+}
+
 # Ensure SQLite URLs are handled correctly
-if DATABASE_URL and DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     # SQLite needs this for threading and handles absolute paths in volumes
     connect_args = {"check_same_thread": False}
+    engine_options = {}
 else:
+    # Postgres connection pool profile
     connect_args = {}
+    engine_options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
 
 # Create engine
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_options)
 print(f"✓ Using database: {DATABASE_URL}")
 
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            if value:
+                cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+class WriteQueue:
+    """
+    Single-writer queue: write transactions run one at a time on a dedicated
+    thread, so concurrent requests wait in line instead of failing with
+    "database is locked", and commits do not block the event loop.
+    When disabled (the default for Postgres, which handles concurrent writers),
+    writes run concurrently on worker threads; never on the event loop.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer") if enabled else None
+        self._lock = threading.Lock()
+        self._counters = {"pending": 0, "completed": 0, "failed": 0, "max_wait_ms": 0.0, "total_wait_ms": 0.0}
+
+    async def run(self, fn, *args, **kwargs):
+        if not self.enabled:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+        enqueued = time.perf_counter()
+        with self._lock:
+            self._counters["pending"] += 1
+
+        def job():
+            wait_ms = (time.perf_counter() - enqueued) * 1000
+            with self._lock:
+                self._counters["pending"] -= 1
+                self._counters["total_wait_ms"] += wait_ms
+                self._counters["max_wait_ms"] = max(self._counters["max_wait_ms"], wait_ms)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._counters["failed"] += 1
+                raise
+            with self._lock:
+                self._counters["completed"] += 1
+            return result
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._counters["completed"] + self._counters["failed"]
+            return {
+                "enabled": self.enabled,
+                "pending": self._counters["pending"],
+                "completed": self._counters["completed"],
+                "failed": self._counters["failed"],
+                "avg_wait_ms": round(self._counters["total_wait_ms"] / done, 2) if done else 0.0,
+                "max_wait_ms": round(self._counters["max_wait_ms"], 2)
+            }
+
+
+write_queue = WriteQueue(
+    enabled=os.getenv("DB_SERIALIZE_WRITES", "true" if IS_SQLITE else "false").lower() == "true"
+)
+
+
+def serialized_write(fn):
+    """Turn a synchronous write method into a coroutine that runs through the write queue"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await write_queue.run(fn, *args, **kwargs)
+    return wrapper
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -44,3 +146,25 @@ def init_db():
     from models.db_models import Base
     Base.metadata.create_all(bind=engine)
     print("✓ Database tables created successfully")
+
+
+def ensure_schema():
+    """
+    Create missing tables, then add columns and indexes introduced after a
+    database file was first created (create_all never alters existing tables)
+    """
+    from models import db_models
+    Base.metadata.create_all(bind=engine)
+    
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in existing]
+        if missing:
+            with engine.begin() as conn:
+                for column in missing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    print(f"✓ Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
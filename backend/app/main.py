@@ -7,17 +7,22 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
+import asyncio
 
 # Load environment variables
 load_dotenv()
 
 # Import routers
-from routers import reports, insights, users
+from routers import reports, insights, users, metrics
+from middleware import CompressionMiddleware, UploadSizeLimitMiddleware, compression_settings
+from services.storage_service import MAX_UPLOAD_BYTES
+from services.executor_service import cpu_executor, shutdown_executors
+from services.llm_ledger import llm_ledger
+from services.supabase_service import supabase_service
 
 # Initialize database
-from database import Base, engine
-from models import db_models
-Base.metadata.create_all(bind=engine)
+from database import ensure_schema
+ensure_schema()
 print("✓ Database tables initialized")
 
 # Create FastAPI app
@@ -27,6 +32,11 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Refuse oversized uploads: from their Content-Length before the body is read,
+# otherwise as soon as the bytes received pass the limit
+# (added before CORS so the 413 still carries CORS headers)
+app.add_middleware(UploadSizeLimitMiddleware, max_upload_bytes=MAX_UPLOAD_BYTES)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -36,10 +46,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (history payloads can hold thousands of test rows)
+app.add_middleware(CompressionMiddleware, **compression_settings())
+
 # Include routers
 app.include_router(reports.router, prefix="/api/reports", tags=["Reports"])
 app.include_router(insights.router, prefix="/api/insights", tags=["Insights"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["Metrics"])
+
+
+@app.on_event("startup")
+async def startup():
+    await cpu_executor.warm_up()
+    app.state.tombstone_pruner = asyncio.create_task(supabase_service.prune_tombstones_periodically())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.tombstone_pruner.cancel()
+    await llm_ledger.flush()
+    shutdown_executors()
 
 
 @app.get("/")
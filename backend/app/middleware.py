@@ -0,0 +1,218 @@
+"""
+ASGI Middleware
+Response compression (brotli when available, gzip otherwise) above a size threshold,
+and early rejection of oversized uploads
+"""
+
+import os
+import gzip
+import json
+
+from starlette.exceptions import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Accept-Encoding as {coding: q-value}, e.g. "br;q=0, gzip" -> {"br": 0.0, "gzip": 1.0}"""
+    weights = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights
+
+
+class CompressionMiddleware:
+    """
+    Compress complete (non-streaming) responses larger than minimum_size.
+    Streaming responses such as server-sent events are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1").lower()
+                break
+
+        encoding = self._select_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = dict(start_message.get("headers", []))
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+
+            if (
+                message.get("more_body", False)
+                or b"content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self._compress(body, encoding)
+            raw_headers = [
+                (name, value) for name, value in start_message.get("headers", [])
+                if name not in (b"content-length", b"vary")
+            ]
+            vary = headers.get(b"vary")
+            raw_headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"),
+            ]
+            await send({**start_message, "headers": raw_headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _select_encoding(accept_encoding: str):
+        """The supported coding the client weights highest (br on ties); q=0 means not acceptable"""
+        weights = parse_accept_encoding(accept_encoding)
+        supported = ("br", "gzip") if brotli is not None else ("gzip",)
+        best, best_q = None, 0.0
+        for encoding in supported:
+            q = weights.get(encoding, weights.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+
+class UploadTooLarge(HTTPException):
+    """Raised from receive() once an upload body passes the size limit"""
+
+    def __init__(self, max_upload_bytes: int):
+        super().__init__(
+            status_code=413,
+            detail=f"File too large. Maximum size is {round(max_upload_bytes / (1024 * 1024), 2):g} MB"
+        )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject upload requests larger than the limit with 413: from the declared
+    Content-Length before the body is read, and otherwise (chunked bodies, or a
+    Content-Length that understates the body) by counting the bytes received,
+    stopping as soon as the limit is passed.
+    """
+
+    # Allowance for form fields and multipart boundaries around the file
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, max_upload_bytes: int, path_suffix: str = "/upload"):
+        self.app = app
+        self.max_upload_bytes = max_upload_bytes
+        self.path_suffix = path_suffix
+
+    async def __call__(self, scope, receive, send):
+        if not (scope["type"] == "http" and scope["method"] == "POST" and scope["path"].endswith(self.path_suffix)):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_upload_bytes + self.MULTIPART_OVERHEAD
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # An HTTPException, so the body parser passes it on and it is rendered as a 413
+                    raise UploadTooLarge(self.max_upload_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            # Raised somewhere the exception handlers do not reach
+            if response_started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": UploadTooLarge(self.max_upload_bytes).detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def compression_settings() -> dict:
+    """Compression middleware options from environment settings"""
+    return {
+        "minimum_size": int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+        "gzip_level": int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+        "brotli_quality": int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4")),
+    }
@@ -1,2 +1,2 @@
 # Database Models
-from .db_models import Base, UserProfile, FamilyMember, Report, TestResult, AIConversation, Reminder
+from .db_models import Base, UserProfile, FamilyMember, Report, TestResult, AIConversation, Reminder, DeletedRecord, StoredBlob, ExtractionArtifact, LLMCall
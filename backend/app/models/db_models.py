@@ -73,10 +73,20 @@ class Report(Base):
     summary = Column(Text)
     status = Column(String, default="pending")
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    # Aggregates written when test results are saved
+    total_tests = Column(Integer)
+    normal_count = Column(Integer)
+    abnormal_count = Column(Integer)
+    critical_count = Column(Integer)
+    status_counts = Column(Text)  # JSON string for SQLite compatibility
+    severity_counts = Column(Text)
     
     # Relationships
     test_results = relationship("TestResult", back_populates="report", cascade="all, delete-orphan")
+    extraction_artifacts = relationship("ExtractionArtifact", back_populates="report", cascade="all, delete-orphan")
+    llm_calls = relationship("LLMCall", back_populates="report", cascade="all, delete-orphan")
 
 
 class TestResult(Base):
@@ -94,11 +104,57 @@ class TestResult(Base):
     explanation = Column(Text)
     alert_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     report = relationship("Report", back_populates="test_results")
 
 
+class ExtractionArtifact(Base):
+    """
+    Intermediate output of extracting a report (text and raw LLM JSON),
+    so it can be re-analyzed without re-running PDF parsing or OCR
+    """
+    __tablename__ = "extraction_artifacts"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    report_id = Column(String, ForeignKey("reports.id"), nullable=False, index=True)
+    extractor = Column(String)  # pypdf, pdf_ocr or image_ocr
+    extractor_version = Column(String)
+    prompt_version = Column(String, index=True)
+    model = Column(String)
+    pages = Column(Text)  # JSON list of per-page text
+    cleaned_text = Column(Text)
+    raw_llm_json = Column(Text)  # the model's reply as received
+    repaired = Column(Boolean, default=False)  # the reply was truncated; only its complete items were parsed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    report = relationship("Report", back_populates="extraction_artifacts")
+
+
+class LLMCall(Base):
+    """Ledger entry of one LLM call: stage, model, latency, tokens and retries"""
+    __tablename__ = "llm_calls"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    report_id = Column(String, ForeignKey("reports.id"), nullable=True, index=True)
+    stage = Column(String, nullable=False)
+    model = Column(String)
+    endpoint = Column(String)
+    outcome = Column(String)  # ok, failed, rejected or cancelled
+    latency_ms = Column(Float)
+    first_token_ms = Column(Float)  # streamed calls only
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    retries = Column(Integer, default=0)
+    cache_hit = Column(Boolean, default=False)  # shared a concurrent identical call
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # Relationships
+    report = relationship("Report", back_populates="llm_calls")
+
+
 class AIConversation(Base):
     __tablename__ = "ai_conversations"
     
@@ -123,3 +179,27 @@ class Reminder(Base):
     is_read = Column(Boolean, default=False)
     is_dismissed = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DeletedRecord(Base):
+    """Tombstone of a deleted report or test result, used by delta sync clients"""
+    __tablename__ = "deleted_records"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, index=True)
+    entity_type = Column(String, nullable=False)  # "report" or "test_result"
+    entity_id = Column(String, nullable=False)
+    report_id = Column(String)
+    deleted_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class StoredBlob(Base):
+    """Content-addressed upload file, shared by every report with identical bytes"""
+    __tablename__ = "stored_blobs"
+    
+    sha256 = Column(String, primary_key=True)
+    path = Column(String, nullable=False, unique=True, index=True)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String)
+    ref_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -49,6 +49,12 @@ class ExtractedReportData(BaseModel):
     tests: List[TestResult] = []
 
 
+class HealthSummary(BaseModel):
+    summary: str
+    health_score: int = Field(ge=0, le=100)
+    attention_areas: List[str] = []
+
+
 class ReportUploadResponse(BaseModel):
     id: str
     file_url: str
@@ -63,6 +69,8 @@ class AnalysisResponse(BaseModel):
     health_score: Optional[int] = None
     summary: Optional[str] = None
     overall_status: str = "pending"
+    # True when explanations and the summary are still being generated (saved reports get them later)
+    enrichment_pending: bool = False
 
 
 class ExplanationRequest(BaseModel):
@@ -4,6 +4,9 @@ All prompts for OpenAI integration as specified in the workflow
 """
 
 # Prompt 1: PDF → Structured Medical Data
+# Bump when the extraction prompts change; stored extraction artifacts record it
+EXTRACT_PROMPT_VERSION = "2"
+
 SYSTEM_PROMPT_EXTRACT = """You are a medical report analysis assistant.
 Your task is to read medical laboratory reports and extract structured data.
 You must be precise and conservative.
@@ -63,7 +66,7 @@ Also assign severity:
 - LOW or HIGH (significantly outside range, more than 10%) → severity: "red"
 - UNKNOWN → severity: "gray"
 
-Return JSON only with the same structure, adding status and severity to each test.
+Return JSON only: an object {{"tests": [...]}} with the same fields for each test, adding status and severity.
 
 Input test data:
 {tests_json}"""
@@ -133,8 +136,8 @@ Provide:
 3. Key areas of attention (if any abnormal values)
 
 Return as JSON:
-{
+{{
   "summary": "string",
   "health_score": number,
   "attention_areas": ["string"]
-}"""
+}}"""
@@ -0,0 +1,133 @@
+"""
+HTTP Response Helpers
+Fast JSON rendering, conditional requests (ETag / Last-Modified)
+and Cache-Control for report endpoints
+"""
+
+import os
+import json
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Reports hold health data: only the browser may cache them (never a CDN or shared
+# proxy), and must revalidate once stale so a deleted report stops being served
+REPORT_MAX_AGE = int(os.getenv("REPORT_HTTP_MAX_AGE", "60"))
+SHARE_MAX_AGE = int(os.getenv("SHARE_HTTP_MAX_AGE", "300"))
+
+
+def _json_default(obj):
+    """Encode values the JSON encoders do not handle natively"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response that renders plain dicts/lists directly (orjson when installed),
+    skipping FastAPI's recursive jsonable_encoder pass
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=_json_default)
+        return json.dumps(
+            content, default=_json_default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def report_validators(report: dict, variant: str) -> tuple:
+    """
+    ETag and Last-Modified of a report representation.
+    The variant distinguishes endpoints (and query options) serving the same report.
+
+    Last-Modified has whole-second precision, so it is the second after updated_at
+    and is only sent once that second has passed: a later update always gets a
+    later Last-Modified, and If-Modified-Since can never match stale data.
+    """
+    updated_at = report.get("updated_at") or report.get("created_at") or ""
+    digest = hashlib.sha1(f"{report['id']}:{updated_at}:{variant}".encode()).hexdigest()[:20]
+    # Weak validator: the body may be re-encoded (e.g. compressed) on the way out
+    etag = f'W/"{digest}"'
+
+    last_modified = None
+    if updated_at:
+        modified = datetime.fromisoformat(updated_at).replace(microsecond=0, tzinfo=timezone.utc) + timedelta(seconds=1)
+        if modified <= datetime.now(timezone.utc):
+            last_modified = format_datetime(modified, usegmt=True)
+
+    return etag, last_modified
+
+
+def cache_control(report: dict, shared: bool = False) -> str:
+    """Cache-Control header for a report representation"""
+    if report.get("status") != "completed":
+        return "no-cache"
+    if shared:
+        return f"private, max-age={SHARE_MAX_AGE}, must-revalidate"
+    return f"private, max-age={REPORT_MAX_AGE}, must-revalidate"
+
+
+def _validator_headers(report: dict, variant: str, shared: bool) -> dict:
+    etag, last_modified = report_validators(report, variant)
+    headers = {"ETag": etag, "Cache-Control": cache_control(report, shared)}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match header"""
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def not_modified_response(request: Request, report: dict, variant: str, shared: bool = False) -> Optional[Response]:
+    """
+    Return a 304 response if the client's cached copy is still current, else None
+    """
+    headers = _validator_headers(report, variant, shared)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return Response(status_code=304, headers=headers) if _etag_matches(if_none_match, headers["ETag"]) else None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = headers.get("Last-Modified")
+    if if_modified_since and last_modified:
+        try:
+            if parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+def report_json_response(payload, report: dict, variant: str, shared: bool = False) -> FastJSONResponse:
+    """JSON response carrying the report's validators and Cache-Control"""
+    return FastJSONResponse(
+        content=payload,
+        headers=_validator_headers(report, variant, shared)
+    )
@@ -3,10 +3,16 @@ Insights Router
 Handles health insights and explanation endpoints
 """
 
-from fastapi import APIRouter, HTTPException
+import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from services.openai_service import openai_service
+from services.llm_service import LLMUnavailable
+from services.admission_service import AdmissionRejected, set_llm_caller_for_request
+from services.token_service import prompt_budget, fit_lines, test_line, set_llm_report
 from services.supabase_service import supabase_service
 from services.analysis_service import analysis_service
+from responses import not_modified_response, report_json_response
 from models.schemas import (
     ExplanationRequest, ExplanationResponse,
     AlertRequest, AlertResponse, TestStatus, Severity
@@ -14,13 +20,17 @@ from models.schemas import (
 
 router = APIRouter()
 
+# Tokens of the /ask prompt besides the patient's results (instructions and question)
+ASK_PROMPT_TOKENS = 250
+
 
 @router.post("/explain", response_model=ExplanationResponse)
-async def get_explanation(request: ExplanationRequest):
+async def get_explanation(request: ExplanationRequest, http_request: Request):
     """
     Get a patient-friendly explanation for a specific test result
     """
     try:
+        set_llm_caller_for_request(http_request)
         explanation = await openai_service.generate_explanation(
             request.test_name,
             request.value,
@@ -40,11 +50,12 @@ async def get_explanation(request: ExplanationRequest):
 
 
 @router.post("/alert", response_model=AlertResponse)
-async def get_alert(request: AlertRequest):
+async def get_alert(request: AlertRequest, http_request: Request):
     """
     Get a health alert message for a specific test result
     """
     try:
+        set_llm_caller_for_request(http_request)
         alert_message = await openai_service.generate_alert(
             request.test_name,
             request.status.value,
@@ -62,48 +73,28 @@ async def get_alert(request: AlertRequest):
 
 
 @router.get("/{report_id}")
-async def get_report_insights(report_id: str):
+async def get_report_insights(report_id: str, request: Request):
     """
     Get comprehensive insights for a report
     """
     try:
-        # Get test results
-        test_results = await supabase_service.get_test_results(report_id)
+        # Counts are stored on the report row when its test results are saved
+        report = await supabase_service.get_report(report_id)
         
-        if not test_results:
+        if not report or not report.get("total_tests"):
             raise HTTPException(status_code=404, detail="Report not found or has no results")
         
-        # Calculate statistics
-        total = len(test_results)
-        normal_count = sum(1 for t in test_results if t.get("status") == "NORMAL")
-        abnormal_count = sum(1 for t in test_results if t.get("status") in ["LOW", "HIGH"])
-        critical_count = sum(1 for t in test_results if t.get("severity") == "red")
-        
-        # Get abnormal tests
-        abnormal_tests = [t for t in test_results if t.get("status") in ["LOW", "HIGH"]]
-        
-        # Calculate health score
-        health_score = int((normal_count / total) * 100) if total > 0 else 0
-        
-        return {
-            "report_id": report_id,
-            "statistics": {
-                "total_tests": total,
-                "normal_count": normal_count,
-                "abnormal_count": abnormal_count,
-                "critical_count": critical_count,
-                "health_score": health_score
-            },
-            "abnormal_tests": abnormal_tests,
-            "recommendations": [
-                "Review any abnormal values with your healthcare provider",
-                "Consider scheduling a follow-up appointment if multiple values are abnormal",
-                "Maintain a healthy lifestyle with regular exercise and balanced nutrition"
-            ] if abnormal_count > 0 else [
-                "Your test results look good! Continue maintaining your healthy lifestyle",
-                "Schedule regular check-ups to monitor your health"
-            ]
-        }
+        not_modified = not_modified_response(request, report, "insights")
+        if not_modified:
+            return not_modified
+        
+        # Only abnormal rows need to be loaded
+        abnormal_tests = []
+        if report["abnormal_count"]:
+            abnormal_tests = await supabase_service.get_test_results(report_id, statuses=["LOW", "HIGH"])
+        
+        insights = analysis_service.build_insights(report_id, report, abnormal_tests)
+        return report_json_response(insights, report, "insights")
         
     except HTTPException:
         raise
@@ -113,57 +104,24 @@ async def get_report_insights(report_id: str):
 
 
 @router.get("/{report_id}/chart-data")
-async def get_chart_data(report_id: str):
+async def get_chart_data(report_id: str, request: Request):
     """
     Get data formatted for charts
     """
     try:
-        test_results = await supabase_service.get_test_results(report_id)
+        report = await supabase_service.get_report(report_id)
         
-        if not test_results:
+        if not report or not report.get("total_tests"):
             raise HTTPException(status_code=404, detail="Report not found")
         
-        # Status distribution for pie/bar chart
-        status_counts = {"NORMAL": 0, "LOW": 0, "HIGH": 0, "UNKNOWN": 0}
-        for t in test_results:
-            status = t.get("status", "UNKNOWN")
-            if status in status_counts:
-                status_counts[status] += 1
-        
-        status_distribution = [
-            {"name": "Normal", "value": status_counts["NORMAL"], "color": "#10b981"},
-            {"name": "Low", "value": status_counts["LOW"], "color": "#f59e0b"},
-            {"name": "High", "value": status_counts["HIGH"], "color": "#ef4444"},
-            {"name": "Unknown", "value": status_counts["UNKNOWN"], "color": "#6b7280"}
-        ]
-        
-        # Severity distribution
-        severity_counts = {"green": 0, "yellow": 0, "red": 0, "gray": 0}
-        for t in test_results:
-            severity = t.get("severity", "gray")
-            if severity in severity_counts:
-                severity_counts[severity] += 1
-        
-        severity_distribution = [
-            {"name": "Healthy", "value": severity_counts["green"], "color": "#10b981"},
-            {"name": "Borderline", "value": severity_counts["yellow"], "color": "#f59e0b"},
-            {"name": "Needs Attention", "value": severity_counts["red"], "color": "#ef4444"},
-            {"name": "Unknown", "value": severity_counts["gray"], "color": "#6b7280"}
-        ]
-        
-        return {
-            "status_distribution": status_distribution,
-            "severity_distribution": severity_distribution,
-            "test_results": [
-                {
-                    "name": t["test_name"][:20],
-                    "value": float(t["observed_value"]) if t["observed_value"].replace(".", "").replace("-", "").isdigit() else 0,
-                    "status": t.get("status", "UNKNOWN"),
-                    "severity": t.get("severity", "gray")
-                }
-                for t in test_results
-            ]
-        }
+        not_modified = not_modified_response(request, report, "chart-data")
+        if not_modified:
+            return not_modified
+        
+        test_results = await supabase_service.get_test_results(report_id)
+        
+        chart_data = analysis_service.build_chart_data(report, test_results)
+        return report_json_response(chart_data, report, "chart-data")
         
     except HTTPException:
         raise
@@ -173,7 +131,7 @@ async def get_chart_data(report_id: str):
 
 
 @router.post("/ask")
-async def ask_followup_question(question_data: dict):
+async def ask_followup_question(question_data: dict, request: Request):
     """
     Answer follow-up questions about test results
     Uses AI to provide context-aware answers based on the report
@@ -185,21 +143,122 @@ async def ask_followup_question(question_data: dict):
         if not question:
             raise HTTPException(status_code=400, detail="Question is required")
         
-        # Get test results for context (if report_id provided)
-        context = ""
-        if report_id:
-            test_results = await supabase_service.get_test_results(report_id)
-            if test_results:
-                context = "\\n".join([
-                    f"- {t['test_name']}: {t['observed_value']} {t.get('unit', '')} ({t.get('status', 'UNKNOWN')})"
-                    for t in test_results
-                ])
+        set_llm_caller_for_request(request)
+        set_llm_report(report_id)
         
         # Generate answer using OpenAI
         if not openai_service.client:
             answer = get_fallback_answer(question)
         else:
-            prompt = f"""You are a helpful health assistant. Answer the patient's question about their test results.
+            try:
+                response = await openai_service.llm.chat(
+                    "ask", messages=await build_ask_messages(report_id, question), temperature=0.7
+                )
+                answer = response.choices[0].message.content.strip()
+            except LLMUnavailable as e:
+                print(f"⚠️  Answering from fallback: {e}")
+                openai_service.llm.record_fallback("ask")
+                answer = get_fallback_answer(question)
+        
+        return {"question": question, "answer": answer}
+        
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"Error answering question: {e}")
+        return {"question": question_data.get("question", ""), "answer": "I'm sorry, I couldn't process your question. Please try again or consult your healthcare provider."}
+
+
+@router.post("/ask/stream")
+async def ask_followup_question_stream(question_data: dict, request: Request):
+    """
+    Answer a follow-up question as server-sent events: "delta" events carry
+    the answer's text as the model writes it, then a "done" event carries the
+    full answer. The Q&A is saved once the answer is complete (with user_id).
+    """
+    report_id = question_data.get("report_id")
+    question = question_data.get("question")
+    user_id = question_data.get("user_id")
+    
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+    
+    # Rate limits apply per client address; user_id only says whose conversation this is
+    set_llm_caller_for_request(request)
+    set_llm_report(report_id)
+    
+    stream = None
+    first = ""
+    if openai_service.client:
+        try:
+            stream = openai_service.llm.chat_stream(
+                "ask", messages=await build_ask_messages(report_id, question), temperature=0.7
+            )
+            # Wait for the first token before answering, so admission and upstream
+            # failures still get a proper status code (or the fallback answer)
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            stream = None
+        except LLMUnavailable as e:
+            print(f"⚠️  Answering from fallback: {e}")
+            openai_service.llm.record_fallback("ask")
+            stream = None
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        except Exception as e:
+            print(f"Error answering question: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    async def events():
+        parts = [first] if stream is not None else [get_fallback_answer(question)]
+        try:
+            yield sse_event("delta", {"text": parts[0]})
+            if stream is not None:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield sse_event("delta", {"text": delta})
+        except LLMUnavailable as e:
+            print(f"Error streaming answer: {e}")
+            yield sse_event("error", {"detail": "The answer was interrupted. Please try again."})
+            return
+        finally:
+            if stream is not None:
+                await stream.aclose()
+        
+        answer = "".join(parts).strip()
+        conversation_id = None
+        if user_id:
+            saved = await supabase_service.save_conversation(user_id, report_id, question, answer)
+            conversation_id = saved.get("id")
+        yield sse_event("done", {"question": question, "answer": answer, "conversation_id": conversation_id})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # keep nginx from buffering the stream
+    })
+
+
+async def build_ask_messages(report_id, question: str) -> list:
+    """Prompt for a follow-up question, with the report's results (abnormal first) as context"""
+    context = ""
+    if report_id:
+        test_results = await supabase_service.get_test_results(
+            report_id, fields=["test_name", "observed_value", "unit", "status"]
+        )
+        if test_results:
+            # Abnormal results first, so trimming to the prompt budget drops normal ones
+            ordered = sorted(test_results, key=lambda t: t["status"] not in ("LOW", "HIGH"))
+            context = "\n".join(fit_lines(
+                [test_line(t["test_name"], t["observed_value"], t["unit"], t["status"] or "UNKNOWN") for t in ordered],
+                prompt_budget("ask") - ASK_PROMPT_TOKENS,
+                omitted="... and {count} more results"
+            ))
+    
+    context_block = f"Patient's test results:\n{context}" if context else ""
+    
+    prompt = f"""You are a helpful health assistant. Answer the patient's question about their test results.
 IMPORTANT RULES:
 - Be educational and patient-friendly
 - Explain what tests measure and what results generally mean
@@ -207,30 +266,20 @@ IMPORTANT RULES:
 - Do NOT recommend specific medications
 - Always suggest consulting a doctor for personalized advice
 
-{f"Patient's test results:\\n{context}" if context else ""}
+{context_block}
 
 Patient's question: {question}
 
 Provide a helpful, educational response:"""
-            
-            response = openai_service.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful health education assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300,
-                temperature=0.7
-            )
-            answer = response.choices[0].message.content.strip()
-        
-        return {"question": question, "answer": answer}
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error answering question: {e}")
-        return {"question": question_data.get("question", ""), "answer": "I'm sorry, I couldn't process your question. Please try again or consult your healthcare provider."}
+    
+    return [
+        {"role": "system", "content": "You are a helpful health education assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 def get_fallback_answer(question: str) -> str:
@@ -0,0 +1,84 @@
+"""
+Metrics Router
+Runtime counters of backend subsystems
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from database import write_queue
+from services.supabase_service import supabase_service
+from services.ocr_service import ocr_stats
+from services.executor_service import executor_stats
+from services.openai_service import openai_service
+from services.admission_service import llm_scheduler
+from services.token_service import token_usage
+from services.llm_ledger import llm_ledger, summarize_llm_calls
+
+router = APIRouter()
+
+
+@router.get("")
+async def get_metrics():
+    """
+    Get runtime metrics (cache hit/miss/eviction counters, database write queue,
+    upload storage, OCR stage timings, executor pools, LLM calls and circuit breaker,
+    LLM admission queues, LLM token usage and call ledger)
+    """
+    return {
+        "report_cache": supabase_service.cache.stats(),
+        "db_write_queue": write_queue.stats(),
+        "storage": await supabase_service.get_storage_usage(),
+        "ocr": ocr_stats.stats(),
+        "executors": executor_stats(),
+        "llm": openai_service.llm.stats() if openai_service.llm else None,
+        "llm_admission": llm_scheduler.stats(),
+        "llm_tokens": token_usage.stats(),
+        "llm_ledger": llm_ledger.stats()
+    }
+
+
+@router.get("/llm-calls")
+async def get_llm_call_metrics(hours: float = Query(24, gt=0, le=24 * 30), stage: Optional[str] = None):
+    """
+    Get LLM call latency percentiles (p50/p95/p99; time to first token for
+    streamed calls), retries, cache hits and tokens per stage over the last
+    `hours`, from the call ledger
+    """
+    await llm_ledger.flush()
+    since = datetime.utcnow() - timedelta(hours=hours)
+    calls = await supabase_service.get_llm_calls(since, stage=stage, fields=[
+        "stage", "model", "outcome", "latency_ms", "first_token_ms", "prompt_tokens", "completion_tokens", "retries", "cache_hit"
+    ])
+    return {
+        "since": since.isoformat(),
+        "hours": hours,
+        "calls": len(calls),
+        "stages": summarize_llm_calls(calls)
+    }
+
+
+@router.get("/reports/{report_id}/tokens")
+async def get_report_token_usage(report_id: str):
+    """
+    Get the prompt and completion tokens spent on a report's analysis, per stage
+    (kept in memory for recently analyzed reports)
+    """
+    usage = token_usage.report(report_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="No token usage recorded for this report")
+    return {"report_id": report_id, **usage}
+
+
+@router.get("/reports/{report_id}/llm-calls")
+async def get_report_llm_calls(report_id: str):
+    """Get every recorded LLM call of a report, with per-stage totals"""
+    await llm_ledger.flush()
+    calls = await supabase_service.get_report_llm_calls(report_id)
+    if not calls:
+        raise HTTPException(status_code=404, detail="No LLM calls recorded for this report")
+    return {
+        "report_id": report_id,
+        "calls": calls,
+        "stages": summarize_llm_calls(calls)
+    }
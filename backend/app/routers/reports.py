@@ -1,19 +1,71 @@
 import os
 import uuid
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from typing import Optional
+import base64
+import binascii
+from datetime import datetime
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Query, Request
+from typing import Optional, List
 from services.openai_service import openai_service
-from services.supabase_service import supabase_service
-from services.analysis_service import analysis_service
-from models.schemas import (
-    ReportUploadResponse, AnalysisResponse, TestStatus, TestResult, ReferenceRange, Severity
+from services.supabase_service import (
+    supabase_service, REPORT_FIELDS, REPORT_LIST_FIELDS, TEST_RESULT_FIELDS
 )
+from services.analysis_service import analysis_service
+from services.storage_service import blob_store, UploadRejected
+from services.executor_service import ExecutorBusy
+from services.llm_service import LLMUnavailable
+from services.admission_service import AdmissionRejected, BULK, set_llm_caller, set_llm_caller_for_request
+from services.token_service import set_llm_report
+from services.pipeline_service import analyze_for_upload, analysis_response, reanalyze_report
+from models.schemas import ReportUploadResponse, AnalysisResponse
+from responses import FastJSONResponse, not_modified_response, report_json_response
 
 router = APIRouter()
 
+# Upper bound for N-way comparisons across a patient's latest reports
+MAX_COMPARE_REPORTS = 12
+
+# Sections the dashboard bundle can return
+BUNDLE_FIELDS = ("analysis", "insights", "chart_data")
+
+# Long per-test texts the history view does not display
+HISTORY_TEXT_FIELDS = ("explanation", "alert_message")
+
+SERVER_BUSY_DETAIL = "Server is busy processing other reports, please try again shortly"
+AI_UNAVAILABLE_DETAIL = "AI analysis is temporarily unavailable, please try again shortly"
+
+
+def encode_sync_cursor(high_water: datetime) -> str:
+    """Opaque cursor for the delta sync endpoint"""
+    return base64.urlsafe_b64encode(high_water.isoformat().encode()).decode().rstrip("=")
+
+
+def decode_sync_cursor(cursor: Optional[str]) -> Optional[datetime]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return datetime.fromisoformat(base64.urlsafe_b64decode(padded).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: tuple) -> Optional[List[str]]:
+    """Parse a comma-separated fields= parameter, rejecting unknown names"""
+    if not fields:
+        return None
+    selected = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(allowed)}"
+        )
+    return selected or None
+
 
 @router.post("/upload", response_model=AnalysisResponse)
 async def upload_and_analyze_report(
+    request: Request,
     file: UploadFile = File(...),
     user_id: Optional[str] = Form(default=None),
     save_to_db: Optional[str] = Form(default="false"),
@@ -34,20 +86,24 @@ async def upload_and_analyze_report(
     # Determine if we should save to database
     should_save = save_to_db.lower() == "true" and user_id
     
+    # LLM rate limits apply per client address (user_id only decides whose report is saved)
+    set_llm_caller_for_request(request)
+    
+    # Stream to a temp file in chunks: checks type and size without holding the file in memory
+    try:
+        upload = await blob_store.spool(file.file, declared_type=file.content_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ExecutorBusy:
+        raise HTTPException(status_code=503, detail=SERVER_BUSY_DETAIL, headers={"Retry-After": "10"})
+    
     try:
-        # Read file content
-        file_bytes = await file.read()
-        
         report_id = str(uuid.uuid4())
         
         # Only save to DB if user is authenticated
         if should_save:
             # Upload file
-            file_url = await supabase_service.upload_file(
-                file_bytes,
-                file.filename,
-                file.content_type
-            )
+            file_url = await supabase_service.store_upload(upload, file.filename)
             
             # Create report record with report_date
             report = await supabase_service.create_report(
@@ -64,61 +120,79 @@ async def upload_and_analyze_report(
         else:
             print(f"ℹ Anonymous analysis - report will NOT be saved to database")
         
-        # Step 1: Extract data from PDF using AI
-        extracted_data = await openai_service.extract_report_data(
-            file_bytes=file_bytes,
-            file_type=file.content_type
-        )
-        
-        # Step 2: Classify values and assign severity
-        classified_tests = await openai_service.classify_values(extracted_data.tests)
+        # Token usage of this upload's LLM calls is tallied under the report
+        set_llm_report(report_id)
         
-        # Step 3: Enrich with explanations for abnormal values
-        enriched_tests = await analysis_service.enrich_with_explanations(classified_tests)
+        # Step 1: Extract text from the PDF or image (PyPDF2, OCR fallback)
+        artifact = await openai_service.read_report_text(
+            file_path=upload.path,
+            file_type=upload.content_type
+        )
         
-        # Step 4: Generate overall summary
-        summary_data = await openai_service.generate_summary(enriched_tests)
+        # Keep the extracted text before the LLM runs, so the report can be
+        # re-analyzed without OCR even if the extraction below fails
+        saved_artifact = None
+        if should_save:
+            saved_artifact = await supabase_service.save_extraction_artifact(report_id, artifact)
         
-        # Calculate health score
-        health_score = summary_data.get("health_score", analysis_service.calculate_health_score(enriched_tests))
-        overall_status = analysis_service.get_overall_status(enriched_tests)
+        # Structured data from the text using AI
+        extracted_data, llm_fields = await openai_service.extract_from_text(artifact["cleaned_text"])
+        if saved_artifact:
+            await supabase_service.update_extraction_artifact(saved_artifact["id"], llm_fields)
         
-        # Only save results if user is authenticated
+        # Steps 2-4: Classify, explain and summarize (within the upload's latency budget);
+        # results are only saved if user is authenticated
+        analysis = await analyze_for_upload(report_id, extracted_data, save=should_save)
         if should_save:
-            # Save test results to database
-            await supabase_service.save_test_results(report_id, enriched_tests)
-            
-            # Update report with patient info and health score
-            patient_name = extracted_data.patient_info.name if extracted_data.patient_info else None
-            patient_age = extracted_data.patient_info.age if extracted_data.patient_info else None
-            patient_gender = extracted_data.patient_info.gender if extracted_data.patient_info else None
-            
-            await supabase_service.update_report(report_id, {
-                "status": "completed",
-                "patient_name": patient_name,
-                "patient_age": patient_age,
-                "patient_gender": patient_gender,
-                "health_score": health_score,
-                "summary": summary_data.get("summary")
-            })
             print(f"✓ Report {report_id} analysis saved to database")
         
-        return AnalysisResponse(
-            report_id=report_id,
-            patient_info=extracted_data.patient_info,
-            tests=enriched_tests,
-            health_score=health_score,
-            summary=summary_data.get("summary"),
-            overall_status=overall_status
-        )
+        return analysis_response(report_id, extracted_data, analysis)
         
+    except ExecutorBusy:
+        raise HTTPException(status_code=503, detail=SERVER_BUSY_DETAIL, headers={"Retry-After": "10"})
+    except LLMUnavailable as e:
+        print(f"Error processing report: {e}")
+        raise HTTPException(status_code=503, detail=AI_UNAVAILABLE_DETAIL, headers={"Retry-After": "30"})
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error processing report: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.close()
+
+
+@router.get("/compare")
+async def compare_reports(report_ids: List[str] = Query(...)):
+    """
+    Compare test results across two or more reports, in the order given
+    (the first is "before", the last is "after")
+    """
+    report_ids = list(dict.fromkeys(report_ids))
+    if len(report_ids) < 2:
+        raise HTTPException(status_code=400, detail="At least two report_ids are required")
+    if len(report_ids) > MAX_COMPARE_REPORTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARE_REPORTS} reports can be compared")
+    
+    try:
+        data = await supabase_service.get_comparison_rows(report_ids=report_ids)
+        if len(data["reports"]) < len(report_ids):
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        return {
+            "reports": data["reports"],
+            "comparison": analysis_service.build_comparison(data["reports"], data["rows"])
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error comparing reports: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/{report_id}", response_model=AnalysisResponse)
-async def get_report(report_id: str):
+async def get_report(report_id: str, request: Request):
     """
     Get a previously analyzed report by ID
     """
@@ -128,37 +202,15 @@ async def get_report(report_id: str):
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
+        not_modified = not_modified_response(request, report, "analysis")
+        if not_modified:
+            return not_modified
+        
         # Get test results
         test_results = await supabase_service.get_test_results(report_id)
         
-        tests = []
-        for tr in test_results:
-            ref_range = None
-            if tr.get("reference_min") or tr.get("reference_max"):
-                ref_range = ReferenceRange(
-                    min=tr.get("reference_min"),
-                    max=tr.get("reference_max")
-                )
-            
-            tests.append(TestResult(
-                test_name=tr["test_name"],
-                observed_value=tr["observed_value"],
-                unit=tr.get("unit"),
-                reference_range=ref_range,
-                status=TestStatus(tr["status"]) if tr.get("status") else None,
-                severity=Severity(tr["severity"]) if tr.get("severity") else None,
-                explanation=tr.get("explanation"),
-                alert_message=tr.get("alert_message")
-            ))
-        
-        return AnalysisResponse(
-            report_id=report_id,
-            patient_info=None,
-            tests=tests,
-            health_score=report.get("health_score"),
-            summary=report.get("summary"),
-            overall_status=report.get("status", "completed")
-        )
+        analysis = analysis_service.build_analysis(report_id, report, test_results)
+        return report_json_response(analysis, report, "analysis")
         
     except HTTPException:
         raise
@@ -167,22 +219,178 @@ async def get_report(report_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{report_id}/bundle")
+async def get_report_bundle(report_id: str, request: Request, fields: Optional[str] = None):
+    """
+    Get the analysis, insights and chart data of a report in one request.
+    Use fields=analysis,insights,chart_data to select sections (default: all).
+    """
+    selected = parse_fields(fields, BUNDLE_FIELDS) or list(BUNDLE_FIELDS)
+    
+    try:
+        variant = "bundle:" + ",".join(sorted(selected))
+        report = await supabase_service.get_report(report_id)
+        
+        if not report:
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        not_modified = not_modified_response(request, report, variant)
+        if not_modified:
+            return not_modified
+        
+        # Reuses the report row loaded above; only the test results are read
+        bundle = await supabase_service.get_report_bundle(report_id, report=report)
+        
+        if not bundle:
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        report = bundle["report"]
+        test_results = bundle["test_results"]
+        has_results = bool(report.get("total_tests"))
+        
+        response = {"report_id": report_id}
+        if "analysis" in selected:
+            response["analysis"] = analysis_service.build_analysis(report_id, report, test_results)
+        if "insights" in selected:
+            abnormal_tests = [t for t in test_results if t.get("status") in ["LOW", "HIGH"]]
+            response["insights"] = analysis_service.build_insights(report_id, report, abnormal_tests) if has_results else None
+        if "chart_data" in selected:
+            response["chart_data"] = analysis_service.build_chart_data(report, test_results) if has_results else None
+        
+        return report_json_response(response, report, variant)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting report bundle: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/{report_id}")
+async def delete_report(report_id: str):
+    """
+    Delete a report and its test results
+    """
+    try:
+        success = await supabase_service.delete_report(report_id)
+        if not success:
+            raise HTTPException(status_code=404, detail="Report not found")
+        
+        return {"success": True}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error deleting report: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{report_id}/reanalyze", response_model=AnalysisResponse)
+async def reanalyze(report_id: str, reuse_extraction: bool = False):
+    """
+    Re-analyze a saved report from its stored extraction (no PDF parsing or OCR).
+    The LLM extraction is re-run with the current prompt unless reuse_extraction=true,
+    in which case only classification, explanations and summary are redone.
+    """
+    try:
+        # Re-analysis is batch work: it shares one rate limit and yields to interactive requests
+        set_llm_caller("reanalysis", BULK)
+        result = await reanalyze_report(report_id, reuse_extraction=reuse_extraction)
+        if result is None:
+            raise HTTPException(status_code=404, detail="No stored extraction for this report")
+        return result
+        
+    except HTTPException:
+        raise
+    except LLMUnavailable:
+        raise HTTPException(status_code=503, detail=AI_UNAVAILABLE_DETAIL, headers={"Retry-After": "30"})
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"Error re-analyzing report: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/user/{user_id}")
-async def get_user_reports(user_id: str):
+async def get_user_reports(user_id: str, fields: Optional[str] = None):
     """
-    Get all reports for a specific user
+    Get all reports for a specific user.
+    Use fields=id,created_at,... to select only some columns.
     """
+    selected = parse_fields(fields, REPORT_FIELDS)
+    
     try:
-        reports = await supabase_service.get_user_reports(user_id)
-        return {"reports": reports}
+        reports = await supabase_service.get_user_reports(user_id, fields=selected)
+        return FastJSONResponse({"reports": reports})
         
     except Exception as e:
         print(f"Error getting user reports: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/user/{user_id}/compare")
+async def compare_latest_reports(user_id: str, last: int = Query(default=2, ge=2, le=MAX_COMPARE_REPORTS)):
+    """
+    Compare test results across a user's last K reports (oldest to newest)
+    """
+    try:
+        data = await supabase_service.get_comparison_rows(user_id=user_id, last=last)
+        return {
+            "reports": data["reports"],
+            "comparison": analysis_service.build_comparison(data["reports"], data["rows"])
+        }
+        
+    except Exception as e:
+        print(f"Error comparing user reports: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/user/{user_id}/changes")
+async def get_user_changes(
+    user_id: str,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    test_fields: Optional[str] = None,
+    include_explanations: bool = False
+):
+    """
+    Delta sync: reports and test results created or updated since the cursor,
+    plus ids of deleted records. Omit the cursor for a full download; when
+    "reset" is true the client should replace its local copy. Pass the returned
+    cursor on the next call.
+    """
+    since = decode_sync_cursor(cursor)
+    report_fields = parse_fields(fields, REPORT_FIELDS) or list(REPORT_LIST_FIELDS)
+    for required in ("id", "updated_at"):
+        if required not in report_fields:
+            report_fields.append(required)
+    
+    selected_test_fields = parse_fields(test_fields, TEST_RESULT_FIELDS) or [
+        f for f in TEST_RESULT_FIELDS
+        if include_explanations or f not in HISTORY_TEXT_FIELDS
+    ]
+    for required in ("id", "report_id"):
+        if required not in selected_test_fields:
+            selected_test_fields.append(required)
+    
+    try:
+        changes = await supabase_service.get_changes(user_id, since, report_fields, selected_test_fields)
+        
+        return FastJSONResponse({
+            "cursor": encode_sync_cursor(changes["high_water"]),
+            "reset": changes["reset"],
+            "reports": changes["reports"],
+            "test_results": changes["test_results"],
+            "deleted": changes["deleted"]
+        })
+        
+    except Exception as e:
+        print(f"Error getting changes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/{report_id}/share")
-async def get_shareable_report(report_id: str):
+async def get_shareable_report(report_id: str, request: Request):
     """
     Get a shareable version of the report (public URL)
     """
@@ -192,9 +400,14 @@ async def get_shareable_report(report_id: str):
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
+        # Share payloads carry the patient's name and results: browser-cached only, revalidated with the ETag
+        not_modified = not_modified_response(request, report, "share", shared=True)
+        if not_modified:
+            return not_modified
+        
         test_results = await supabase_service.get_test_results(report_id)
         
-        return {
+        return report_json_response({
             "report_id": report_id,
             "patient_name": report.get("patient_name"),
             "health_score": report.get("health_score"),
@@ -210,7 +423,7 @@ async def get_shareable_report(report_id: str):
                 }
                 for t in test_results
             ]
-        }
+        }, report, "share", shared=True)
         
     except HTTPException:
         raise
@@ -220,13 +433,25 @@ async def get_shareable_report(report_id: str):
 
 
 @router.get("/{report_id}/tests")
-async def get_report_tests(report_id: str):
+async def get_report_tests(report_id: str, request: Request, fields: Optional[str] = None):
     """
-    Get all test results for a specific report
+    Get all test results for a specific report.
+    Use fields=test_name,observed_value,... to select only some columns.
     """
+    selected = parse_fields(fields, TEST_RESULT_FIELDS)
+    variant = "tests:" + ",".join(selected) if selected else "tests"
+    
     try:
-        test_results = await supabase_service.get_test_results(report_id)
-        return {"tests": test_results}
+        report = await supabase_service.get_report(report_id)
+        if not report:
+            return {"tests": []}
+        
+        not_modified = not_modified_response(request, report, variant)
+        if not_modified:
+            return not_modified
+        
+        test_results = await supabase_service.get_test_results(report_id, fields=selected)
+        return report_json_response({"tests": test_results}, report, variant)
         
     except Exception as e:
         print(f"Error getting test results: {e}")
@@ -234,23 +459,42 @@ async def get_report_tests(report_id: str):
 
 
 @router.get("/user/{user_id}/history")
-async def get_user_history(user_id: str):
+async def get_user_history(
+    user_id: str,
+    fields: Optional[str] = None,
+    test_fields: Optional[str] = None,
+    include_explanations: bool = False
+):
     """
-    Get all reports with test results for history tracking
+    Get all reports with test results for history tracking.
+    fields / test_fields select report and test result columns. By default
+    explanation and alert texts are not loaded unless include_explanations=true.
     """
+    report_fields = parse_fields(fields, REPORT_FIELDS)
+    if report_fields and "id" not in report_fields:
+        report_fields.insert(0, "id")
+    
+    selected_test_fields = parse_fields(test_fields, TEST_RESULT_FIELDS)
+    if not selected_test_fields:
+        selected_test_fields = [
+            f for f in TEST_RESULT_FIELDS
+            if include_explanations or f not in HISTORY_TEXT_FIELDS
+        ]
+    
     try:
-        reports = await supabase_service.get_user_reports(user_id)
-        
-        # Enrich with test results
-        result = []
-        for report in reports:
-            test_results = await supabase_service.get_test_results(report.get("id"))
-            result.append({
-                **report,
-                "test_results": test_results
-            })
-        
-        return {"reports": result}
+        reports = await supabase_service.get_user_reports(user_id, fields=report_fields)
+        
+        # Enrich with test results (loaded for all reports at once)
+        test_results = await supabase_service.get_test_results_for_reports(
+            [report["id"] for report in reports],
+            fields=selected_test_fields
+        )
+        result = [
+            {**report, "test_results": test_results[report["id"]]}
+            for report in reports
+        ]
+        
+        return FastJSONResponse({"reports": result})
         
     except Exception as e:
         print(f"Error getting user history: {e}")
@@ -0,0 +1,230 @@
+"""
+Admission Service
+Rate limiting and fair scheduling in front of the LLM: a global token bucket
+(our upstream quota), a token bucket per user, and a priority queue that
+serves interactive requests before bulk and background work. Calls beyond
+the queue limits are shed with AdmissionRejected (HTTP 429 + Retry-After).
+"""
+
+import os
+import math
+import time
+import asyncio
+import itertools
+import threading
+import contextvars
+from typing import Optional
+
+# Priorities (lower is served first)
+INTERACTIVE = 0   # uploads and questions a user is waiting on
+BULK = 1          # re-analysis and batch jobs
+BACKGROUND = 2    # backfills nobody is waiting on
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk", BACKGROUND: "background"}
+
+class LLMCaller:
+    """Who the LLM calls of a request or task are made for (priority may change while queued)"""
+    __slots__ = ("user_id", "priority")
+
+    def __init__(self, user_id: Optional[str], priority: int = INTERACTIVE):
+        self.user_id = user_id or "anonymous"
+        self.priority = priority
+
+
+_caller = contextvars.ContextVar("llm_caller", default=LLMCaller(None))
+
+
+class AdmissionRejected(Exception):
+    """The LLM queues are full for this caller; retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def set_llm_caller(user_id: Optional[str], priority: int = INTERACTIVE) -> LLMCaller:
+    """Attribute the LLM calls of the current request (or task) to a user and priority"""
+    caller = LLMCaller(user_id, priority)
+    _caller.set(caller)
+    return caller
+
+
+def set_llm_caller_for_request(request, priority: int = INTERACTIVE) -> LLMCaller:
+    """
+    Attribute the LLM calls of an HTTP request to its client address. User ids
+    sent in the body or form are not authenticated; keying the rate limits on
+    them would let a client get a fresh bucket by sending a new id each call.
+    """
+    return set_llm_caller(request.client.host if request.client else None, priority)
+
+
+def current_llm_caller() -> LLMCaller:
+    return _caller.get()
+
+
+async def run_as_llm_caller(caller: LLMCaller, awaitable):
+    """Await in a task whose LLM calls are attributed to caller"""
+    _caller.set(caller)
+    return await awaitable
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self) -> float:
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("caller", "seq", "future", "enqueued")
+
+    def __init__(self, caller: LLMCaller, seq: int, future: asyncio.Future):
+        self.caller = caller
+        self.seq = seq
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Grants one token per upstream LLM call. Waiters are served in priority
+    order (FIFO within a priority); a waiter whose user has no token left is
+    skipped so that one user's backlog cannot hold up everyone else.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(
+            rate=float(os.getenv("LLM_GLOBAL_RATE", "10")),
+            capacity=float(os.getenv("LLM_GLOBAL_BURST", "20"))
+        )
+        self.user_rate = float(os.getenv("LLM_USER_RATE", "1"))
+        self.user_burst = float(os.getenv("LLM_USER_BURST", "10"))
+        self.max_queue = {
+            INTERACTIVE: int(os.getenv("LLM_QUEUE_MAX_INTERACTIVE", "200")),
+            BULK: int(os.getenv("LLM_QUEUE_MAX_BULK", "100")),
+            BACKGROUND: int(os.getenv("LLM_QUEUE_MAX_BACKGROUND", "100"))
+        }
+        self.max_user_queue = int(os.getenv("LLM_USER_QUEUE_MAX", "30"))
+        self._user_buckets = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._counters = {
+            name: {"admitted": 0, "rejected": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    async def acquire(self, timeout: float):
+        """Wait for a call slot for the current caller (at most timeout seconds)"""
+        caller = _caller.get()
+        name = PRIORITY_NAMES[caller.priority]
+
+        queued = sum(1 for w in self._waiters if w.caller.priority == caller.priority)
+        user_queued = sum(1 for w in self._waiters if w.caller.user_id == caller.user_id)
+        if queued >= self.max_queue[caller.priority] or user_queued >= self.max_user_queue:
+            self._count(name, "rejected")
+            limited_by_user = user_queued >= self.max_user_queue
+            retry_after = (user_queued / self.user_rate) if limited_by_user else (queued / self.global_bucket.rate)
+            raise AdmissionRejected(
+                "Too many AI requests " + ("from this user" if limited_by_user else "in progress"),
+                retry_after=max(1, math.ceil(retry_after))
+            )
+
+        waiter = _Waiter(caller, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                self._count(name, "rejected")
+                raise AdmissionRejected("Timed out waiting for an AI request slot", retry_after=max(1, math.ceil(timeout)))
+        finally:
+            if not waiter.future.done():
+                self._waiters.remove(waiter)
+
+        wait_ms = (time.monotonic() - waiter.enqueued) * 1000
+        with self._lock:
+            counters = self._counters[name]
+            counters["admitted"] += 1
+            counters["total_wait_ms"] += wait_ms
+            counters["max_wait_ms"] = max(counters["max_wait_ms"], wait_ms)
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _dispatch(self):
+        """Hand out tokens to waiters in priority order, then sleep until the next refill"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        self.global_bucket.refill(now)
+
+        next_refill = None
+        for waiter in sorted(self._waiters, key=lambda w: (w.caller.priority, w.seq)):
+            if self.global_bucket.tokens < 1:
+                next_refill = self.global_bucket.time_until_token()
+                break
+            bucket = self._user_bucket(waiter.caller.user_id)
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                wait = bucket.time_until_token()
+                next_refill = wait if next_refill is None else min(next_refill, wait)
+                continue
+            self.global_bucket.tokens -= 1
+            bucket.tokens -= 1
+            self._waiters.remove(waiter)
+            waiter.future.set_result(None)
+
+        if self._waiters and next_refill is not None:
+            self._timer = asyncio.get_running_loop().call_later(next_refill, self._dispatch)
+
+        # Forget users whose bucket has refilled and who have nothing queued
+        if len(self._user_buckets) > 1000:
+            waiting = {w.caller.user_id for w in self._waiters}
+            for user_id, bucket in list(self._user_buckets.items()):
+                bucket.refill(now)
+                if user_id not in waiting and bucket.tokens >= bucket.capacity:
+                    del self._user_buckets[user_id]
+
+    def _count(self, name: str, counter: str):
+        with self._lock:
+            self._counters[name][counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            queues = {}
+            for priority, name in PRIORITY_NAMES.items():
+                counters = self._counters[name]
+                admitted = counters["admitted"]
+                queues[name] = {
+                    "queued": sum(1 for w in self._waiters if w.caller.priority == priority),
+                    "max_queue": self.max_queue[priority],
+                    "admitted": admitted,
+                    "rejected": counters["rejected"],
+                    "avg_wait_ms": round(counters["total_wait_ms"] / admitted, 1) if admitted else 0.0,
+                    "max_wait_ms": round(counters["max_wait_ms"], 1)
+                }
+            return {
+                "global_rate": self.global_bucket.rate,
+                "global_tokens": round(self.global_bucket.tokens, 2),
+                "user_rate": self.user_rate,
+                "users_tracked": len(self._user_buckets),
+                "queues": queues
+            }
+
+
+llm_scheduler = LLMScheduler()
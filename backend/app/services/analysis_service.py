@@ -3,11 +3,37 @@ Analysis Service
 Business logic for analyzing medical report data
 """
 
-from typing import List
-from models.schemas import TestResult, TestStatus, Severity
+import re
+from typing import List, Optional
+from models.schemas import AnalysisResponse, TestResult, TestStatus, Severity, ReferenceRange
 from services.openai_service import openai_service
 
 
+NUMERIC_PREFIX = re.compile(r"^\s*[-+]?(\d+(\.\d*)?|\.\d+)")
+
+# Changes smaller than this percentage are reported as "stable"
+STABLE_CHANGE_PERCENT = 5
+
+ABNORMAL_RECOMMENDATIONS = [
+    "Review any abnormal values with your healthcare provider",
+    "Consider scheduling a follow-up appointment if multiple values are abnormal",
+    "Maintain a healthy lifestyle with regular exercise and balanced nutrition"
+]
+
+NORMAL_RECOMMENDATIONS = [
+    "Your test results look good! Continue maintaining your healthy lifestyle",
+    "Schedule regular check-ups to monitor your health"
+]
+
+
+def parse_numeric_value(value: Optional[str]) -> Optional[float]:
+    """Parse the leading number of an observed value ("5.4 mg/dL" -> 5.4)"""
+    if not value:
+        return None
+    match = NUMERIC_PREFIX.match(value)
+    return float(match.group()) if match else None
+
+
 class AnalysisService:
     @staticmethod
     def calculate_health_score(tests: List[TestResult]) -> int:
@@ -86,6 +112,184 @@ class AnalysisService:
         """
         return [t for t in tests if t.status in [TestStatus.LOW, TestStatus.HIGH]]
     
+    @staticmethod
+    def compare_values(before: Optional[dict], after: Optional[dict]) -> tuple:
+        """
+        Compare two observations of the same test.
+        Returns (change, percent_change) where change is improved/worsened/stable/new/removed
+        """
+        if not before:
+            return "new", 0.0
+        if not after:
+            return "removed", 0.0
+        
+        before_value = parse_numeric_value(before.get("observed_value"))
+        after_value = parse_numeric_value(after.get("observed_value"))
+        if before_value is None or after_value is None or before_value == 0:
+            return "stable", 0.0
+        
+        percent_change = round((after_value - before_value) / before_value * 100, 2)
+        before_normal = before.get("status") == TestStatus.NORMAL.value
+        after_normal = after.get("status") == TestStatus.NORMAL.value
+        
+        # Simplified: lower is assumed better for abnormal values
+        if abs(percent_change) < STABLE_CHANGE_PERCENT:
+            change = "stable"
+        elif after_normal and not before_normal:
+            change = "improved"
+        elif not after_normal and before_normal:
+            change = "worsened"
+        elif percent_change < 0 and not before_normal:
+            change = "improved"
+        elif percent_change > 0 and not before_normal:
+            change = "worsened"
+        else:
+            change = "stable"
+        
+        return change, percent_change
+    
+    @classmethod
+    def build_comparison(cls, reports: List[dict], rows: List[dict]) -> List[dict]:
+        """
+        Pivot joined test rows (sorted by canonical name, then report date) into
+        one entry per test with its value in every report, consecutive deltas and
+        the overall change from the oldest to the newest report.
+        """
+        report_ids = [r["id"] for r in reports]
+        position = {report_id: i for i, report_id in enumerate(report_ids)}
+        
+        grouped = {}
+        for row in rows:
+            values = grouped.setdefault(row["canonical_name"], [None] * len(report_ids))
+            i = position.get(row["report_id"])
+            if i is not None and values[i] is None:
+                values[i] = row
+        
+        comparison = []
+        for values in grouped.values():
+            present = [v for v in values if v]
+            deltas = []
+            for i in range(1, len(values)):
+                change, percent_change = cls.compare_values(values[i - 1], values[i])
+                deltas.append({
+                    "from_report_id": report_ids[i - 1],
+                    "to_report_id": report_ids[i],
+                    "change": change,
+                    "percent_change": percent_change
+                })
+            
+            before, after = values[0], values[-1]
+            change, percent_change = cls.compare_values(before, after)
+            comparison.append({
+                "test_name": present[-1]["test_name"].strip(),
+                "unit": present[-1]["unit"],
+                "before": {
+                    "value": before["observed_value"] if before else "-",
+                    "status": (before["status"] or "") if before else ""
+                },
+                "after": {
+                    "value": after["observed_value"] if after else "-",
+                    "status": (after["status"] or "") if after else ""
+                },
+                "change": change,
+                "percent_change": percent_change,
+                "values": [
+                    {"value": v["observed_value"], "status": v["status"]} if v else None
+                    for v in values
+                ],
+                "deltas": deltas
+            })
+        
+        return comparison
+    
+    @staticmethod
+    def build_analysis(report_id: str, report: dict, test_results: List[dict]) -> AnalysisResponse:
+        """
+        Build the analysis response of a stored report from its test result rows
+        """
+        tests = []
+        for tr in test_results:
+            ref_range = None
+            if tr.get("reference_min") or tr.get("reference_max"):
+                ref_range = ReferenceRange(
+                    min=tr.get("reference_min"),
+                    max=tr.get("reference_max")
+                )
+            
+            tests.append(TestResult(
+                test_name=tr["test_name"],
+                observed_value=tr["observed_value"],
+                unit=tr.get("unit"),
+                reference_range=ref_range,
+                status=TestStatus(tr["status"]) if tr.get("status") else None,
+                severity=Severity(tr["severity"]) if tr.get("severity") else None,
+                explanation=tr.get("explanation"),
+                alert_message=tr.get("alert_message")
+            ))
+        
+        return AnalysisResponse(
+            report_id=report_id,
+            patient_info=None,
+            tests=tests,
+            health_score=report.get("health_score"),
+            summary=report.get("summary"),
+            overall_status=report.get("status", "completed")
+        )
+    
+    @staticmethod
+    def build_insights(report_id: str, report: dict, abnormal_tests: List[dict]) -> dict:
+        """
+        Build report insights from the aggregates stored on the report row
+        """
+        total = report["total_tests"]
+        normal_count = report["normal_count"]
+        abnormal_count = report["abnormal_count"]
+        
+        return {
+            "report_id": report_id,
+            "statistics": {
+                "total_tests": total,
+                "normal_count": normal_count,
+                "abnormal_count": abnormal_count,
+                "critical_count": report["critical_count"],
+                "health_score": int((normal_count / total) * 100) if total > 0 else 0
+            },
+            "abnormal_tests": abnormal_tests,
+            "recommendations": ABNORMAL_RECOMMENDATIONS if abnormal_count > 0 else NORMAL_RECOMMENDATIONS
+        }
+    
+    @staticmethod
+    def build_chart_data(report: dict, test_results: List[dict]) -> dict:
+        """
+        Build chart data: distributions from the stored aggregates, one bar per test
+        """
+        status_counts = {"NORMAL": 0, "LOW": 0, "HIGH": 0, "UNKNOWN": 0, **report["status_counts"]}
+        severity_counts = {"green": 0, "yellow": 0, "red": 0, "gray": 0, **report["severity_counts"]}
+        
+        return {
+            "status_distribution": [
+                {"name": "Normal", "value": status_counts["NORMAL"], "color": "#10b981"},
+                {"name": "Low", "value": status_counts["LOW"], "color": "#f59e0b"},
+                {"name": "High", "value": status_counts["HIGH"], "color": "#ef4444"},
+                {"name": "Unknown", "value": status_counts["UNKNOWN"], "color": "#6b7280"}
+            ],
+            "severity_distribution": [
+                {"name": "Healthy", "value": severity_counts["green"], "color": "#10b981"},
+                {"name": "Borderline", "value": severity_counts["yellow"], "color": "#f59e0b"},
+                {"name": "Needs Attention", "value": severity_counts["red"], "color": "#ef4444"},
+                {"name": "Unknown", "value": severity_counts["gray"], "color": "#6b7280"}
+            ],
+            "test_results": [
+                {
+                    "name": t["test_name"][:20],
+                    "value": float(t["observed_value"]) if t["observed_value"].replace(".", "").replace("-", "").isdigit() else 0,
+                    "status": t.get("status", "UNKNOWN"),
+                    "severity": t.get("severity", "gray")
+                }
+                for t in test_results
+            ]
+        }
+    
     async def enrich_with_explanations(self, tests: List[TestResult]) -> List[TestResult]:
         """
         Add AI-generated explanations and alerts to abnormal tests
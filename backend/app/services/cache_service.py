@@ -0,0 +1,190 @@
+"""
+Cache Service
+Size-bounded in-process LRU cache for serialized report payloads,
+optionally backed by a shared Redis store
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class ReportCache:
+    """
+    Read-through cache keyed by "<kind>:<report_id>".
+    Values are stored as JSON strings so every hit returns a fresh copy.
+
+    With a shared backend, local entries expire after local_ttl seconds so
+    invalidations made by other workers are picked up quickly. Shared entries
+    expire after shared_ttl seconds, and every report has a shared generation
+    counter that invalidation increments: a value loaded before an
+    invalidation (in any worker) is never written to the shared store.
+    """
+
+    KINDS = ("report", "tests")
+
+    # Generation counters outlive the entries they guard
+    GENERATION_TTL = 86400
+
+    def __init__(self, max_entries: int = 1000, shared_url: Optional[str] = None, local_ttl: Optional[float] = None,
+                 shared_ttl: int = 300):
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._shared = None
+        self._counters = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "skipped_stale_writes": 0
+        }
+
+        if shared_url:
+            try:
+                import redis
+                self._shared = redis.Redis.from_url(shared_url)
+                print("✓ Report cache using shared Redis backend")
+            except ImportError:
+                print("⚠️  redis package not installed, report cache is process-local only")
+
+    @staticmethod
+    def key(kind: str, report_id: str) -> str:
+        return f"{kind}:{report_id}"
+
+    @staticmethod
+    def generation_key(report_id: str) -> str:
+        return f"gen:{report_id}"
+
+    def begin_read(self, report_id: str) -> tuple:
+        """
+        Token to pass to set() after loading a report's data from the database.
+        If the report is invalidated in between (by any worker), the loaded value is not cached.
+        """
+        generation = None
+        if self._shared is not None:
+            try:
+                generation = self._shared.get(self.generation_key(report_id))
+            except Exception as e:
+                print(f"Report cache shared get error: {e}")
+        return report_id, self._epoch, generation
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, stored_at = entry
+                if self.local_ttl is None or time.monotonic() - stored_at < self.local_ttl:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return json.loads(payload)
+                del self._entries[key]
+
+        if self._shared is not None:
+            try:
+                payload = self._shared.get(key)
+            except Exception as e:
+                print(f"Report cache shared get error: {e}")
+                payload = None
+            if payload is not None:
+                with self._lock:
+                    self._counters["shared_hits"] += 1
+                    self._store_local(key, payload)
+                return json.loads(payload)
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any, token: tuple):
+        report_id, epoch, generation = token
+        payload = json.dumps(value)
+        with self._lock:
+            if epoch != self._epoch:
+                self._counters["skipped_stale_writes"] += 1
+                return
+            self._store_local(key, payload)
+
+        if self._shared is not None:
+            self._set_shared(key, payload, report_id, generation)
+
+    def _set_shared(self, key: str, payload: str, report_id: str, generation):
+        """Write only if the report's generation is unchanged since the read began"""
+        import redis
+        generation_key = self.generation_key(report_id)
+        try:
+            with self._shared.pipeline() as pipe:
+                pipe.watch(generation_key)
+                if pipe.get(generation_key) != generation:
+                    raise redis.WatchError()
+                pipe.multi()
+                pipe.set(key, payload, ex=self.shared_ttl)
+                pipe.execute()
+        except redis.WatchError:
+            # Invalidated by some worker after this value was loaded
+            with self._lock:
+                self._counters["skipped_stale_writes"] += 1
+                self._entries.pop(key, None)
+        except Exception as e:
+            print(f"Report cache shared set error: {e}")
+
+    def invalidate_report(self, report_id: str):
+        """Drop every cached payload of a report"""
+        keys = [self.key(kind, report_id) for kind in self.KINDS]
+        with self._lock:
+            self._epoch += 1
+            self._counters["invalidations"] += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+        if self._shared is not None:
+            try:
+                # Bump the generation first, so reads in flight elsewhere cannot re-cache old data
+                generation_key = self.generation_key(report_id)
+                with self._shared.pipeline() as pipe:
+                    pipe.incr(generation_key)
+                    pipe.expire(generation_key, self.GENERATION_TTL)
+                    pipe.delete(*keys)
+                    pipe.execute()
+            except Exception as e:
+                print(f"Report cache shared delete error: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["shared_hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": round((lookups - self._counters["misses"]) / lookups, 4) if lookups else 0.0,
+                "shared_backend": self._shared is not None
+            }
+
+    def _store_local(self, key: str, payload):
+        """Insert into the LRU (caller holds the lock)"""
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        self._entries[key] = (payload, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+
+def create_report_cache() -> ReportCache:
+    """Build the report cache from environment settings"""
+    shared_url = os.getenv("REPORT_CACHE_REDIS_URL")
+    local_ttl = os.getenv("REPORT_CACHE_LOCAL_TTL")
+    return ReportCache(
+        max_entries=int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1000")),
+        shared_url=shared_url,
+        local_ttl=float(local_ttl) if local_ttl else (5.0 if shared_url else None),
+        shared_ttl=int(os.getenv("REPORT_CACHE_SHARED_TTL", "300"))
+    )
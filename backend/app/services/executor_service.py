@@ -0,0 +1,161 @@
+"""
+Executor Service
+Bounded pools for work that must not run on the event loop:
+a process pool for CPU-bound stages (PDF parsing, OCR, text cleaning)
+and a thread pool for blocking I/O (file writes), with queue metrics
+"""
+
+import os
+import time
+import asyncio
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ExecutorBusy(Exception):
+    """The pool's queue is full; the caller should retry later"""
+
+
+def _preload_modules(modules: tuple):
+    """Worker initializer: import the job modules up front instead of on the first job"""
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _timed_job(fn, args, kwargs):
+    """Runs in the worker: returns the wall-clock start time along with the result"""
+    return time.time(), fn(*args, **kwargs)
+
+
+class ManagedExecutor:
+    """
+    A process or thread pool that admits at most max_workers + max_queue
+    jobs at once (further submissions raise ExecutorBusy) and tracks queue
+    depth, wait time (submitted → started) and run time.
+    """
+
+    def __init__(self, name: str, kind: str, max_workers: int, max_queue: int, preload: tuple = ()):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.preload = preload
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "total_run_ms": 0.0
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: workers must not inherit the parent's threads and DB connections
+                context = multiprocessing.get_context(os.getenv("CPU_POOL_START_METHOD", "spawn"))
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_preload_modules,
+                    initargs=(self.preload,)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool (fn and its arguments must be picklable for processes)"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._counters["rejected"] += 1
+                raise ExecutorBusy(f"{self.name} pool is at capacity")
+            self._in_flight += 1
+            executor = self._get_executor()
+
+        submitted = time.time()
+        started = None
+        try:
+            started, result = await asyncio.get_running_loop().run_in_executor(
+                executor, _timed_job, fn, args, kwargs
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OCR ran out of memory): start a fresh pool for the next job
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+        finally:
+            finished = time.time()
+            with self._lock:
+                self._in_flight -= 1
+                if started is None:
+                    self._counters["failed"] += 1
+                else:
+                    wait_ms = max(0.0, started - submitted) * 1000
+                    self._counters["completed"] += 1
+                    self._counters["total_wait_ms"] += wait_ms
+                    self._counters["max_wait_ms"] = max(self._counters["max_wait_ms"], wait_ms)
+                    self._counters["total_run_ms"] += (finished - started) * 1000
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self._counters["completed"]
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": max(0, self._in_flight - self.max_workers),
+                "completed": completed,
+                "failed": self._counters["failed"],
+                "rejected": self._counters["rejected"],
+                "avg_wait_ms": round(self._counters["total_wait_ms"] / completed, 1) if completed else 0.0,
+                "max_wait_ms": round(self._counters["max_wait_ms"], 1),
+                "avg_run_ms": round(self._counters["total_run_ms"] / completed, 1) if completed else 0.0
+            }
+
+    async def warm_up(self):
+        """Start every worker now, so the first upload does not pay process start-up"""
+        if self.kind == "process":
+            await asyncio.gather(*[self.run(os.getpid) for _ in range(self.max_workers)])
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _create_cpu_executor() -> ManagedExecutor:
+    workers = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+    max_queue = int(os.getenv("CPU_POOL_MAX_QUEUE", "16"))
+    if workers <= 0:
+        # Process pool disabled: run CPU stages on threads instead
+        return ManagedExecutor("cpu", "thread", max(1, os.cpu_count() or 1), max_queue)
+    return ManagedExecutor("cpu", "process", workers, max_queue, preload=("services.extraction_service",))
+
+
+cpu_executor = _create_cpu_executor()
+io_executor = ManagedExecutor(
+    "io", "thread",
+    max_workers=int(os.getenv("IO_POOL_WORKERS", "8")),
+    max_queue=int(os.getenv("IO_POOL_MAX_QUEUE", "64"))
+)
+
+
+def executor_stats() -> dict:
+    return {"cpu": cpu_executor.stats(), "io": io_executor.stats()}
+
+
+def shutdown_executors():
+    cpu_executor.shutdown()
+    io_executor.shutdown()
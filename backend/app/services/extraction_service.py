@@ -0,0 +1,127 @@
+"""
+Extraction Service
+Text extraction stage of the report pipeline: PyPDF2 → Tesseract OCR (for
+scanned PDFs and photos) → cleaning. Runs in the CPU worker processes, so it
+must not import the database or LLM services.
+"""
+
+import re
+from io import BytesIO
+
+from services.ocr_service import extract_text_from_image, ocr_pdf_pages, ocr_stats
+
+
+# Bump when text extraction (PyPDF2/OCR/cleaning) changes, so stored artifacts can be told apart
+EXTRACTOR_VERSION = "2"
+
+
+def extract_pages_from_pdf(pdf_source) -> list[str]:
+    """Extract per-page text from digital PDF using PyPDF2 (pdf_source: file path or bytes)"""
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(pdf_source if isinstance(pdf_source, str) else BytesIO(pdf_source))
+        pages = [(page.extract_text() or "").strip() for page in reader.pages]
+        
+        print(f"✓ PyPDF2 extracted {sum(len(p) for p in pages)} characters")
+        return pages
+    except Exception as e:
+        print(f"✗ PyPDF2 extraction failed: {e}")
+        return []
+
+
+def extract_text_from_pdf(pdf_source) -> str:
+    """Extract text from digital PDF using PyPDF2 (pdf_source: file path or bytes)"""
+    return "\n".join(p for p in extract_pages_from_pdf(pdf_source) if p).strip()
+
+
+def extract_pages_with_ocr(pdf_source) -> list[str]:
+    """Extract per-page text from scanned PDF using Tesseract OCR (pdf_source: file path or bytes)"""
+    try:
+        print("⚡ Attempting OCR with Tesseract...")
+        
+        pages = ocr_pdf_pages(pdf_source)
+        
+        print(f"✓ OCR extracted {sum(len(p) for p in pages)} characters from {len(pages)} pages")
+        return pages
+        
+    except ImportError:
+        print("✗ Tesseract not installed. Install: sudo apt-get install tesseract-ocr")
+        return []
+    except Exception as e:
+        print(f"✗ OCR extraction failed: {e}")
+        return []
+
+
+def extract_text_with_ocr(pdf_source) -> str:
+    """Extract text from scanned PDF using Tesseract OCR (pdf_source: file path or bytes)"""
+    return "\n".join(extract_pages_with_ocr(pdf_source)).strip()
+
+
+def clean_medical_text(text: str) -> str:
+    """Clean and normalize extracted medical text"""
+    if not text:
+        return ""
+    
+    # Remove excessive whitespace
+    text = re.sub(r'\s+', ' ', text)
+    
+    # Remove common PDF artifacts
+    text = re.sub(r'Page \d+ of \d+', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\d{1,2}/\d{1,2}/\d{2,4}', lambda m: f" {m.group()} ", text)  # Preserve dates
+    
+    # Normalize units
+    text = text.replace('mg / dl', 'mg/dL')
+    text = text.replace('g / dl', 'g/dL')
+    text = text.replace('mg/dl', 'mg/dL')
+    text = text.replace('g/dl', 'g/dL')
+    
+    # Remove multiple spaces again after replacements
+    text = re.sub(r'\s+', ' ', text)
+    
+    return text.strip()
+
+
+def extract_report_text(source, file_type: str = "application/pdf") -> dict:
+    """
+    Text extraction stage: PyPDF2 → Tesseract OCR (fallback); images go straight to OCR.
+    Returns the extractor used, per-page text and the cleaned text.
+    """
+    print("\n=== TEXT EXTRACTION ===")
+    if file_type.startswith("image/"):
+        # Photos and scans: OCR the image directly
+        extractor = "image_ocr"
+        pages = [extract_text_from_image(source)]
+    else:
+        # STEP 1: Try PyPDF2 first (digital PDFs)
+        extractor = "pypdf"
+        pages = extract_pages_from_pdf(source)
+        
+        # STEP 2: Fallback to OCR if text is empty or too short
+        if len("\n".join(pages).strip()) < 100:
+            print("⚠️  Low text extracted, trying OCR fallback...")
+            extractor = "pdf_ocr"
+            pages = extract_pages_with_ocr(source)
+    
+    extracted_text = "\n".join(p for p in pages if p).strip()
+    if len(extracted_text) < 50:
+        raise Exception(
+            "Could not extract sufficient text from the report. "
+            "Ensure it's a text-based PDF or a sharp photo, and install Tesseract for OCR support."
+        )
+    
+    # STEP 3: Clean and normalize text
+    print("\n=== TEXT CLEANING ===")
+    cleaned_text = clean_medical_text(extracted_text)
+    print(f"✓ Cleaned text: {len(cleaned_text)} characters")
+    
+    return {
+        "extractor": extractor,
+        "extractor_version": EXTRACTOR_VERSION,
+        "pages": pages,
+        "cleaned_text": cleaned_text
+    }
+
+
+def extract_report_text_job(source, file_type: str) -> tuple:
+    """Worker-process entry point: the text extraction stage plus the OCR timings recorded in the worker"""
+    return extract_report_text(source, file_type), ocr_stats.drain()
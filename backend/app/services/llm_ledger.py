@@ -0,0 +1,130 @@
+"""
+LLM Call Ledger
+Records every LLM call (stage, model, latency, time to first token of
+streamed calls, tokens, retries, cache hit)
+in the llm_calls table, linked to the report it was made for. Records are
+buffered and written in batches so the ledger stays off the request path.
+"""
+
+import os
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: list, p: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize_llm_calls(calls: list) -> dict:
+    """Per-stage call counts, latency percentiles, retries and token totals of ledger records"""
+    by_stage = {}
+    for call in calls:
+        by_stage.setdefault(call["stage"], []).append(call)
+
+    stages = {}
+    for stage, stage_calls in sorted(by_stage.items()):
+        # Latency of calls that reached the model; shared (cache hit) calls only waited
+        latencies = sorted(
+            c["latency_ms"] for c in stage_calls
+            if c["latency_ms"] is not None and not c["cache_hit"]
+        )
+        summary = {
+            "calls": len(stage_calls),
+            "cache_hits": sum(1 for c in stage_calls if c["cache_hit"]),
+            "failed": sum(1 for c in stage_calls if c["outcome"] == "failed"),
+            "rejected": sum(1 for c in stage_calls if c["outcome"] == "rejected"),
+            "cancelled": sum(1 for c in stage_calls if c["outcome"] == "cancelled"),
+            "retries": sum(c["retries"] or 0 for c in stage_calls),
+            "prompt_tokens": sum(c["prompt_tokens"] or 0 for c in stage_calls),
+            "completion_tokens": sum(c["completion_tokens"] or 0 for c in stage_calls),
+            "models": sorted({c["model"] for c in stage_calls if c["model"]})
+        }
+        for p in PERCENTILES:
+            value = percentile(latencies, p)
+            summary[f"p{p}_ms"] = round(value, 1) if value is not None else None
+
+        # Streamed calls: time to first token is what the user waits for
+        first_tokens = sorted(c["first_token_ms"] for c in stage_calls if c.get("first_token_ms") is not None)
+        if first_tokens:
+            for p in PERCENTILES:
+                summary[f"first_token_p{p}_ms"] = round(percentile(first_tokens, p), 1)
+        stages[stage] = summary
+    return stages
+
+
+class LLMCallLedger:
+    """Buffers call records; flushes when a batch fills up or after a short interval"""
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_LEDGER", "true").lower() == "true"
+        self.batch_size = int(os.getenv("LLM_LEDGER_BATCH", "50"))
+        self.flush_interval = float(os.getenv("LLM_LEDGER_FLUSH_SECONDS", "5"))
+        self._pending = []
+        self._timer = None
+        self._timer_loop = None
+        self._flushes = set()
+        self.recorded = 0
+        self.written = 0
+
+    def record(self, stage: str, model: str, endpoint: str, outcome: str, latency_ms: float,
+               prompt_tokens: int = 0, completion_tokens: int = 0, retries: int = 0,
+               cache_hit: bool = False, report_id: Optional[str] = None,
+               first_token_ms: Optional[float] = None):
+        if not self.enabled:
+            return
+        self._pending.append({
+            "report_id": report_id,
+            "stage": stage,
+            "model": model,
+            "endpoint": endpoint,
+            "outcome": outcome,
+            "latency_ms": round(latency_ms, 1),
+            "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "created_at": datetime.utcnow()
+        })
+        self.recorded += 1
+
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._timer is None or self._timer_loop is not loop:
+            # (a timer left on another event loop, e.g. a finished script run, would never fire)
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+            self._timer_loop = loop
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """Write the buffered records (also called on shutdown)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Imported here, so importing the LLM services does not open the database
+            from services.supabase_service import supabase_service
+            self.written += await supabase_service.save_llm_calls(batch)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "written": self.written,
+            "pending": len(self._pending)
+        }
+
+
+llm_ledger = LLMCallLedger()
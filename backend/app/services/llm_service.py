@@ -0,0 +1,541 @@
+"""
+LLM Service
+Resilient chat-completion calls: per-stage deadlines, jittered exponential
+backoff retries, optional hedged duplicate requests and a circuit breaker.
+While the breaker is open calls fail fast with LLMUnavailable, so callers
+fall back to their local answers instead of waiting on a failing upstream.
+Concurrent identical requests share one upstream call (single flight).
+Each stage is routed to a model, max_tokens and deadline (and optionally a
+separate OpenAI-compatible endpoint) from a routing table.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from typing import Optional
+
+import openai
+
+from services.admission_service import llm_scheduler, AdmissionRejected
+from services.structured_output import STRUCTURED_OUTPUT_MODES
+from services.llm_ledger import llm_ledger
+from services.token_service import (
+    token_usage, current_llm_report, prompt_budget, count_tokens, count_message_tokens, truncate_to_tokens
+)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"  # Budget-friendly model
+
+# Per-stage defaults: completion size and total time budget (seconds, retries included)
+STAGE_DEFAULTS = {
+    "extract": {"max_tokens": 2000, "timeout": 45.0},
+    "classify": {"max_tokens": 2000, "timeout": 30.0},
+    "explain": {"max_tokens": 200, "timeout": 15.0},
+    "alert": {"max_tokens": 100, "timeout": 10.0},
+    "summary": {"max_tokens": 300, "timeout": 20.0},
+    "ask": {"max_tokens": 300, "timeout": 20.0},
+}
+DEFAULT_STAGE = {"max_tokens": 500, "timeout": 20.0}
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """The LLM could not answer (breaker open, deadline spent, retries exhausted or request rejected)"""
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class ModelRoute:
+    """Where and how one stage's calls are sent"""
+
+    def __init__(self, stage: str, model: str, max_tokens: int, timeout: float,
+                 base_url: Optional[str] = None, api_key_env: Optional[str] = None,
+                 structured_output: str = "json_object"):
+        if structured_output not in STRUCTURED_OUTPUT_MODES:
+            raise ValueError(f"Unknown structured output mode for {stage}: {structured_output}")
+        self.stage = stage
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.structured_output = structured_output
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.api_key_env = api_key_env
+
+    @property
+    def endpoint(self) -> str:
+        return self.base_url or "openai"
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.endpoint}"
+
+    def as_dict(self) -> dict:
+        return {
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "max_tokens": self.max_tokens,
+            "timeout_s": self.timeout,
+            "structured_output": self.structured_output
+        }
+
+
+def load_routes() -> dict:
+    """
+    Routing table: built-in stage defaults, then the JSON file in LLM_ROUTES_FILE
+    ({"default": {...}, "<stage>": {"model", "max_tokens", "timeout", "base_url", "api_key_env",
+    "structured_output"}}), then LLM_MODEL_<STAGE>, LLM_MAX_TOKENS_<STAGE>, LLM_DEADLINE_<STAGE>,
+    LLM_BASE_URL_<STAGE> and LLM_STRUCTURED_OUTPUT_<STAGE>
+    """
+    config = {}
+    routes_file = os.getenv("LLM_ROUTES_FILE")
+    if routes_file:
+        with open(routes_file) as f:
+            config = json.load(f)
+
+    routes = {}
+    for stage in [*STAGE_DEFAULTS, *(s for s in config if s not in STAGE_DEFAULTS and s != "default")]:
+        settings = {
+            "model": os.getenv("OPENAI_MODEL", DEFAULT_MODEL),
+            "structured_output": os.getenv("LLM_STRUCTURED_OUTPUT", "json_object"),
+            **STAGE_DEFAULTS.get(stage, DEFAULT_STAGE),
+            **config.get("default", {}),
+            **config.get(stage, {})
+        }
+        prefix = stage.upper()
+        routes[stage] = ModelRoute(
+            stage,
+            model=os.getenv(f"LLM_MODEL_{prefix}", settings["model"]),
+            max_tokens=int(os.getenv(f"LLM_MAX_TOKENS_{prefix}", settings["max_tokens"])),
+            timeout=_env_float(f"LLM_DEADLINE_{prefix}", float(settings["timeout"])),
+            base_url=os.getenv(f"LLM_BASE_URL_{prefix}", settings.get("base_url")),
+            api_key_env=settings.get("api_key_env"),
+            structured_output=os.getenv(f"LLM_STRUCTURED_OUTPUT_{prefix}", settings["structured_output"])
+        )
+    return routes
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive upstream failures; after
+    reset_timeout seconds a single trial call is let through (half-open)
+    and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = "half_open"
+                self._trial_in_flight = False
+            if self._state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._state == "open"
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._times_opened += 1
+                    print(f"⚠️  LLM circuit breaker opened after {self._consecutive_failures} failures")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self._times_opened,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout_s": self.reset_timeout
+            }
+
+
+class CallInfo:
+    """What one upstream call cost: retries and the tokens of the successful attempt"""
+    __slots__ = ("retries", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+class ResilientLLM:
+    """
+    Wraps an AsyncOpenAI client (created with max_retries=0; retries happen here).
+    chat(stage, **request) returns the completion or raises LLMUnavailable;
+    chat_stream(stage, **request) yields the completion's text as it arrives.
+    Routes with a base_url get their own client (and circuit breaker).
+    """
+
+    def __init__(self, client, routes: Optional[dict] = None):
+        self.client = client
+        self.routes = routes if routes is not None else load_routes()
+        self._clients = {}
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.backoff_base = _env_float("LLM_BACKOFF_BASE", 0.5)
+        self.backoff_cap = _env_float("LLM_BACKOFF_CAP", 8.0)
+        self.hedge_stages = {s.strip() for s in os.getenv("LLM_HEDGE_STAGES", "").split(",") if s.strip()}
+        self.hedge_delay = _env_float("LLM_HEDGE_DELAY", 2.0)
+        self.breaker = self._new_breaker()
+        self._breakers = {"openai": self.breaker}
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._latencies = {}
+        self._in_flight = {}
+
+    @staticmethod
+    def _new_breaker() -> CircuitBreaker:
+        return CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=_env_float("LLM_BREAKER_RESET", 30.0)
+        )
+
+    def route(self, stage: str) -> ModelRoute:
+        route = self.routes.get(stage)
+        if route is None:
+            route = self.routes[stage] = ModelRoute(
+                stage, os.getenv("OPENAI_MODEL", DEFAULT_MODEL),
+                structured_output=os.getenv("LLM_STRUCTURED_OUTPUT", "json_object"), **DEFAULT_STAGE
+            )
+        return route
+
+    def _client_for(self, route: ModelRoute):
+        if route.base_url is None:
+            return self.client
+        client = self._clients.get(route.base_url)
+        if client is None:
+            # Local OpenAI-compatible servers usually accept any key
+            api_key = os.getenv(route.api_key_env) if route.api_key_env else None
+            client = self._clients[route.base_url] = openai.AsyncOpenAI(
+                base_url=route.base_url, api_key=api_key or "not-needed", max_retries=0
+            )
+            self._breakers[route.endpoint] = self._new_breaker()
+        return client
+
+    async def chat(self, stage: str, **request):
+        """
+        Identical concurrent requests (same stage and parameters) are coalesced:
+        later callers wait on the first caller's upstream call and share its result.
+        Each caller is admitted under its own rate limits first; the stage deadline
+        starts before admission, so queueing counts against it.
+        Every call is recorded in the LLM call ledger.
+        """
+        route = self.route(stage)
+        request = {"model": route.model, "max_tokens": route.max_tokens, **request}
+        request["messages"] = self._fit_prompt(stage, request["model"], request["messages"])
+        key = hashlib.sha256(
+            json.dumps([stage, route.endpoint, request], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        started = time.perf_counter()
+        deadline = asyncio.get_running_loop().time() + route.timeout
+        info = CallInfo()
+        cache_hit = False
+        outcome = "failed"
+        try:
+            # Every caller is admitted on its own, even one that ends up sharing a call
+            await self._admit(route, deadline)
+            call = self._in_flight.get(key)
+            cache_hit = call is not None
+            if cache_hit:
+                self._count(stage, "coalesced")
+            else:
+                # A separate task, so one caller giving up does not cancel the call for the others
+                call = asyncio.ensure_future(self._call(route, request, info, deadline))
+                self._in_flight[key] = call
+                call.add_done_callback(lambda done: self._release(key, done))
+
+            response = await asyncio.shield(call)
+            outcome = "ok"
+            return response
+        except AdmissionRejected:
+            outcome = "rejected"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            llm_ledger.record(
+                stage, request["model"], route.endpoint, outcome,
+                latency_ms=(time.perf_counter() - started) * 1000,
+                prompt_tokens=info.prompt_tokens,
+                completion_tokens=info.completion_tokens,
+                retries=info.retries,
+                cache_hit=cache_hit,
+                report_id=current_llm_report()
+            )
+
+    async def chat_stream(self, stage: str, **request):
+        """
+        Stream a completion, yielding text deltas as they arrive. Admission, the
+        circuit breaker and retries apply until the stream is open; a stream that
+        breaks after that raises LLMUnavailable (part of the answer has been sent).
+        Streams are not coalesced. Tokens are counted locally, since not every
+        OpenAI-compatible server reports usage for streams.
+        """
+        route = self.route(stage)
+        request = {"model": route.model, "max_tokens": route.max_tokens, **request, "stream": True}
+        request["messages"] = self._fit_prompt(stage, request["model"], request["messages"])
+        started = time.perf_counter()
+        deadline = asyncio.get_running_loop().time() + route.timeout
+        info = CallInfo()
+        stream = None
+        first_token = None
+        parts = []
+        outcome = "failed"
+        try:
+            await self._admit(route, deadline)
+            stream = await self._call(route, request, info, deadline)
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    parts.append(delta)
+                    yield delta
+            except (openai.APIError, asyncio.TimeoutError) as e:
+                self._count(stage, "stream_errors")
+                self._breakers[route.endpoint].record_failure()
+                raise LLMUnavailable(f"LLM {stage} stream broke off: {e or 'timed out'}")
+            outcome = "ok"
+            self._count(stage, "successes")
+        except AdmissionRejected:
+            outcome = "rejected"
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away mid-answer
+            outcome = "cancelled"
+            raise
+        finally:
+            if stream is not None:
+                await stream.close()
+                info.prompt_tokens = count_message_tokens(request["messages"], request["model"])
+                info.completion_tokens = count_tokens("".join(parts), request["model"])
+                token_usage.record(stage, info.prompt_tokens, info.completion_tokens, current_llm_report())
+            if first_token is not None:
+                self._record_latency(route, first_token)
+            llm_ledger.record(
+                stage, request["model"], route.endpoint, outcome,
+                latency_ms=(time.perf_counter() - started) * 1000,
+                first_token_ms=first_token * 1000 if first_token is not None else None,
+                prompt_tokens=info.prompt_tokens,
+                completion_tokens=info.completion_tokens,
+                retries=info.retries,
+                report_id=current_llm_report()
+            )
+
+    def _fit_prompt(self, stage: str, model: str, messages: list) -> list:
+        """Budget guard: trim the last message if the prompt is over the stage's token budget"""
+        excess = count_message_tokens(messages, model) - prompt_budget(stage)
+        if excess <= 0:
+            return messages
+        last = messages[-1]
+        keep = max(0, count_tokens(last["content"], model) - excess)
+        self._count(stage, "prompts_trimmed")
+        print(f"⚠️  {stage} prompt over budget by {excess} tokens, trimmed")
+        return messages[:-1] + [{**last, "content": truncate_to_tokens(last["content"], keep, model)}]
+
+    def _record_usage(self, stage: str, request: dict, response) -> tuple:
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.prompt_tokens is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens or 0
+        else:
+            # Some OpenAI-compatible servers do not report usage
+            prompt_tokens = count_message_tokens(request["messages"], request["model"])
+            completion_tokens = count_tokens(response.choices[0].message.content or "", request["model"])
+        token_usage.record(stage, prompt_tokens, completion_tokens, current_llm_report())
+        return prompt_tokens, completion_tokens
+
+    def _release(self, key: str, call: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if not call.cancelled():
+            call.exception()  # retrieved here in case every caller has given up waiting
+
+    async def _admit(self, route: ModelRoute, deadline: float):
+        """Wait for the current caller's turn under the global and per-user rate limits"""
+        try:
+            await llm_scheduler.acquire(timeout=deadline - asyncio.get_running_loop().time())
+        except AdmissionRejected:
+            self._count(route.stage, "shed")
+            raise
+
+    async def _call(self, route: ModelRoute, request: dict, info: CallInfo, deadline: float):
+        """The upstream call with retries, within what is left of the deadline after admission"""
+        stage = route.stage
+        client = self._client_for(route)
+        breaker = self._breakers[route.endpoint]
+
+        if not breaker.allow():
+            self._count(stage, "short_circuited")
+            raise LLMUnavailable(f"LLM circuit breaker for {route.endpoint} is open")
+
+        loop = asyncio.get_running_loop()
+        self._count(stage, "calls")
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if attempt:
+                if breaker.is_open():
+                    # Failures during this call tripped the breaker: stop hammering the upstream
+                    break
+                self._count(stage, "retries")
+                info.retries += 1
+
+            started = time.perf_counter()
+            try:
+                response = await self._attempt(client, stage, request, remaining)
+            except (asyncio.TimeoutError, openai.APITimeoutError):
+                last_error = "timed out"
+                self._count(stage, "timeouts")
+                breaker.record_failure()
+                continue
+            except openai.APIStatusError as e:
+                if e.status_code not in RETRYABLE_STATUS_CODES:
+                    # Our request (or key, or model name) is wrong; not a sign of upstream
+                    # trouble, so the breaker is left alone and callers get their fallback
+                    self._count(stage, "errors")
+                    raise LLMUnavailable(f"LLM {stage} call rejected: {e.status_code}") from e
+                last_error = e
+                self._count(stage, "upstream_errors")
+                breaker.record_failure()
+                retry_after = self._retry_after(e)
+            except openai.APIConnectionError as e:
+                last_error = e
+                self._count(stage, "upstream_errors")
+                breaker.record_failure()
+                retry_after = None
+            else:
+                breaker.record_success()
+                if request.get("stream"):
+                    # Open stream: chat_stream accounts for latency and tokens once it ends
+                    self._count(stage, "streams")
+                    return response
+                self._record_latency(route, time.perf_counter() - started)
+                info.prompt_tokens, info.completion_tokens = self._record_usage(stage, request, response)
+                self._count(stage, "successes")
+                return response
+
+            if attempt < self.max_retries:
+                # Full jitter exponential backoff (or the server's Retry-After), within the deadline
+                delay = retry_after or random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                if delay >= deadline - loop.time():
+                    break
+                await asyncio.sleep(delay)
+
+        self._count(stage, "failures")
+        raise LLMUnavailable(f"LLM {stage} call failed: {last_error or 'deadline exceeded'}")
+
+    async def _attempt(self, client, stage: str, request: dict, remaining: float):
+        """One logical attempt; for hedged stages a duplicate request races the first if it is slow"""
+        primary = asyncio.ensure_future(client.chat.completions.create(**request, timeout=remaining))
+        if stage not in self.hedge_stages or self.hedge_delay >= remaining or request.get("stream"):
+            return await asyncio.wait_for(primary, timeout=remaining)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + remaining
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        if done:
+            return primary.result()
+
+        self._count(stage, "hedges_sent")
+        hedge = asyncio.ensure_future(client.chat.completions.create(**request, timeout=deadline - loop.time()))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count(stage, "hedge_wins")
+                        return task.result()
+            # Both failed: surface the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _retry_after(error) -> Optional[float]:
+        try:
+            value = error.response.headers.get("retry-after")
+            return min(float(value), 30.0) if value else None
+        except (AttributeError, ValueError):
+            return None
+
+    def _count(self, stage: str, counter: str):
+        with self._lock:
+            counters = self._stages.setdefault(stage, {})
+            counters[counter] = counters.get(counter, 0) + 1
+
+    def _record_latency(self, route: ModelRoute, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(route.name, deque(maxlen=200)).append(seconds * 1000)
+
+    def record_fallback(self, stage: str):
+        """Called by callers that answered with a local fallback"""
+        self._count(stage, "fallbacks")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {
+                stage: {**counters, "route": self.route(stage).name}
+                for stage, counters in self._stages.items()
+            }
+            routes = {}
+            for name, samples in self._latencies.items():
+                latencies = sorted(samples)
+                routes[name] = {
+                    "samples": len(latencies),
+                    "p50_ms": round(latencies[len(latencies) // 2], 1),
+                    "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1)
+                }
+        return {
+            "breakers": {endpoint: breaker.stats() for endpoint, breaker in self._breakers.items()},
+            "in_flight": len(self._in_flight),
+            "routing": {stage: route.as_dict() for stage, route in self.routes.items()},
+            "stages": stages,
+            "routes": routes
+        }
@@ -0,0 +1,318 @@
+"""
+OCR Service
+Tesseract OCR for photographed and scanned reports: images are loaded
+directly, EXIF-rotated, scaled to the OCR target DPI, cropped to content,
+deskewed and binarized. Scanned PDF pages are rasterized at the lowest DPI
+of a ladder and only re-rendered at higher DPI when the text comes out poor.
+"""
+
+import os
+import re
+import time
+import threading
+from io import BytesIO
+from typing import List, Optional
+
+# Resolution Tesseract is tuned for; larger photos are scaled down to it
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+
+# Long side of an A4 page in inches, used to estimate a photo's effective DPI
+PAGE_LONG_SIDE_INCHES = 11.7
+
+# Rasterization DPIs for scanned PDF pages, tried in order until a page reads well
+OCR_DPI_LADDER = [int(dpi) for dpi in os.getenv("OCR_DPI_LADDER", "200,300").split(",") if dpi.strip()]
+
+# A page "reads well" with at least this many characters, mostly real words/numbers
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "200"))
+OCR_MIN_WORD_RATIO = float(os.getenv("OCR_MIN_WORD_RATIO", "0.6"))
+
+# Deskew search range (degrees) and working width of the deskew thumbnail
+MAX_SKEW_DEGREES = 5.0
+DESKEW_WIDTH = 800
+
+# Words, units (mg/dL) and numbers/ranges (13.5, <5.0, 70-100)
+WORD_PATTERN = re.compile(r"^[A-Za-z]{2,}[.,:;)]?$|^[A-Za-z]+/[A-Za-z]+$|^[<>(]?[\d.,/%-]+[A-Za-z/%]*[.,:;)]?$")
+
+
+class OCRStats:
+    """Per-stage OCR timings, aggregated for /api/metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, kind: str, timings: dict):
+        with self._lock:
+            entry = self._totals.setdefault(kind, {"count": 0, "total_ms": {}})
+            entry["count"] += 1
+            for stage, ms in timings.items():
+                entry["total_ms"][stage] = entry["total_ms"].get(stage, 0.0) + ms
+
+    def drain(self) -> dict:
+        """Take the raw totals recorded so far (used to ship worker-process timings back)"""
+        with self._lock:
+            totals, self._totals = self._totals, {}
+            return totals
+
+    def merge(self, totals: dict):
+        with self._lock:
+            for kind, entry in totals.items():
+                target = self._totals.setdefault(kind, {"count": 0, "total_ms": {}})
+                target["count"] += entry["count"]
+                for stage, ms in entry["total_ms"].items():
+                    target["total_ms"][stage] = target["total_ms"].get(stage, 0.0) + ms
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                kind: {
+                    "count": entry["count"],
+                    "avg_ms": {stage: round(ms / entry["count"], 1) for stage, ms in entry["total_ms"].items()}
+                }
+                for kind, entry in self._totals.items()
+            }
+
+
+ocr_stats = OCRStats()
+
+
+def otsu_threshold(gray_image) -> int:
+    """Threshold that best separates ink from paper (Otsu's method on the histogram)"""
+    histogram = gray_image.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+
+    sum_background = 0.0
+    weight_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def binarize(gray_image):
+    """Black text on white background, thresholded with Otsu"""
+    threshold = otsu_threshold(gray_image)
+    return gray_image.point(lambda value: 255 if value > threshold else 0, mode="1")
+
+
+def target_size(size: tuple, target_dpi: int = OCR_TARGET_DPI) -> tuple:
+    """
+    Pixel size of a full-page image at target_dpi.
+    Images at or below that resolution keep their size (never upscaled).
+    """
+    width, height = size
+    max_long_side = int(target_dpi * PAGE_LONG_SIDE_INCHES)
+    if max(width, height) <= max_long_side:
+        return size
+    scale = max_long_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def scale_to_dpi(image, target_dpi: int = OCR_TARGET_DPI):
+    """Downscale a page image whose effective resolution is above target_dpi"""
+    from PIL import Image
+
+    size = target_size(image.size, target_dpi)
+    return image if size == image.size else image.resize(size, Image.LANCZOS)
+
+
+def crop_margins(gray_image, threshold: int, padding: int = 12):
+    """Crop empty paper around the printed content"""
+    ink = gray_image.point(lambda value: 255 if value <= threshold else 0)
+    bbox = ink.getbbox()
+    if not bbox:
+        return gray_image
+    left, top, right, bottom = bbox
+    return gray_image.crop((
+        max(0, left - padding),
+        max(0, top - padding),
+        min(gray_image.width, right + padding),
+        min(gray_image.height, bottom + padding)
+    ))
+
+
+def _row_profile_variance(ink_image, angle: float) -> float:
+    """Variance of per-row ink after rotating; text lines aligned with rows maximize it"""
+    from PIL import Image
+
+    rotated = ink_image.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=0)
+    # Averaging every row down to a single pixel gives the horizontal projection profile
+    profile = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+    mean = sum(profile) / len(profile)
+    return sum((value - mean) ** 2 for value in profile) / len(profile)
+
+
+def estimate_skew(gray_image, threshold: int) -> float:
+    """Page rotation in degrees (coarse 1° search, then 0.25° refinement) on a thumbnail"""
+    scale = min(1.0, DESKEW_WIDTH / gray_image.width)
+    thumbnail = gray_image.resize((max(1, round(gray_image.width * scale)), max(1, round(gray_image.height * scale))))
+    ink = thumbnail.point(lambda value: 255 if value <= threshold else 0)
+
+    best = max(
+        (float(a) for a in range(-int(MAX_SKEW_DEGREES), int(MAX_SKEW_DEGREES) + 1)),
+        key=lambda angle: _row_profile_variance(ink, angle)
+    )
+    return max(
+        (best + step * 0.25 for step in range(-3, 4)),
+        key=lambda angle: _row_profile_variance(ink, angle)
+    )
+
+
+def deskew(gray_image, threshold: int):
+    angle = estimate_skew(gray_image, threshold)
+    if abs(angle) < 0.2:
+        return gray_image
+    from PIL import Image
+    return gray_image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def prepare_image(image, scale: bool = True, crop: bool = True, straighten: bool = True):
+    """
+    Grayscale, scale to the target DPI, crop empty margins, deskew and
+    binarize a page image for Tesseract
+    """
+    from PIL import ImageOps
+
+    gray = ImageOps.grayscale(image)
+    if scale:
+        gray = scale_to_dpi(gray)
+    threshold = otsu_threshold(gray)
+    if crop:
+        gray = crop_margins(gray, threshold)
+    if straighten:
+        gray = deskew(gray, threshold)
+    return binarize(gray)
+
+
+def text_quality(text: str) -> float:
+    """Share of OCR tokens that look like words or numbers (garbage scores low)"""
+    tokens = text.split()
+    if not tokens:
+        return 0.0
+    return sum(1 for token in tokens if WORD_PATTERN.match(token)) / len(tokens)
+
+
+def reads_well(text: str) -> bool:
+    return len(text) >= OCR_MIN_PAGE_CHARS and text_quality(text) >= OCR_MIN_WORD_RATIO
+
+
+def extract_text_from_image(image_source) -> str:
+    """
+    Extract text from a photographed/scanned report image using Tesseract OCR
+    (image_source: file path or bytes). Stage timings go to ocr_stats.
+    """
+    try:
+        import pytesseract
+        from PIL import Image, ImageOps
+
+        timings = {}
+        started = time.perf_counter()
+
+        image = Image.open(image_source if isinstance(image_source, str) else BytesIO(image_source))
+        if image.format == "JPEG":
+            # Let the decoder skip detail we would scale away (1/2, 1/4, 1/8 scaling) and color
+            image.draft("L", target_size(image.size))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+        timings["load_ms"] = (time.perf_counter() - started) * 1000
+
+        stage = time.perf_counter()
+        prepared = prepare_image(image)
+        timings["preprocess_ms"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        text = pytesseract.image_to_string(prepared, lang='eng')
+        timings["ocr_ms"] = (time.perf_counter() - stage) * 1000
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+
+        ocr_stats.record("image", timings)
+        extracted_text = text.strip()
+        stage_times = ", ".join(f"{name} {ms:.0f}" for name, ms in timings.items())
+        print(
+            f"✓ Image OCR extracted {len(extracted_text)} characters "
+            f"({image.width}x{image.height} → {prepared.width}x{prepared.height}, {stage_times})"
+        )
+        return extracted_text
+
+    except ImportError:
+        print("✗ Tesseract not installed. Install: sudo apt-get install tesseract-ocr")
+        return ""
+    except Exception as e:
+        print(f"✗ Image OCR failed: {e}")
+        return ""
+
+
+def pdf_page_count(pdf_source) -> int:
+    from pdf2image import pdfinfo_from_bytes, pdfinfo_from_path
+
+    info = pdfinfo_from_path(pdf_source) if isinstance(pdf_source, str) else pdfinfo_from_bytes(pdf_source)
+    return int(info["Pages"])
+
+
+def render_pdf_page(pdf_source, page_number: int, dpi: int):
+    from pdf2image import convert_from_bytes, convert_from_path
+
+    convert = convert_from_path if isinstance(pdf_source, str) else convert_from_bytes
+    return convert(pdf_source, dpi=dpi, first_page=page_number, last_page=page_number, grayscale=True)[0]
+
+
+def ocr_pdf_page(pdf_source, page_number: int, dpi_ladder: Optional[List[int]] = None,
+                 preprocess: bool = True) -> dict:
+    """
+    OCR one scanned PDF page, starting at the lowest DPI of the ladder and
+    escalating only while the text reads poorly. Keeps the best attempt.
+    """
+    import pytesseract
+
+    best = None
+    for dpi in dpi_ladder or OCR_DPI_LADDER:
+        timings = {}
+        started = time.perf_counter()
+
+        image = render_pdf_page(pdf_source, page_number, dpi)
+        timings["render_ms"] = (time.perf_counter() - started) * 1000
+
+        stage = time.perf_counter()
+        # Pages are rendered at the intended DPI already; only crop, deskew and binarize
+        prepared = prepare_image(image, scale=False) if preprocess else image
+        timings["preprocess_ms"] = (time.perf_counter() - stage) * 1000
+
+        stage = time.perf_counter()
+        text = pytesseract.image_to_string(prepared, lang='eng').strip()
+        timings["ocr_ms"] = (time.perf_counter() - stage) * 1000
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        ocr_stats.record(f"pdf_page@{dpi}dpi", timings)
+
+        attempt = {"text": text, "dpi": dpi, "quality": text_quality(text), "timings": timings}
+        if best is None or (len(text) * attempt["quality"]) > (len(best["text"]) * best["quality"]):
+            best = attempt
+        if reads_well(text):
+            break
+
+    return best
+
+
+def ocr_pdf_pages(pdf_source) -> List[str]:
+    """OCR every page of a scanned PDF (pdf_source: file path or bytes), returning per-page text"""
+    page_count = pdf_page_count(pdf_source)
+    pages = []
+    for page_number in range(1, page_count + 1):
+        result = ocr_pdf_page(pdf_source, page_number)
+        print(
+            f"   Page {page_number}/{page_count}: {len(result['text'])} characters at {result['dpi']} DPI "
+            f"(quality {result['quality']:.2f}, {result['timings']['total_ms']:.0f} ms)"
+        )
+        pages.append(result["text"])
+    return pages
@@ -1,98 +1,101 @@
 """
 OpenAI Service with Tesseract OCR Fallback
-TEXT EXTRACTION: PyPDF2 → Tesseract OCR (for scanned PDFs)
-AI ANALYSIS: GPT-3.5-turbo (budget-friendly)
+TEXT EXTRACTION: PyPDF2 → Tesseract OCR (for scanned PDFs), see extraction_service
+AI ANALYSIS: model per stage from the LLM routing table (GPT-3.5-turbo by default)
 """
 
 import os
 import json
-import re
-from openai import OpenAI
-from io import BytesIO
+from openai import AsyncOpenAI
 from prompts.medical_prompts import (
     SYSTEM_PROMPT_EXTRACT, USER_PROMPT_EXTRACT,
     SYSTEM_PROMPT_CLASSIFY, USER_PROMPT_CLASSIFY,
     SYSTEM_PROMPT_EXPLAIN, USER_PROMPT_EXPLAIN,
     SYSTEM_PROMPT_ALERT, USER_PROMPT_ALERT,
-    SYSTEM_PROMPT_SUMMARY, USER_PROMPT_SUMMARY
+    SYSTEM_PROMPT_SUMMARY, USER_PROMPT_SUMMARY,
+    EXTRACT_PROMPT_VERSION
 )
+from services.ocr_service import ocr_stats
+from services.extraction_service import (
+    EXTRACTOR_VERSION, extract_pages_from_pdf, extract_text_from_pdf, extract_pages_with_ocr,
+    extract_text_with_ocr, clean_medical_text, extract_report_text, extract_report_text_job
+)
+from services.executor_service import cpu_executor
+from services.llm_service import ResilientLLM, DEFAULT_MODEL
+from services.token_service import (
+    prompt_budget, count_tokens, count_message_tokens, truncate_to_tokens, fit_lines,
+    compact_json, prompt_test, test_line
+)
+from services.structured_output import (
+    EXTRACT_SCHEMA, CLASSIFY_SCHEMA, SUMMARY_SCHEMA, response_format, parse_json_reply
+)
+from pydantic import ValidationError
 from models.schemas import (
     ExtractedReportData, TestResult, PatientInfo,
-    ReferenceRange, TestStatus, Severity
+    TestStatus, Severity, HealthSummary
 )
 
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    """Extract text from digital PDF using PyPDF2"""
-    try:
-        from PyPDF2 import PdfReader
-        reader = PdfReader(BytesIO(pdf_bytes))
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        
-        extracted_text = text.strip()
-        print(f"✓ PyPDF2 extracted {len(extracted_text)} characters")
-        return extracted_text
-    except Exception as e:
-        print(f"✗ PyPDF2 extraction failed: {e}")
-        return ""
+def parse_test_item(item: dict) -> TestResult:
+    """Validate one test from a model reply (raises ValidationError if it is unusable)"""
+    if not isinstance(item, dict):
+        raise TypeError(f"test item is not an object: {item!r}")
+    item = dict(item)
+    item.setdefault("test_name", "Unknown Test")
+    item["observed_value"] = str(item.get("observed_value", item.get("value", "N/A")))
+    if not isinstance(item.get("reference_range"), dict):
+        item["reference_range"] = None
+    status = str(item.get("status") or "UNKNOWN").upper()
+    item["status"] = status if status in TestStatus.__members__ else "UNKNOWN"
+    severity = str(item.get("severity") or "gray").lower()
+    item["severity"] = severity if severity in {s.value for s in Severity} else "gray"
+    return TestResult.model_validate(item)
 
 
-def extract_text_with_ocr(pdf_bytes: bytes) -> str:
-    """Extract text from scanned PDF using Tesseract OCR"""
-    try:
-        import pytesseract
-        from pdf2image import convert_from_bytes
-        from PIL import Image
-        
-        print("⚡ Attempting OCR with Tesseract...")
-        
-        # Convert PDF pages to images
-        images = convert_from_bytes(pdf_bytes, dpi=300)
-        
-        text = ""
-        for i, image in enumerate(images):
-            print(f"   Processing page {i+1}/{len(images)}...")
-            page_text = pytesseract.image_to_string(image, lang='eng')
-            text += page_text + "\n"
-        
-        extracted_text = text.strip()
-        print(f"✓ OCR extracted {len(extracted_text)} characters from {len(images)} pages")
-        return extracted_text
-        
-    except ImportError:
-        print("✗ Tesseract not installed. Install: sudo apt-get install tesseract-ocr")
-        return ""
-    except Exception as e:
-        print(f"✗ OCR extraction failed: {e}")
-        return ""
+def parse_reply_object(content: str) -> tuple:
+    """
+    Parse a JSON reply that should be an object. Returns (data, repaired) as
+    parse_json_reply does; raises json.JSONDecodeError if it cannot be parsed.
+    """
+    data, repaired = parse_json_reply(content)
+    if not isinstance(data, dict):
+        # Older prompts could answer with a bare list of tests
+        data = {"tests": data} if isinstance(data, list) else {}
+    return data, repaired
 
 
-def clean_medical_text(text: str) -> str:
-    """Clean and normalize extracted medical text"""
-    if not text:
-        return ""
-    
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Remove common PDF artifacts
-    text = re.sub(r'Page \d+ of \d+', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'\d{1,2}/\d{1,2}/\d{2,4}', lambda m: f" {m.group()} ", text)  # Preserve dates
+def parse_extraction(data: dict) -> ExtractedReportData:
+    """
+    Convert the LLM's extraction JSON into Pydantic models.
+    Invalid tests are dropped (and invalid patient fields left empty) instead of failing the report.
+    """
+    patient_info = None
+    if isinstance(data.get("patient_info"), dict):
+        fields = {}
+        for key, value in data["patient_info"].items():
+            try:
+                PatientInfo.model_validate({key: value})
+                fields[key] = value
+            except ValidationError:
+                print(f"⚠️  Ignoring invalid patient {key}: {value!r}")
+        patient_info = PatientInfo.model_validate(fields)
     
-    # Normalize units
-    text = text.replace('mg / dl', 'mg/dL')
-    text = text.replace('g / dl', 'g/dL')
-    text = text.replace('mg/dl', 'mg/dL')
-    text = text.replace('g/dl', 'g/dL')
+    tests = []
+    for item in data.get("tests") or []:
+        try:
+            test = parse_test_item(item)
+        except (ValidationError, TypeError, ValueError) as e:
+            print(f"⚠️  Dropping invalid test item: {e}")
+            continue
+        # Extraction does not classify
+        test.status = None
+        test.severity = None
+        tests.append(test)
     
-    # Remove multiple spaces again after replacements
-    text = re.sub(r'\s+', ' ', text)
+    if not tests:
+        raise Exception("No test results found. Ensure you uploaded a valid medical lab report.")
     
-    return text.strip()
+    return ExtractedReportData(patient_info=patient_info, tests=tests)
 
 
 class OpenAIService:
@@ -101,115 +104,137 @@ class OpenAIService:
         if not api_key or api_key == "your_openai_api_key_here":
             print("⚠️  OpenAI API key not configured!")
             self.client = None
+            self.llm = None
         else:
-            self.client = OpenAI(api_key=api_key)
+            # Retries, deadlines and the circuit breaker are handled by ResilientLLM
+            self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+            self.llm = ResilientLLM(self.client)
             print("✓ OpenAI client initialized")
+    
+    def model_for(self, stage: str) -> str:
+        """Model the routing table sends a stage to"""
+        return self.llm.route(stage).model if self.llm else DEFAULT_MODEL
+    
+    async def _chat_json(self, stage: str, messages: list, schema: dict, temperature: float) -> dict:
+        """
+        Chat call whose reply must be JSON: requests structured output per the stage's
+        route and parses the reply, keeping the complete items of a truncated one
+        """
+        data, _, _ = await self._chat_json_reply(stage, messages, schema, temperature)
+        return data
+    
+    async def _chat_json_reply(self, stage: str, messages: list, schema: dict, temperature: float) -> tuple:
+        """Like _chat_json, but returns (data, reply content as received, whether it was repaired)"""
+        fmt = response_format(self.llm.route(stage).structured_output, f"{stage}_result", schema)
+        response = await self.llm.chat(
+            stage,
+            messages=messages,
+            temperature=temperature,
+            **({"response_format": fmt} if fmt else {})
+        )
         
-        self.model = "gpt-3.5-turbo"  # Budget-friendly model
+        content = response.choices[0].message.content
+        data, repaired = parse_reply_object(content)
+        if repaired:
+            print(f"⚠️  Truncated {stage} reply repaired, kept its complete items")
+        return data, content, repaired
     
-    async def extract_report_data(self, file_url: str = None, file_bytes: bytes = None, file_type: str = "application/pdf") -> ExtractedReportData:
+    async def extract_report_data(self, file_url: str = None, file_bytes: bytes = None, file_type: str = "application/pdf",
+                                  file_path: str = None) -> ExtractedReportData:
         """
         Extract structured data from medical report
         WORKFLOW: PyPDF2 → Tesseract OCR (fallback) → Clean → AI Analysis
+        The file is read from file_path when given (no in-memory copy), else from file_bytes.
+        """
+        extracted_data, _ = await self.extract_report(file_bytes=file_bytes, file_type=file_type, file_path=file_path)
+        return extracted_data
+    
+    async def extract_report(self, file_bytes: bytes = None, file_type: str = "application/pdf",
+                             file_path: str = None) -> tuple:
+        """
+        Like extract_report_data, but also returns the extraction artifact
+        (extractor, per-page text, cleaned text, raw LLM JSON) for storage
         """
         if not self.client:
             raise Exception("OpenAI API key not configured. Add OPENAI_API_KEY to .env")
         
-        if not file_bytes:
-            raise Exception("No file provided")
-        
         try:
-            # STEP 1: Try PyPDF2 first (digital PDFs)
-            print("\n=== TEXT EXTRACTION ===")
-            extracted_text = extract_text_from_pdf(file_bytes)
-            
-            # STEP 2: Fallback to OCR if text is empty or too short
-            if len(extracted_text) < 100:
-                print("⚠️  Low text extracted, trying OCR fallback...")
-                extracted_text = extract_text_with_ocr(file_bytes)
-            
-            if len(extracted_text) < 50:
-                raise Exception(
-                    "Could not extract sufficient text from PDF. "
-                    "Ensure it's a text-based PDF or install Tesseract for OCR support."
-                )
-            
-            # STEP 3: Clean and normalize text
-            print("\n=== TEXT CLEANING ===")
-            cleaned_text = clean_medical_text(extracted_text)
-            print(f"✓ Cleaned text: {len(cleaned_text)} characters")
+            artifact = await self.read_report_text(file_bytes=file_bytes, file_type=file_type, file_path=file_path)
+            extracted_data, llm_fields = await self.extract_from_text(artifact["cleaned_text"])
+            artifact.update(llm_fields)
+            return extracted_data, artifact
             
-            # STEP 4: AI Analysis - Extract structured data
-            print("\n=== AI ANALYSIS ===")
-            user_content = f"""{USER_PROMPT_EXTRACT}
+        except Exception as e:
+            print(f"✗ Error: {e}")
+            raise e
+    
+    async def read_report_text(self, file_bytes: bytes = None, file_type: str = "application/pdf",
+                               file_path: str = None) -> dict:
+        """
+        Text extraction stage: PyPDF2 → Tesseract OCR (fallback) → Clean.
+        Returns the text part of the extraction artifact (extractor, per-page text, cleaned text).
+        """
+        source = file_path or file_bytes
+        if not source:
+            raise Exception("No file provided")
+        
+        # PDF parsing, OCR and cleaning are CPU-bound: keep them off the event loop
+        artifact, worker_ocr_stats = await cpu_executor.run(extract_report_text_job, source, file_type)
+        ocr_stats.merge(worker_ocr_stats)
+        return artifact
+    
+    async def extract_from_text(self, cleaned_text: str) -> tuple:
+        """
+        AI extraction stage: structured data from cleaned report text.
+        Returns the parsed data and the artifact fields of the extraction: the
+        model's reply verbatim, whether it had to be repaired, model and prompt version.
+        """
+        if not self.client:
+            raise Exception("OpenAI API key not configured. Add OPENAI_API_KEY to .env")
+        
+        # STEP 4: AI Analysis - Extract structured data
+        print("\n=== AI ANALYSIS ===")
+        template = f"""{USER_PROMPT_EXTRACT}
 
 Here is the extracted medical report text:
 
 ---
-{cleaned_text[:8000]}
+{{report_text}}
 ---
 
 Extract the medical test data as JSON."""
-            
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT_EXTRACT},
-                {"role": "user", "content": user_content}
-            ]
-            
-            print("🤖 Sending to OpenAI GPT-3.5...")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=2000,
-                temperature=0.1
-            )
-            
-            content = response.choices[0].message.content
-            
-            # Clean JSON response
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            
-            content = content.strip()
-            
+        
+        # The report text gets whatever the prompt budget leaves after the instructions
+        model = self.model_for("extract")
+        text_budget = prompt_budget("extract") - count_message_tokens([
+            {"content": SYSTEM_PROMPT_EXTRACT}, {"content": template}
+        ], model)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT_EXTRACT},
+            {"role": "user", "content": template.replace("{report_text}", truncate_to_tokens(cleaned_text, text_budget, model))}
+        ]
+        
+        print(f"🤖 Sending to {self.model_for('extract')}...")
+        # A malformed reply is asked for once more here, instead of failing the upload
+        for attempt in range(2):
             try:
-                data = json.loads(content)
+                data, content, repaired = await self._chat_json_reply(
+                    "extract", messages, EXTRACT_SCHEMA, temperature=0.1 if attempt == 0 else 0.0
+                )
+                break
             except json.JSONDecodeError as e:
                 print(f"✗ JSON parse error: {e}")
-                raise Exception("AI response format error. The report may have an unusual format.")
-            
-            # Convert to Pydantic models
-            patient_info = None
-            if data.get("patient_info"):
-                patient_info = PatientInfo(**data["patient_info"])
-            
-            tests = []
-            for test in data.get("tests", []):
-                ref_range = None
-                if test.get("reference_range") and isinstance(test["reference_range"], dict):
-                    ref_range = ReferenceRange(
-                        min=test["reference_range"].get("min"),
-                        max=test["reference_range"].get("max")
-                    )
-                
-                tests.append(TestResult(
-                    test_name=test.get("test_name", "Unknown Test"),
-                    observed_value=str(test.get("observed_value", test.get("value", "N/A"))),
-                    unit=test.get("unit"),
-                    reference_range=ref_range
-                ))
-            
-            if not tests:
-                raise Exception("No test results found. Ensure you uploaded a valid medical lab report.")
-            
-            print(f"✓ Extracted {len(tests)} tests successfully\n")
-            return ExtractedReportData(patient_info=patient_info, tests=tests)
-            
-        except Exception as e:
-            print(f"✗ Error: {e}")
-            raise e
+        else:
+            raise Exception("AI response format error. The report may have an unusual format.")
+        
+        extracted_data = parse_extraction(data)
+        print(f"✓ Extracted {len(extracted_data.tests)} tests successfully\n")
+        return extracted_data, {
+            "raw_llm_json": content,
+            "repaired": repaired,
+            "prompt_version": EXTRACT_PROMPT_VERSION,
+            "model": model
+        }
     
     async def classify_values(self, tests: list[TestResult]) -> list[TestResult]:
         """Classify test values as NORMAL/LOW/HIGH and assign severity"""
@@ -220,55 +245,54 @@ Extract the medical test data as JSON."""
             return tests
         
         try:
-            tests_json = json.dumps([t.model_dump() for t in tests], indent=2, default=str)
+            # Compact and null-free; tests past the prompt budget are left unclassified
+            model = self.model_for("classify")
+            budget = prompt_budget("classify") - count_message_tokens([
+                {"content": SYSTEM_PROMPT_CLASSIFY}, {"content": USER_PROMPT_CLASSIFY}
+            ], model)
+            prompt_tests = []
+            for test in tests:
+                item = prompt_test(test)
+                budget -= count_tokens(compact_json(item), model) + 1
+                if budget < 0:
+                    print(f"⚠️  Classifying {len(prompt_tests)} of {len(tests)} tests (prompt budget)")
+                    break
+                prompt_tests.append(item)
             
             messages = [
                 {"role": "system", "content": SYSTEM_PROMPT_CLASSIFY},
-                {"role": "user", "content": USER_PROMPT_CLASSIFY.format(tests_json=tests_json)}
+                {"role": "user", "content": USER_PROMPT_CLASSIFY.format(tests_json=compact_json(prompt_tests))}
             ]
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=2000,
-                temperature=0.1
-            )
-            
-            content = response.choices[0].message.content
+            classified_data = await self._chat_json("classify", messages, CLASSIFY_SCHEMA, temperature=0.1)
             
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            
-            classified_data = json.loads(content.strip())
-            tests_data = classified_data if isinstance(classified_data, list) else classified_data.get("tests", [])
+            replies = []
+            for item in classified_data.get("tests") or []:
+                try:
+                    replies.append(parse_test_item(item))
+                except (ValidationError, TypeError, ValueError) as e:
+                    print(f"⚠️  Dropping invalid classification: {e}")
+                    replies.append(None)
+            by_name = {r.test_name.strip().lower(): r for r in replies if r}
             
+            # Match replies by position, else by name; tests missing from the reply
+            # (e.g. it was truncated) stay unclassified
             classified_tests = []
-            for test_data in tests_data:
-                ref_range = None
-                if test_data.get("reference_range") and isinstance(test_data["reference_range"], dict):
-                    ref_range = ReferenceRange(
-                        min=test_data["reference_range"].get("min"),
-                        max=test_data["reference_range"].get("max")
-                    )
-                
-                status_str = test_data.get("status", "UNKNOWN").upper()
-                severity_str = test_data.get("severity", "gray").lower()
-                
-                classified_tests.append(TestResult(
-                    test_name=test_data.get("test_name", "Unknown"),
-                    observed_value=str(test_data.get("observed_value", "N/A")),
-                    unit=test_data.get("unit"),
-                    reference_range=ref_range,
-                    status=TestStatus(status_str) if status_str in ["NORMAL", "LOW", "HIGH", "UNKNOWN"] else TestStatus.UNKNOWN,
-                    severity=Severity(severity_str) if severity_str in ["green", "yellow", "red", "gray"] else Severity.GRAY
-                ))
+            for index, test in enumerate(tests):
+                name = test.test_name.strip().lower()
+                classified = replies[index] if index < len(replies) else None
+                if not classified or classified.test_name.strip().lower() != name:
+                    classified = by_name.get(name)
+                classified_tests.append(test.model_copy(update={
+                    "status": classified.status if classified else TestStatus.UNKNOWN,
+                    "severity": classified.severity if classified else Severity.GRAY
+                }))
             
             return classified_tests
             
         except Exception as e:
             print(f"Classification error: {e}")
+            self.llm.record_fallback("classify")
             for test in tests:
                 test.status = TestStatus.UNKNOWN
                 test.severity = Severity.GRAY
@@ -287,10 +311,9 @@ Extract the medical test data as JSON."""
                 )}
             ]
             
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.llm.chat(
+                "explain",
                 messages=messages,
-                max_tokens=200,
                 temperature=0.7
             )
             
@@ -298,6 +321,7 @@ Extract the medical test data as JSON."""
             
         except Exception as e:
             print(f"Explanation error: {e}")
+            self.llm.record_fallback("explain")
             return "Please consult your healthcare provider."
     
     async def generate_alert(self, test_name: str, status: str, severity: str) -> str:
@@ -313,10 +337,9 @@ Extract the medical test data as JSON."""
                 )}
             ]
             
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response = await self.llm.chat(
+                "alert",
                 messages=messages,
-                max_tokens=100,
                 temperature=0.7
             )
             
@@ -324,6 +347,7 @@ Extract the medical test data as JSON."""
             
         except Exception as e:
             print(f"Alert error: {e}")
+            self.llm.record_fallback("alert")
             return "Please consult your healthcare provider."
     
     async def generate_summary(self, tests: list[TestResult]) -> dict:
@@ -339,13 +363,20 @@ Extract the medical test data as JSON."""
             }
         
         try:
-            tests_summary = "\n".join([
-                f"- {t.test_name}: {t.observed_value} {t.unit or ''} - {t.status.value if t.status else 'UNKNOWN'}"
-                for t in tests
-            ])
-            
             abnormal_count = sum(1 for t in tests if t.status in [TestStatus.LOW, TestStatus.HIGH])
             
+            # Abnormal tests first, so trimming to the prompt budget drops normal ones
+            model = self.model_for("summary")
+            ordered = sorted(tests, key=lambda t: t.status not in [TestStatus.LOW, TestStatus.HIGH])
+            tests_summary = "\n".join(fit_lines(
+                [test_line(t.test_name, t.observed_value, t.unit, t.status.value if t.status else "UNKNOWN") for t in ordered],
+                prompt_budget("summary") - count_message_tokens([
+                    {"content": SYSTEM_PROMPT_SUMMARY}, {"content": USER_PROMPT_SUMMARY}
+                ], model),
+                model,
+                omitted="... and {count} more tests"
+            ))
+            
             messages = [
                 {"role": "system", "content": SYSTEM_PROMPT_SUMMARY},
                 {"role": "user", "content": USER_PROMPT_SUMMARY.format(
@@ -356,24 +387,12 @@ Extract the medical test data as JSON."""
                 )}
             ]
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7
-            )
-            
-            content = response.choices[0].message.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            
-            return json.loads(content.strip())
+            summary_data = await self._chat_json("summary", messages, SUMMARY_SCHEMA, temperature=0.7)
+            return HealthSummary.model_validate(summary_data).model_dump()
             
         except Exception as e:
             print(f"Summary error: {e}")
+            self.llm.record_fallback("summary")
             return {
                 "summary": "Please review with healthcare provider.",
                 "health_score": health_score,
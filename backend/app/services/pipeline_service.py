@@ -0,0 +1,179 @@
+"""
+Report Pipeline
+Analysis steps shared by uploads and re-analysis:
+classify → explain → summarize → save
+"""
+
+import os
+import asyncio
+from typing import Optional
+
+from services.openai_service import openai_service, parse_extraction, parse_reply_object
+from services.analysis_service import analysis_service
+from services.supabase_service import supabase_service
+from services.admission_service import LLMCaller, BACKGROUND, current_llm_caller, run_as_llm_caller
+from services.token_service import set_llm_report
+from models.schemas import ExtractedReportData, AnalysisResponse, TestResult
+
+# Seconds an upload waits for explanations and the summary after classification;
+# past it the upload returns a locally scored result and the rest is saved later (0 = always wait)
+UPLOAD_ANALYSIS_BUDGET = float(os.getenv("UPLOAD_ANALYSIS_BUDGET", "10"))
+
+# Running backfills (kept referenced so they are not garbage collected)
+_backfill_tasks = set()
+
+
+async def analyze_extracted(extracted_data: ExtractedReportData) -> dict:
+    """Classify, explain and summarize extracted tests"""
+    # Step 2: Classify values and assign severity
+    classified_tests = await openai_service.classify_values(extracted_data.tests)
+    return await enrich_and_summarize(classified_tests)
+
+
+async def enrich_and_summarize(classified_tests: list[TestResult]) -> dict:
+    """Explanations, alerts and the summary for classified tests"""
+    # Step 3: Enrich with explanations for abnormal values
+    enriched_tests = await analysis_service.enrich_with_explanations(classified_tests)
+
+    # Step 4: Generate overall summary
+    summary_data = await openai_service.generate_summary(enriched_tests)
+
+    return {
+        "tests": enriched_tests,
+        "summary": summary_data.get("summary"),
+        "health_score": summary_data.get("health_score", analysis_service.calculate_health_score(enriched_tests)),
+        "overall_status": analysis_service.get_overall_status(enriched_tests)
+    }
+
+
+def local_analysis(classified_tests: list[TestResult]) -> dict:
+    """Analysis without LLM explanations: local health score, status and a count-based summary"""
+    counts = analysis_service.count_by_status(classified_tests)
+    abnormal_count = counts["low"] + counts["high"]
+    summary = f"{counts['normal']} of {counts['total']} results are within the normal range."
+    if abnormal_count:
+        summary += f" {abnormal_count} need review with your healthcare provider."
+
+    return {
+        "tests": classified_tests,
+        "summary": summary,
+        "health_score": analysis_service.calculate_health_score(classified_tests),
+        "overall_status": analysis_service.get_overall_status(classified_tests),
+        "enrichment_pending": True
+    }
+
+
+async def analyze_for_upload(report_id: str, extracted_data: ExtractedReportData, save: bool,
+                             budget: float = UPLOAD_ANALYSIS_BUDGET) -> dict:
+    """
+    Classify, then wait for explanations and the summary until the budget runs out.
+    If they are not ready by then, the locally scored result is returned (and saved);
+    for saved reports they keep running and are written to the stored rows when done.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    classified_tests = await openai_service.classify_values(extracted_data.tests)
+
+    if budget <= 0:
+        analysis = await enrich_and_summarize(classified_tests)
+    else:
+        # Enrichment fills in the test objects: give it copies so the partial result stays unchanged
+        caller = current_llm_caller()
+        enrich_caller = LLMCaller(caller.user_id, caller.priority)
+        pending = asyncio.ensure_future(run_as_llm_caller(
+            enrich_caller, enrich_and_summarize([t.model_copy() for t in classified_tests])
+        ))
+        done, _ = await asyncio.wait({pending}, timeout=max(0.0, budget - (loop.time() - started)))
+        if done:
+            analysis = pending.result()
+        else:
+            print(f"⚠️  Analysis budget of {budget:g}s spent, returning locally scored result")
+            analysis = local_analysis(classified_tests)
+            if save:
+                # Nobody is waiting for the rest any more: let interactive requests go first
+                enrich_caller.priority = BACKGROUND
+            else:
+                pending.cancel()
+
+    if save:
+        saved_tests = await save_analysis(report_id, extracted_data, analysis)
+        if analysis.get("enrichment_pending"):
+            task = asyncio.ensure_future(backfill_analysis(report_id, pending, [t["id"] for t in saved_tests]))
+            _backfill_tasks.add(task)
+            task.add_done_callback(_backfill_tasks.discard)
+
+    return analysis
+
+
+async def backfill_analysis(report_id: str, pending: asyncio.Future, test_ids: list):
+    """Write explanations, alerts and the summary of a late enrichment to the saved report"""
+    try:
+        analysis = await pending
+        updates = {
+            test_id: {"explanation": test.explanation, "alert_message": test.alert_message}
+            for test_id, test in zip(test_ids, analysis["tests"])
+            if test.explanation or test.alert_message
+        }
+        if updates:
+            await supabase_service.update_test_results(report_id, updates)
+        await supabase_service.update_report(report_id, {
+            "health_score": analysis["health_score"],
+            "summary": analysis["summary"]
+        })
+        print(f"✓ Backfilled explanations and summary for report {report_id}")
+    except Exception as e:
+        print(f"✗ Backfill failed for report {report_id}: {e}")
+
+
+async def save_analysis(report_id: str, extracted_data: ExtractedReportData, analysis: dict, replace: bool = False) -> list:
+    """Save test results and mark the report completed with patient info and health score"""
+    saved_tests = await supabase_service.save_test_results(report_id, analysis["tests"], replace=replace)
+
+    patient_info = extracted_data.patient_info
+    await supabase_service.update_report(report_id, {
+        "status": "completed",
+        "patient_name": patient_info.name if patient_info else None,
+        "patient_age": patient_info.age if patient_info else None,
+        "patient_gender": patient_info.gender if patient_info else None,
+        "health_score": analysis["health_score"],
+        "summary": analysis["summary"]
+    })
+    return saved_tests
+
+
+def analysis_response(report_id: str, extracted_data: ExtractedReportData, analysis: dict) -> AnalysisResponse:
+    return AnalysisResponse(
+        report_id=report_id,
+        patient_info=extracted_data.patient_info,
+        tests=analysis["tests"],
+        health_score=analysis["health_score"],
+        summary=analysis["summary"],
+        overall_status=analysis["overall_status"],
+        enrichment_pending=analysis.get("enrichment_pending", False)
+    )
+
+
+async def reanalyze_report(report_id: str, reuse_extraction: bool = False) -> Optional[AnalysisResponse]:
+    """
+    Re-run the analysis of a saved report from its stored extraction artifact,
+    skipping PDF parsing and OCR. The LLM extraction runs again with the current
+    prompt (and is stored as a new artifact) unless reuse_extraction is set.
+    Returns None if the report has no stored artifact.
+    """
+    artifact = await supabase_service.get_extraction_artifact(report_id)
+    if not artifact:
+        return None
+    set_llm_report(report_id)
+
+    if reuse_extraction and artifact["raw_llm_json"]:
+        data, _ = parse_reply_object(artifact["raw_llm_json"])
+        extracted_data = parse_extraction(data)
+    else:
+        extracted_data, llm_fields = await openai_service.extract_from_text(artifact["cleaned_text"])
+        await supabase_service.save_extraction_artifact(report_id, {**artifact, **llm_fields})
+
+    analysis = await analyze_extracted(extracted_data)
+    await save_analysis(report_id, extracted_data, analysis, replace=True)
+    print(f"✓ Re-analyzed report {report_id} from stored {artifact['extractor']} text")
+
+    return analysis_response(report_id, extracted_data, analysis)
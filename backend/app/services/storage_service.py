@@ -0,0 +1,188 @@
+"""
+Storage Service
+Streaming upload ingestion and content-addressed upload storage: files are
+named by their SHA-256 digest and sharded into two levels of subdirectories
+(uploads/ab/cd/abcd...ef.pdf)
+"""
+
+import os
+import uuid
+import shutil
+import hashlib
+from typing import Optional
+
+from services.executor_service import io_executor
+
+DEFAULT_UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "uploads")
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Leading bytes of every supported upload type
+MAGIC_NUMBERS = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+CONTENT_TYPE_ALIASES = {"image/jpg": "image/jpeg"}
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Detect the upload type from its first bytes"""
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class UploadRejected(Exception):
+    """Upload refused while it was spooled (status_code: 413 or 415)"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+class SpooledUpload:
+    """
+    An upload streamed to a temp file next to the blob store, hashed on the way.
+    The temp file is removed by close(); a stored copy is a hard link and survives it.
+    """
+
+    def __init__(self, path: str, sha256: str, size: int, content_type: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.content_type = content_type
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class BlobStore:
+    """
+    Write-once file store keyed by content hash.
+    Identical uploads map to the same file; reference counts live in the
+    stored_blobs table (see DatabaseService.upload_file).
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.abspath(root or os.getenv("UPLOAD_DIR") or DEFAULT_UPLOAD_DIR)
+        # Spool directory on the same filesystem, so stored files are linked instead of copied
+        self.incoming = os.path.join(self.root, ".incoming")
+
+    def path_for(self, sha256: str) -> str:
+        # The path depends on the content alone: identical uploads under different
+        # file names must land on the same file as their stored_blobs row
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    async def spool(self, source, declared_type: Optional[str] = None,
+                    max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+        """
+        Stream a file object to a temp file in chunks, hashing as it goes.
+        Raises UploadRejected as soon as the content type does not match or
+        the size limit is exceeded, without reading the rest.
+        """
+        return await io_executor.run(self._spool, source, declared_type, max_bytes)
+
+    def _spool(self, source, declared_type: Optional[str], max_bytes: int) -> SpooledUpload:
+        os.makedirs(self.incoming, exist_ok=True)
+        temp_path = os.path.join(self.incoming, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        content_type = None
+
+        try:
+            with open(temp_path, "wb") as f:
+                while True:
+                    chunk = source.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    if content_type is None:
+                        content_type = sniff_content_type(chunk)
+                        declared = CONTENT_TYPE_ALIASES.get(declared_type, declared_type)
+                        if content_type is None or (declared and declared != content_type):
+                            raise UploadRejected(415, "File content does not match a supported file type")
+
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadRejected(413, f"File too large. Maximum size is {round(max_bytes / (1024 * 1024), 2):g} MB")
+
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            if content_type is None:
+                raise UploadRejected(415, "Empty file")
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return SpooledUpload(temp_path, digest.hexdigest(), size, content_type)
+
+    async def put(self, data: bytes) -> dict:
+        """
+        Store bytes on the I/O pool.
+        Returns sha256, path, size and whether the content was already stored.
+        """
+        return await io_executor.run(self._put, data)
+
+    def _put(self, data: bytes) -> dict:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha256)
+
+        existed = os.path.exists(path)
+        if not existed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file in the target directory, then atomically rename
+            # into place so readers never see a partial file
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        return {"sha256": sha256, "path": path, "size": len(data), "deduplicated": existed}
+
+    async def put_spooled(self, upload: SpooledUpload) -> dict:
+        """Store a spooled upload without copying it (hash already known)"""
+        return await io_executor.run(self._put_spooled, upload)
+
+    def _put_spooled(self, upload: SpooledUpload) -> dict:
+        path = self.path_for(upload.sha256)
+        existed = os.path.exists(path)
+        if not existed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(upload.path, path)
+            except FileExistsError:
+                existed = True
+            except OSError:
+                # Filesystem without hard links: copy, then atomically rename into place
+                temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                shutil.copyfile(upload.path, temp_path)
+                os.replace(temp_path, path)
+
+        return {"sha256": upload.sha256, "path": path, "size": upload.size, "deduplicated": existed}
+
+    def remove(self, path: str):
+        """Delete a stored file that is no longer referenced"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore()
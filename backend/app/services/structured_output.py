@@ -0,0 +1,165 @@
+"""
+Structured Output
+JSON schemas requested from the model for the extract, classify and summary
+stages, and a tolerant parser for the replies: strips code fences and, when
+a reply was cut off (max_tokens), keeps every complete array item.
+"""
+
+import json
+from typing import Optional
+
+# Modes: "json_schema" (strict schema, newer models), "json_object" (any JSON object), "off"
+STRUCTURED_OUTPUT_MODES = ("json_schema", "json_object", "off")
+
+
+def _nullable(type_name: str) -> dict:
+    return {"type": [type_name, "null"]}
+
+
+REFERENCE_RANGE_SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {"min": _nullable("number"), "max": _nullable("number")},
+    "required": ["min", "max"],
+    "additionalProperties": False
+}
+
+
+def _test_schema(classified: bool) -> dict:
+    properties = {
+        "test_name": {"type": "string"},
+        "observed_value": {"type": "string"},
+        "unit": _nullable("string"),
+        "reference_range": REFERENCE_RANGE_SCHEMA
+    }
+    if classified:
+        properties["status"] = {"type": "string", "enum": ["NORMAL", "LOW", "HIGH", "UNKNOWN"]}
+        properties["severity"] = {"type": "string", "enum": ["green", "yellow", "red", "gray"]}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+EXTRACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patient_info": {
+            "type": ["object", "null"],
+            "properties": {
+                "name": _nullable("string"),
+                "age": _nullable("integer"),
+                "gender": _nullable("string")
+            },
+            "required": ["name", "age", "gender"],
+            "additionalProperties": False
+        },
+        "tests": {"type": "array", "items": _test_schema(classified=False)}
+    },
+    "required": ["patient_info", "tests"],
+    "additionalProperties": False
+}
+
+CLASSIFY_SCHEMA = {
+    "type": "object",
+    "properties": {"tests": {"type": "array", "items": _test_schema(classified=True)}},
+    "required": ["tests"],
+    "additionalProperties": False
+}
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "health_score": {"type": "integer"},
+        "attention_areas": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["summary", "health_score", "attention_areas"],
+    "additionalProperties": False
+}
+
+
+def response_format(mode: str, name: str, schema: dict) -> Optional[dict]:
+    """The response_format request parameter for a structured output mode (None when off)"""
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+def strip_code_fences(content: str) -> str:
+    if "```json" in content:
+        content = content.split("```json")[1]
+    if "```" in content:
+        content = content.split("```")[0]
+    return content.strip()
+
+
+def _at_item_level(stack: list) -> bool:
+    """Not inside an array item: only whole items of an array count as complete"""
+    return "[" not in stack[:-1]
+
+
+def repair_truncated_json(text: str) -> Optional[str]:
+    """
+    Close a JSON document that was cut off, dropping the incomplete tail:
+    the text is cut after the last complete array item (or object value)
+    and the still-open brackets are closed. Returns None if nothing is salvageable.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    safe_end, safe_stack = None, None
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if stack and stack[-1] == "[" and _at_item_level(stack):
+                    safe_end, safe_stack = i + 1, list(stack)
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            if char == "[" and stack and _at_item_level(stack + ["["]):
+                # An empty array is a valid place to stop
+                safe_end, safe_stack = i + 1, stack + ["["]
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                return None
+            stack.pop()
+            if not stack:
+                return text[:i + 1]
+            if _at_item_level(stack):
+                safe_end, safe_stack = i + 1, list(stack)
+        elif char == "," and stack and stack[-1] == "[" and _at_item_level(stack):
+            safe_end, safe_stack = i, list(stack)
+
+    if safe_end is None:
+        return None
+    closing = "".join("}" if bracket == "{" else "]" for bracket in reversed(safe_stack))
+    return text[:safe_end].rstrip().rstrip(",") + closing
+
+
+def parse_json_reply(content: str) -> tuple:
+    """
+    Parse a model reply as JSON. Returns (data, repaired); repaired is True when
+    the reply was truncated and only its complete items were kept.
+    Raises json.JSONDecodeError if the reply cannot be parsed or repaired.
+    """
+    content = strip_code_fences(content or "")
+    try:
+        return json.loads(content), False
+    except json.JSONDecodeError as error:
+        repaired = repair_truncated_json(content[content.find("{"):] if "{" in content else content)
+        if repaired is None:
+            raise error
+        return json.loads(repaired), True
@@ -4,20 +4,154 @@ Handles all database operations using SQLAlchemy with SQLite
 """
 
 import os
+import json
+import asyncio
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, func, select, update
 from sqlalchemy.orm import Session
 
-from database import SessionLocal, engine, Base
-from models.db_models import Report, TestResult, UserProfile, FamilyMember, AIConversation, Reminder
+from database import SessionLocal, ensure_schema, serialized_write
+from services.cache_service import ReportCache, create_report_cache
+from services.storage_service import blob_store, SpooledUpload
+from services.executor_service import ExecutorBusy
+from models.db_models import (
+    Report, TestResult, UserProfile, FamilyMember, AIConversation, Reminder, DeletedRecord, StoredBlob,
+    ExtractionArtifact, LLMCall
+)
+
+
+# Columns that can be selected with fields=
+REPORT_LIST_FIELDS = (
+    "id", "user_id", "file_name", "patient_name", "health_score", "status", "created_at",
+    "total_tests", "normal_count", "abnormal_count", "critical_count"
+)
+REPORT_FIELDS = REPORT_LIST_FIELDS + (
+    "file_url", "patient_age", "patient_gender", "summary", "updated_at"
+)
+TEST_RESULT_FIELDS = (
+    "id", "report_id", "test_name", "observed_value", "unit", "reference_min", "reference_max",
+    "status", "severity", "explanation", "alert_message"
+)
+
+ARTIFACT_FIELDS = (
+    "id", "report_id", "extractor", "extractor_version", "prompt_version", "model",
+    "pages", "cleaned_text", "raw_llm_json", "repaired", "created_at"
+)
+
+LLM_CALL_FIELDS = (
+    "id", "report_id", "stage", "model", "endpoint", "outcome", "latency_ms", "first_token_ms",
+    "prompt_tokens", "completion_tokens", "retries", "cache_hit", "created_at"
+)
+
+# Full report payload: every selectable column plus the stored distributions
+REPORT_DETAIL_FIELDS = REPORT_FIELDS + ("status_counts", "severity_counts")
+
+# Maximum number of ids per IN (...) clause
+ID_CHUNK_SIZE = 500
+
+# Delta sync: tombstones are kept this long; older cursors must resync fully
+SYNC_RETENTION_DAYS = int(os.getenv("SYNC_RETENTION_DAYS", "30"))
+# How often expired tombstones are pruned
+TOMBSTONE_PRUNE_INTERVAL = float(os.getenv("TOMBSTONE_PRUNE_INTERVAL", "3600"))
+# Rows stamped within this window may belong to transactions that have not
+# committed yet, so the returned cursor stays this far behind the clock
+SYNC_CLOCK_SKEW_SECONDS = float(os.getenv("SYNC_CLOCK_SKEW_SECONDS", "2"))
+
+# LLM call ledger entries older than this are pruned
+LLM_CALL_RETENTION_DAYS = int(os.getenv("LLM_CALL_RETENTION_DAYS", "30"))
+
+# Counters read as 0 for reports without stored aggregates
+COUNT_FIELDS = {"total_tests", "normal_count", "abnormal_count", "critical_count"}
+JSON_FIELDS = {"status_counts", "severity_counts"}
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _count(value):
+    return value or 0
+
+
+def _json_object(value):
+    return json.loads(value) if value else {}
+
+
+def _column_converter(field: str, column):
+    """Converter applied to a selected column value, or None to pass it through"""
+    if isinstance(column.type, DateTime):
+        return _isoformat
+    if field in COUNT_FIELDS:
+        return _count
+    if field in JSON_FIELDS:
+        return _json_object
+    return None
+
+
+def select_rows(db: Session, model, fields, *criteria, order_by=None) -> List[dict]:
+    """
+    Select only the given columns as plain tuples and serialize them straight
+    into dicts, skipping ORM object hydration and the identity map
+    """
+    keys = tuple(fields)
+    columns = [getattr(model, f) for f in keys]
+    stmt = select(*columns).where(*criteria)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    rows = db.execute(stmt).all()
+    
+    converters = [
+        (f, converter) for f, column in zip(keys, columns)
+        if (converter := _column_converter(f, column)) is not None
+    ]
+    if not converters:
+        return [dict(zip(keys, row)) for row in rows]
+    
+    results = []
+    for row in rows:
+        item = dict(zip(keys, row))
+        for f, converter in converters:
+            item[f] = converter(item[f])
+        results.append(item)
+    return results
+
+
+def compute_report_aggregates(results: list) -> dict:
+    """
+    Count test results by status and severity.
+    Works on TestResult rows or dicts with "status"/"severity" keys.
+    """
+    status_counts = {"NORMAL": 0, "LOW": 0, "HIGH": 0, "UNKNOWN": 0}
+    severity_counts = {"green": 0, "yellow": 0, "red": 0, "gray": 0}
+    
+    for r in results:
+        status = r.get("status") if isinstance(r, dict) else r.status
+        severity = r.get("severity") if isinstance(r, dict) else r.severity
+        if status in status_counts:
+            status_counts[status] += 1
+        if severity in severity_counts:
+            severity_counts[severity] += 1
+    
+    return {
+        "total_tests": len(results),
+        "normal_count": status_counts["NORMAL"],
+        "abnormal_count": status_counts["LOW"] + status_counts["HIGH"],
+        "critical_count": severity_counts["red"],
+        "status_counts": json.dumps(status_counts),
+        "severity_counts": json.dumps(severity_counts)
+    }
 
 
 class DatabaseService:
     def __init__(self):
+        # Serialized report and test-result payloads, invalidated on every write to a report
+        self.cache = create_report_cache()
+        
         # Initialize database tables
         try:
-            from models import db_models
-            Base.metadata.create_all(bind=engine)
+            ensure_schema()
+            self.backfill_report_aggregates()
             print("✓ SQLite database ready")
         except Exception as e:
             print(f"Warning: Database initialization error: {e}")
@@ -29,26 +163,104 @@ class DatabaseService:
     # ==================== FILE UPLOAD ====================
     
     async def upload_file(self, file_bytes: bytes, file_name: str, content_type: str) -> Optional[str]:
-        """Save file locally and return path"""
+        """
+        Save file to content-addressed storage and return its path.
+        Identical uploads share one file and add a reference to it.
+        """
+        return await self._store_blob(lambda: blob_store.put(file_bytes), file_name, content_type)
+    
+    async def store_upload(self, upload: SpooledUpload, file_name: str) -> Optional[str]:
+        """Save a spooled upload to content-addressed storage (linked, not copied) and return its path"""
+        return await self._store_blob(lambda: blob_store.put_spooled(upload), file_name, upload.content_type)
+    
+    async def _store_blob(self, put, file_name: str, content_type: str) -> Optional[str]:
         try:
-            # Create uploads directory if needed
-            upload_dir = os.path.join(os.path.dirname(__file__), "..", "uploads")
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = os.path.join(upload_dir, f"{timestamp}_{file_name}")
-            
-            with open(file_path, "wb") as f:
-                f.write(file_bytes)
-            
-            return file_path
+            # A second attempt covers the file being removed by a concurrent
+            # delete of its last reference between writing and referencing it
+            for _ in range(2):
+                blob = await put()
+                path = await self._add_blob_reference(blob, content_type)
+                if path:
+                    if blob["deduplicated"]:
+                        print(f"✓ Upload matches stored file {blob['sha256'][:12]}")
+                    # The row's path, which is what delete_report releases by
+                    return path
+            raise RuntimeError("stored file disappeared while adding a reference")
+        except ExecutorBusy:
+            raise
         except Exception as e:
             print(f"Error saving file: {e}")
             return f"local://uploads/{file_name}"
     
+    @serialized_write
+    def _add_blob_reference(self, blob: dict, content_type: str) -> Optional[str]:
+        """Count one more reference to a stored file and return its path (None if the file is gone)"""
+        db = self.get_session()
+        try:
+            stored = db.query(StoredBlob).filter(StoredBlob.sha256 == blob["sha256"]).first()
+            if stored is None:
+                stored = StoredBlob(
+                    sha256=blob["sha256"],
+                    path=blob["path"],
+                    size=blob["size"],
+                    content_type=content_type,
+                    ref_count=0
+                )
+                db.add(stored)
+            if not os.path.exists(stored.path):
+                db.rollback()
+                return None
+            stored.ref_count += 1
+            path = stored.path
+            db.commit()
+            return path
+        finally:
+            db.close()
+    
+    def _release_blob_reference(self, db: Session, file_url: Optional[str]) -> Optional[str]:
+        """
+        Drop one reference to a stored file within the caller's transaction.
+        Returns the path to remove once the transaction commits, if it was the last one.
+        """
+        if not file_url:
+            return None
+        stored = db.query(StoredBlob).filter(StoredBlob.path == file_url).first()
+        if stored is None:
+            return None
+        stored.ref_count -= 1
+        if stored.ref_count > 0:
+            return None
+        db.delete(stored)
+        return stored.path
+    
+    async def get_storage_usage(self) -> dict:
+        """Upload storage usage: stored (deduplicated) bytes vs. bytes uploaded"""
+        db = self.get_session()
+        try:
+            files, stored_bytes, referenced_bytes, references = db.execute(select(
+                func.count(StoredBlob.sha256),
+                func.coalesce(func.sum(StoredBlob.size), 0),
+                func.coalesce(func.sum(StoredBlob.size * StoredBlob.ref_count), 0),
+                func.coalesce(func.sum(StoredBlob.ref_count), 0)
+            )).one()
+            return {
+                "root": blob_store.root,
+                "files": files,
+                "references": references,
+                "stored_bytes": stored_bytes,
+                "referenced_bytes": referenced_bytes,
+                "deduplicated_bytes": referenced_bytes - stored_bytes
+            }
+        except Exception as e:
+            print(f"Error getting storage usage: {e}")
+            return {"root": blob_store.root, "error": str(e)}
+        finally:
+            db.close()
+    
     # ==================== REPORTS ====================
     
-    async def create_report(self, user_id: str, file_url: str, file_name: str) -> dict:
+    @serialized_write
+    def create_report(self, user_id: str, file_url: str, file_name: str) -> dict:
         """Create a new report record"""
         db = self.get_session()
         try:
@@ -80,7 +292,8 @@ class DatabaseService:
         finally:
             db.close()
     
-    async def update_report(self, report_id: str, data: dict) -> dict:
+    @serialized_write
+    def update_report(self, report_id: str, data: dict) -> dict:
         """Update a report record"""
         db = self.get_session()
         try:
@@ -91,6 +304,7 @@ class DatabaseService:
                         setattr(report, key, value)
                 db.commit()
                 db.refresh(report)
+                self.cache.invalidate_report(report_id)
                 print(f"✓ Updated report {report_id}")
             return {"id": report_id, **data}
         except Exception as e:
@@ -102,61 +316,340 @@ class DatabaseService:
     
     async def get_report(self, report_id: str) -> Optional[dict]:
         """Get a report by ID"""
+        cache_key = ReportCache.key("report", report_id)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        token = self.cache.begin_read(report_id)
+        db = self.get_session()
+        try:
+            data = self._load_report(db, report_id)
+            if data:
+                self.cache.set(cache_key, data, token)
+            return data
+        except Exception as e:
+            print(f"Error getting report: {e}")
+            return None
+        finally:
+            db.close()
+    
+    async def get_report_bundle(self, report_id: str, report: Optional[dict] = None) -> Optional[dict]:
+        """
+        Get a report and all its test results using a single session.
+        Pass the report if the caller has already loaded it; then only the tests are read.
+        """
+        report_key = ReportCache.key("report", report_id)
+        tests_key = ReportCache.key("tests", report_id)
+        if report is None:
+            report = self.cache.get(report_key)
+        cached_tests = self.cache.get(tests_key) if report is not None else None
+        if cached_tests is not None:
+            return {"report": report, "test_results": cached_tests}
+        
+        token = self.cache.begin_read(report_id)
+        db = self.get_session()
+        try:
+            if report is None:
+                report = self._load_report(db, report_id)
+                if not report:
+                    return None
+                self.cache.set(report_key, report, token)
+            
+            data = {
+                "report": report,
+                "test_results": select_rows(db, TestResult, TEST_RESULT_FIELDS, TestResult.report_id == report_id)
+            }
+            self.cache.set(tests_key, data["test_results"], token)
+            return data
+        except Exception as e:
+            print(f"Error getting report bundle: {e}")
+            return None
+        finally:
+            db.close()
+    
+    async def get_user_reports(self, user_id: str, fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        Get all reports for a user.
+        Only the requested columns (default: REPORT_LIST_FIELDS) are selected.
+        """
+        columns = list(fields or REPORT_LIST_FIELDS)
+        db = self.get_session()
+        try:
+            return select_rows(db, Report, columns, Report.user_id == user_id, order_by=Report.created_at.desc())
+        except Exception as e:
+            print(f"Error getting user reports: {e}")
+            return []
+        finally:
+            db.close()
+    
+    @serialized_write
+    def delete_report(self, report_id: str) -> bool:
+        """Delete a report and its test results"""
         db = self.get_session()
         try:
             report = db.query(Report).filter(Report.id == report_id).first()
             if not report:
-                return None
+                return False
+            
+            db.add(DeletedRecord(
+                user_id=report.user_id,
+                entity_type="report",
+                entity_id=report_id,
+                report_id=report_id
+            ))
+            self._add_test_tombstones(db, report.user_id, report_id)
+            orphaned_path = self._release_blob_reference(db, report.file_url)
+            db.delete(report)
+            db.commit()
+            self.cache.invalidate_report(report_id)
+            if orphaned_path:
+                blob_store.remove(orphaned_path)
+            print(f"✓ Deleted report {report_id}")
+            return True
+        except Exception as e:
+            db.rollback()
+            print(f"Error deleting report: {e}")
+            return False
+        finally:
+            db.close()
+    
+    def _add_test_tombstones(self, db: Session, user_id: Optional[str], report_id: str):
+        """Record deletion of every test result of a report (caller deletes them)"""
+        test_ids = db.execute(select(TestResult.id).where(TestResult.report_id == report_id)).scalars().all()
+        db.add_all([
+            DeletedRecord(user_id=user_id, entity_type="test_result", entity_id=test_id, report_id=report_id)
+            for test_id in test_ids
+        ])
+    
+    @serialized_write
+    def prune_tombstones(self) -> int:
+        """Delete tombstones older than SYNC_RETENTION_DAYS (cursors that old resync fully)"""
+        db = self.get_session()
+        try:
+            pruned = db.query(DeletedRecord).filter(
+                DeletedRecord.deleted_at < datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS)
+            ).delete(synchronize_session=False)
+            db.commit()
+            if pruned:
+                print(f"✓ Pruned {pruned} expired tombstones")
+            return pruned
+        except Exception as e:
+            db.rollback()
+            print(f"Error pruning tombstones: {e}")
+            return 0
+        finally:
+            db.close()
+    
+    async def prune_tombstones_periodically(self):
+        """Background task: prune expired tombstones every TOMBSTONE_PRUNE_INTERVAL seconds"""
+        while True:
+            await self.prune_tombstones()
+            await asyncio.sleep(TOMBSTONE_PRUNE_INTERVAL)
+    
+    async def get_changes(self, user_id: str, since: Optional[datetime],
+                          report_fields: List[str], test_fields: List[str]) -> dict:
+        """
+        Get a user's reports and test results created or updated after `since`,
+        plus deletions. Without `since` (or with one older than the tombstone
+        retention) everything is returned and "reset" is set.
+        Returns the high-water mark to use as the next cursor.
+        Errors propagate: an empty delta would look like "nothing changed".
+        """
+        high_water = datetime.utcnow() - timedelta(seconds=SYNC_CLOCK_SKEW_SECONDS)
+        reset = since is None or since < datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS)
+        
+        db = self.get_session()
+        try:
+            report_criteria = [Report.user_id == user_id]
+            test_criteria = [TestResult.report_id.in_(select(Report.id).where(Report.user_id == user_id))]
+            if not reset:
+                report_criteria += [Report.updated_at > since, Report.updated_at <= high_water]
+                test_criteria += [TestResult.updated_at > since, TestResult.updated_at <= high_water]
+            
+            reports = select_rows(db, Report, report_fields, *report_criteria, order_by=Report.updated_at)
+            test_results = select_rows(db, TestResult, test_fields, *test_criteria, order_by=TestResult.updated_at)
+            
+            deleted = {"reports": [], "test_results": []}
+            if not reset:
+                tombstones = db.execute(
+                    select(DeletedRecord.entity_type, DeletedRecord.entity_id).where(
+                        DeletedRecord.user_id == user_id,
+                        DeletedRecord.deleted_at > since,
+                        DeletedRecord.deleted_at <= high_water
+                    ).order_by(DeletedRecord.deleted_at)
+                ).all()
+                for entity_type, entity_id in tombstones:
+                    deleted["reports" if entity_type == "report" else "test_results"].append(entity_id)
             
             return {
-                "id": report.id,
-                "user_id": report.user_id,
-                "file_url": report.file_url,
-                "file_name": report.file_name,
-                "patient_name": report.patient_name,
-                "patient_age": report.patient_age,
-                "patient_gender": report.patient_gender,
-                "health_score": report.health_score,
-                "summary": report.summary,
-                "status": report.status,
-                "created_at": report.created_at.isoformat() if report.created_at else None
+                "reset": reset,
+                "reports": reports,
+                "test_results": test_results,
+                "deleted": deleted,
+                "high_water": high_water
             }
+        finally:
+            db.close()
+    
+    # ==================== EXTRACTION ARTIFACTS ====================
+    
+    @serialized_write
+    def save_extraction_artifact(self, report_id: str, artifact: dict) -> Optional[dict]:
+        """Store the text (and the raw LLM reply, once known) a report was extracted from"""
+        db = self.get_session()
+        try:
+            record = ExtractionArtifact(
+                report_id=report_id,
+                extractor=artifact.get("extractor"),
+                extractor_version=artifact.get("extractor_version"),
+                prompt_version=artifact.get("prompt_version"),
+                model=artifact.get("model"),
+                pages=json.dumps(artifact.get("pages") or []),
+                cleaned_text=artifact.get("cleaned_text"),
+                raw_llm_json=artifact.get("raw_llm_json"),
+                repaired=bool(artifact.get("repaired"))
+            )
+            db.add(record)
+            db.commit()
+            print(f"✓ Saved extraction artifact for report {report_id}")
+            return {"id": record.id}
         except Exception as e:
-            print(f"Error getting report: {e}")
+            db.rollback()
+            print(f"Error saving extraction artifact: {e}")
             return None
         finally:
             db.close()
     
-    async def get_user_reports(self, user_id: str) -> List[dict]:
-        """Get all reports for a user"""
+    @serialized_write
+    def update_extraction_artifact(self, artifact_id: str, updates: dict) -> bool:
+        """Fill in the LLM part (raw reply, repaired flag, model, prompt version) of an artifact saved before extraction"""
         db = self.get_session()
         try:
-            reports = db.query(Report).filter(Report.user_id == user_id).order_by(Report.created_at.desc()).all()
-            
-            return [
-                {
-                    "id": r.id,
-                    "user_id": r.user_id,
-                    "file_name": r.file_name,
-                    "patient_name": r.patient_name,
-                    "health_score": r.health_score,
-                    "status": r.status,
-                    "created_at": r.created_at.isoformat() if r.created_at else None
-                }
-                for r in reports
-            ]
+            record = db.query(ExtractionArtifact).filter(ExtractionArtifact.id == artifact_id).first()
+            if not record:
+                return False
+            for key, value in updates.items():
+                if hasattr(record, key):
+                    setattr(record, key, value)
+            db.commit()
+            return True
         except Exception as e:
-            print(f"Error getting user reports: {e}")
+            db.rollback()
+            print(f"Error updating extraction artifact: {e}")
+            return False
+        finally:
+            db.close()
+    
+    async def get_extraction_artifact(self, report_id: str) -> Optional[dict]:
+        """Get the most recent extraction artifact of a report"""
+        db = self.get_session()
+        try:
+            rows = select_rows(
+                db, ExtractionArtifact, ARTIFACT_FIELDS,
+                ExtractionArtifact.report_id == report_id,
+                order_by=ExtractionArtifact.created_at.desc()
+            )
+            if not rows:
+                return None
+            artifact = rows[0]
+            artifact["pages"] = json.loads(artifact["pages"] or "[]")
+            return artifact
+        except Exception as e:
+            print(f"Error getting extraction artifact: {e}")
+            return None
+        finally:
+            db.close()
+    
+    async def get_stale_artifact_report_ids(self, prompt_version: str, limit: Optional[int] = None) -> List[str]:
+        """Reports with stored artifacts, none of them extracted with the given prompt version"""
+        db = self.get_session()
+        try:
+            current = select(ExtractionArtifact.report_id).where(ExtractionArtifact.prompt_version == prompt_version)
+            query = (
+                select(ExtractionArtifact.report_id)
+                .where(ExtractionArtifact.report_id.not_in(current))
+                .group_by(ExtractionArtifact.report_id)
+                .order_by(func.min(ExtractionArtifact.created_at))
+            )
+            if limit:
+                query = query.limit(limit)
+            return list(db.execute(query).scalars().all())
+        finally:
+            db.close()
+    
+    # ==================== LLM CALL LEDGER ====================
+    
+    @serialized_write
+    def save_llm_calls(self, calls: List[dict]) -> int:
+        """
+        Append a batch of LLM call records and prune entries past the retention period.
+        Calls for reports that were never saved (anonymous uploads) are kept without a report_id.
+        """
+        db = self.get_session()
+        try:
+            report_ids = {c["report_id"] for c in calls if c.get("report_id")}
+            existing = set(
+                db.execute(select(Report.id).where(Report.id.in_(report_ids))).scalars().all()
+            ) if report_ids else set()
+            db.add_all([
+                LLMCall(**{**call, "report_id": call.get("report_id") if call.get("report_id") in existing else None})
+                for call in calls
+            ])
+            db.query(LLMCall).filter(
+                LLMCall.created_at < datetime.utcnow() - timedelta(days=LLM_CALL_RETENTION_DAYS)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return len(calls)
+        except Exception as e:
+            db.rollback()
+            print(f"Error saving LLM calls: {e}")
+            return 0
+        finally:
+            db.close()
+    
+    async def get_llm_calls(self, since: datetime, stage: Optional[str] = None,
+                            fields: Optional[List[str]] = None) -> List[dict]:
+        """LLM call records since a point in time, optionally of one stage"""
+        db = self.get_session()
+        try:
+            criteria = [LLMCall.created_at >= since]
+            if stage:
+                criteria.append(LLMCall.stage == stage)
+            return select_rows(db, LLMCall, fields or LLM_CALL_FIELDS, *criteria)
+        except Exception as e:
+            print(f"Error getting LLM calls: {e}")
+            return []
+        finally:
+            db.close()
+    
+    async def get_report_llm_calls(self, report_id: str) -> List[dict]:
+        """Every recorded LLM call of a report, oldest first"""
+        db = self.get_session()
+        try:
+            return select_rows(
+                db, LLMCall, LLM_CALL_FIELDS,
+                LLMCall.report_id == report_id,
+                order_by=LLMCall.created_at
+            )
+        except Exception as e:
+            print(f"Error getting report LLM calls: {e}")
             return []
         finally:
             db.close()
     
     # ==================== TEST RESULTS ====================
     
-    async def save_test_results(self, report_id: str, tests: list) -> List[dict]:
-        """Save test results for a report"""
+    @serialized_write
+    def save_test_results(self, report_id: str, tests: list, replace: bool = False) -> List[dict]:
+        """Save test results for a report (replace: delete the existing ones first)"""
         db = self.get_session()
         try:
+            if replace:
+                owner = db.execute(select(Report.user_id).where(Report.id == report_id)).scalar()
+                self._add_test_tombstones(db, owner, report_id)
+                db.query(TestResult).filter(TestResult.report_id == report_id).delete(synchronize_session=False)
+            
             saved_results = []
             for test in tests:
                 test_result = TestResult(
@@ -174,7 +667,16 @@ class DatabaseService:
                 db.add(test_result)
                 saved_results.append(test_result)
             
+            report = db.query(Report).filter(Report.id == report_id).first()
+            if report:
+                db.flush()
+                all_results = db.query(TestResult.status, TestResult.severity).filter(TestResult.report_id == report_id).all()
+                for key, value in compute_report_aggregates(all_results).items():
+                    setattr(report, key, value)
+                report.updated_at = datetime.utcnow()
+            
             db.commit()
+            self.cache.invalidate_report(report_id)
             print(f"✓ Saved {len(saved_results)} test results for report {report_id}")
             return [{"id": r.id} for r in saved_results]
         except Exception as e:
@@ -183,35 +685,195 @@ class DatabaseService:
             return []
         finally:
             db.close()
-    
-    async def get_test_results(self, report_id: str) -> List[dict]:
-        """Get all test results for a report"""
+
+    @serialized_write
+    def update_test_results(self, report_id: str, updates: dict) -> int:
+        """Update fields of saved test results of a report ({test_result_id: {field: value}})"""
+        db = self.get_session()
+        try:
+            rows = db.query(TestResult).filter(
+                TestResult.report_id == report_id,
+                TestResult.id.in_(list(updates))
+            ).all()
+            for row in rows:
+                for key, value in updates[row.id].items():
+                    if hasattr(row, key):
+                        setattr(row, key, value)
+            db.commit()
+            self.cache.invalidate_report(report_id)
+            print(f"✓ Updated {len(rows)} test results for report {report_id}")
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            print(f"Error updating test results: {e}")
+            return 0
+        finally:
+            db.close()
+
+    async def get_test_results(self, report_id: str, statuses: Optional[List[str]] = None,
+                               fields: Optional[List[str]] = None) -> List[dict]:
+        """
+        Get all test results for a report, optionally only those with the given statuses.
+        With fields, only those columns are selected (cached full rows are projected instead).
+        """
+        cache_key = ReportCache.key("tests", report_id)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            results = [r for r in cached if r["status"] in statuses] if statuses else cached
+            return [{f: r[f] for f in fields} for r in results] if fields else results
+        
+        token = self.cache.begin_read(report_id)
         db = self.get_session()
         try:
-            results = db.query(TestResult).filter(TestResult.report_id == report_id).all()
+            criteria = [TestResult.report_id == report_id]
+            if statuses:
+                criteria.append(TestResult.status.in_(statuses))
+            results = select_rows(db, TestResult, fields or TEST_RESULT_FIELDS, *criteria)
             
-            return [
-                {
-                    "id": r.id,
-                    "report_id": r.report_id,
-                    "test_name": r.test_name,
-                    "observed_value": r.observed_value,
-                    "unit": r.unit,
-                    "reference_min": r.reference_min,
-                    "reference_max": r.reference_max,
-                    "status": r.status,
-                    "severity": r.severity,
-                    "explanation": r.explanation,
-                    "alert_message": r.alert_message
-                }
-                for r in results
-            ]
+            # Only complete, unfiltered lists are cached
+            if not statuses and not fields:
+                self.cache.set(cache_key, results, token)
+            return results
         except Exception as e:
             print(f"Error getting test results: {e}")
             return []
         finally:
             db.close()
     
+    async def get_test_results_for_reports(self, report_ids: List[str],
+                                           fields: Optional[List[str]] = None) -> dict:
+        """
+        Get test results of many reports with one query per chunk of ids.
+        Returns {report_id: [test results]} in the order of report_ids.
+        """
+        columns = list(fields or TEST_RESULT_FIELDS)
+        drop_report_id = "report_id" not in columns
+        if drop_report_id:
+            columns.append("report_id")
+        
+        grouped = {report_id: [] for report_id in report_ids}
+        db = self.get_session()
+        try:
+            for i in range(0, len(report_ids), ID_CHUNK_SIZE):
+                chunk = report_ids[i:i + ID_CHUNK_SIZE]
+                for row in select_rows(db, TestResult, columns, TestResult.report_id.in_(chunk)):
+                    report_id = row.pop("report_id") if drop_report_id else row["report_id"]
+                    grouped[report_id].append(row)
+            return grouped
+        except Exception as e:
+            print(f"Error getting test results: {e}")
+            return grouped
+        finally:
+            db.close()
+    
+    async def get_comparison_rows(self, report_ids: Optional[List[str]] = None,
+                                  user_id: Optional[str] = None, last: Optional[int] = None) -> dict:
+        """
+        Load test results of several reports joined on canonical test name, in one query
+        (reports outer-joined to their tests, so reports without tests are still returned).
+        Either pass explicit report_ids, compared in the given order, or a user_id and the
+        number of latest reports to compare, oldest first.
+        """
+        db = self.get_session()
+        try:
+            if report_ids:
+                report_filter = Report.id.in_(report_ids)
+            else:
+                latest = (
+                    db.query(Report.id)
+                    .filter(Report.user_id == user_id)
+                    .order_by(Report.created_at.desc())
+                    .limit(last or 2)
+                    .subquery()
+                )
+                report_filter = Report.id.in_(db.query(latest.c.id))
+            
+            canonical_name = func.lower(func.trim(TestResult.test_name)).label("canonical_name")
+            joined = (
+                db.query(
+                    Report.id,
+                    Report.file_name,
+                    Report.health_score,
+                    Report.created_at,
+                    canonical_name,
+                    TestResult.test_name,
+                    TestResult.observed_value,
+                    TestResult.unit,
+                    TestResult.status
+                )
+                .outerjoin(TestResult, TestResult.report_id == Report.id)
+                .filter(report_filter)
+                .order_by(canonical_name, Report.created_at)
+                .all()
+            )
+            
+            reports = {}
+            rows = []
+            for r in joined:
+                reports.setdefault(r.id, {
+                    "id": r.id,
+                    "file_name": r.file_name,
+                    "health_score": r.health_score,
+                    "created_at": r.created_at
+                })
+                if r.test_name is not None:
+                    rows.append({
+                        "canonical_name": r.canonical_name,
+                        "report_id": r.id,
+                        "test_name": r.test_name,
+                        "observed_value": r.observed_value,
+                        "unit": r.unit,
+                        "status": r.status
+                    })
+            
+            if report_ids:
+                ordered = [reports[report_id] for report_id in report_ids if report_id in reports]
+            else:
+                ordered = sorted(reports.values(), key=lambda r: r["created_at"] or datetime.min)
+            for report in ordered:
+                report["created_at"] = _isoformat(report["created_at"])
+            
+            return {"reports": ordered, "rows": rows}
+        except Exception as e:
+            print(f"Error loading comparison rows: {e}")
+            return {"reports": [], "rows": []}
+        finally:
+            db.close()
+    
+    def _load_report(self, db: Session, report_id: str) -> Optional[dict]:
+        """Select a full report payload"""
+        rows = select_rows(db, Report, REPORT_DETAIL_FIELDS, Report.id == report_id)
+        return rows[0] if rows else None
+    
+    def backfill_report_aggregates(self) -> int:
+        """
+        Compute aggregates of completed reports saved before they were stored on
+        the row. Runs once at startup, after ensure_schema; updated_at is left
+        as it was, so validators and delta sync do not see a change.
+        """
+        db = self.get_session()
+        try:
+            legacy_ids = db.execute(
+                select(Report.id).where(Report.total_tests.is_(None), Report.status == "completed")
+            ).scalars().all()
+            for report_id in legacy_ids:
+                results = db.query(TestResult.status, TestResult.severity).filter(TestResult.report_id == report_id).all()
+                db.execute(
+                    update(Report)
+                    .where(Report.id == report_id)
+                    .values(**compute_report_aggregates(results), updated_at=Report.updated_at)
+                )
+            db.commit()
+            if legacy_ids:
+                print(f"✓ Backfilled aggregates of {len(legacy_ids)} reports")
+            return len(legacy_ids)
+        except Exception as e:
+            db.rollback()
+            print(f"Error backfilling report aggregates: {e}")
+            return 0
+        finally:
+            db.close()
+    
     # ==================== USER PROFILES ====================
     
     async def get_user_profile(self, user_id: str) -> Optional[dict]:
@@ -244,7 +906,8 @@ class DatabaseService:
         finally:
             db.close()
     
-    async def create_or_update_profile(self, user_id: str, data: dict) -> dict:
+    @serialized_write
+    def create_or_update_profile(self, user_id: str, data: dict) -> dict:
         """Create or update a user profile"""
         db = self.get_session()
         try:
@@ -306,7 +969,8 @@ class DatabaseService:
         finally:
             db.close()
     
-    async def create_family_member(self, owner_id: str, data: dict) -> dict:
+    @serialized_write
+    def create_family_member(self, owner_id: str, data: dict) -> dict:
         """Create a new family member"""
         db = self.get_session()
         try:
@@ -324,7 +988,8 @@ class DatabaseService:
         finally:
             db.close()
     
-    async def update_family_member(self, member_id: str, data: dict) -> dict:
+    @serialized_write
+    def update_family_member(self, member_id: str, data: dict) -> dict:
         """Update a family member"""
         db = self.get_session()
         try:
@@ -343,7 +1008,8 @@ class DatabaseService:
         finally:
             db.close()
     
-    async def delete_family_member(self, member_id: str) -> bool:
+    @serialized_write
+    def delete_family_member(self, member_id: str) -> bool:
         """Delete a family member"""
         db = self.get_session()
         try:
@@ -363,7 +1029,8 @@ class DatabaseService:
     
     # ==================== AI CONVERSATIONS ====================
     
-    async def save_conversation(self, user_id: str, report_id: str, question: str, answer: str) -> dict:
+    @serialized_write
+    def save_conversation(self, user_id: str, report_id: str, question: str, answer: str) -> dict:
         """Save an AI conversation"""
         db = self.get_session()
         try:
@@ -0,0 +1,173 @@
+"""
+Token Service
+Token counting for prompt budgets (tiktoken when installed, else an estimate),
+compact prompt serialization, and prompt/completion token accounting per
+stage and per report
+"""
+
+import os
+import json
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Prompt budgets (tokens) per stage; builders trim their context to fit
+PROMPT_BUDGETS = {
+    "extract": 3000,
+    "classify": 2500,
+    "explain": 300,
+    "alert": 300,
+    "summary": 1200,
+    "ask": 1500,
+}
+DEFAULT_PROMPT_BUDGET = 1500
+
+# Reports whose token totals are kept in memory
+TRACKED_REPORTS = 500
+
+# Report whose analysis the current task's LLM calls belong to
+_report_id = contextvars.ContextVar("llm_report_id", default=None)
+
+_encodings = {}
+
+
+def set_llm_report(report_id: Optional[str]):
+    """Attribute the LLM calls of the current request (or task) to a report"""
+    _report_id.set(report_id)
+
+
+def current_llm_report() -> Optional[str]:
+    return _report_id.get()
+
+
+def prompt_budget(stage: str) -> int:
+    return int(os.getenv(f"LLM_PROMPT_BUDGET_{stage.upper()}", PROMPT_BUDGETS.get(stage, DEFAULT_PROMPT_BUDGET)))
+
+
+def _encoding(model: str):
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Tokens in text (exact with tiktoken, otherwise about 4 characters per token)"""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: list, model: str = "gpt-3.5-turbo") -> int:
+    # ~4 tokens of chat formatting per message
+    return sum(count_tokens(m.get("content") or "", model) + 4 for m in messages) + 2
+
+
+def truncate_to_tokens(text: str, budget: int, model: str = "gpt-3.5-turbo") -> str:
+    """Cut text to at most budget tokens"""
+    if count_tokens(text, model) <= budget:
+        return text
+    if tiktoken is not None:
+        encoding = _encoding(model)
+        return encoding.decode(encoding.encode(text)[:budget])
+    return text[:budget * 4]
+
+
+def fit_lines(lines: list, budget: int, model: str = "gpt-3.5-turbo", omitted: str = "... {count} more") -> list:
+    """Keep leading lines while they fit in budget tokens, noting how many were left out"""
+    kept, used = [], 0
+    for index, line in enumerate(lines):
+        used += count_tokens(line, model) + 1
+        if used > budget:
+            return kept + [omitted.format(count=len(lines) - index)]
+        kept.append(line)
+    return kept
+
+
+def compact_json(data) -> str:
+    """JSON without whitespace for prompts"""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def prompt_test(test, include_status: bool = False) -> dict:
+    """A test as prompt input: only the fields the model needs, nulls left out"""
+    data = {"test_name": test.test_name, "observed_value": test.observed_value}
+    if test.unit:
+        data["unit"] = test.unit
+    if test.reference_range and (test.reference_range.min is not None or test.reference_range.max is not None):
+        data["reference_range"] = test.reference_range.model_dump(exclude_none=True)
+    if include_status and test.status:
+        data["status"] = test.status.value
+    return data
+
+
+def test_line(name: str, value, unit: Optional[str], status: Optional[str]) -> str:
+    """One compact prompt line per test: "Glucose: 130 mg/dL (HIGH)" """
+    line = f"{name}: {value}" + (f" {unit}" if unit else "")
+    return f"{line} ({status})" if status else line
+
+
+class TokenUsage:
+    """Prompt and completion tokens per stage, and per report for recent reports"""
+
+    def __init__(self, max_reports: int = TRACKED_REPORTS):
+        self.max_reports = max_reports
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._reports = OrderedDict()
+
+    def record(self, stage: str, prompt_tokens: int, completion_tokens: int, report_id: Optional[str] = None):
+        with self._lock:
+            totals = self._stages.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+
+            if report_id:
+                report = self._reports.pop(report_id, None) or {}
+                stage_totals = report.setdefault(stage, {"prompt_tokens": 0, "completion_tokens": 0})
+                stage_totals["prompt_tokens"] += prompt_tokens
+                stage_totals["completion_tokens"] += completion_tokens
+                self._reports[report_id] = report
+                if len(self._reports) > self.max_reports:
+                    self._reports.popitem(last=False)
+
+    def report(self, report_id: str) -> Optional[dict]:
+        with self._lock:
+            report = self._reports.get(report_id)
+            if report is None:
+                return None
+            return {
+                "stages": {stage: dict(totals) for stage, totals in report.items()},
+                "prompt_tokens": sum(t["prompt_tokens"] for t in report.values()),
+                "completion_tokens": sum(t["completion_tokens"] for t in report.values())
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {}
+            for stage, totals in self._stages.items():
+                calls = totals["calls"]
+                stages[stage] = {
+                    **totals,
+                    "avg_prompt_tokens": round(totals["prompt_tokens"] / calls, 1) if calls else 0.0,
+                    "avg_completion_tokens": round(totals["completion_tokens"] / calls, 1) if calls else 0.0
+                }
+            return {
+                "counter": "tiktoken" if tiktoken is not None else "estimate",
+                "stages": stages,
+                "reports_tracked": len(self._reports)
+            }
+
+
+token_usage = TokenUsage()
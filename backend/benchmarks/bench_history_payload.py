@@ -0,0 +1,117 @@
+"""
+History Payload Benchmark
+Serialization CPU time and transfer size of the /user/{user_id}/history payload
+
+Usage (from backend/):
+    python benchmarks/bench_history_payload.py --reports 100 --tests 40
+"""
+
+import os
+import sys
+import time
+import gzip
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from responses import FastJSONResponse, orjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+EXPLANATION = (
+    "This test measures how much of this substance is in your blood. A value outside the "
+    "reference range can have many common causes such as diet, hydration or recent exercise. "
+    "Please discuss the result with your doctor, who can look at it together with your history."
+)
+ALERT = "Your value is outside the reference range. Consider discussing it with your healthcare provider."
+
+
+def build_history(reports: int, tests: int, include_explanations: bool) -> dict:
+    result = []
+    for r in range(reports):
+        test_results = []
+        for t in range(tests):
+            row = {
+                "id": f"00000000-0000-0000-0000-{r:06d}{t:06d}",
+                "report_id": f"report-{r}",
+                "test_name": f"Test parameter {t}",
+                "observed_value": f"{t * 1.37:.2f}",
+                "unit": "mg/dL",
+                "reference_min": 1.0,
+                "reference_max": 40.0,
+                "status": "HIGH" if t % 5 == 0 else "NORMAL",
+                "severity": "yellow" if t % 5 == 0 else "green",
+            }
+            if include_explanations:
+                row["explanation"] = EXPLANATION if t % 5 == 0 else None
+                row["alert_message"] = ALERT if t % 5 == 0 else None
+            test_results.append(row)
+        result.append({
+            "id": f"report-{r}",
+            "user_id": "user",
+            "file_name": f"report-{r}.pdf",
+            "patient_name": "Patient",
+            "health_score": 80,
+            "status": "completed",
+            "created_at": "2025-01-01T00:00:00",
+            "total_tests": tests,
+            "abnormal_count": tests // 5,
+            "test_results": test_results,
+        })
+    return {"reports": result}
+
+
+def time_render(render, payload, repeat: int) -> tuple:
+    timings = []
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = render(payload)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=100)
+    parser.add_argument("--tests", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mbps", type=float, default=10.0, help="Link speed used to estimate transfer time")
+    args = parser.parse_args()
+
+    full = build_history(args.reports, args.tests, include_explanations=True)
+    lean = build_history(args.reports, args.tests, include_explanations=False)
+
+    cases = [
+        ("before: jsonable_encoder + JSONResponse", lambda p: JSONResponse(jsonable_encoder(p)).body, full),
+        (f"after: FastJSONResponse ({'orjson' if orjson else 'json'})", lambda p: FastJSONResponse(p).body, full),
+        ("after: FastJSONResponse, no explanations", lambda p: FastJSONResponse(p).body, lean),
+    ]
+
+    rows = args.reports * args.tests
+    print(f"History payload: {args.reports} reports x {args.tests} tests = {rows} rows\n")
+    print(f"{'case':<48} {'serialize ms':>12} {'raw KB':>9} {'gzip KB':>9} {'br KB':>9} {'transfer ms':>12}")
+
+    for name, render, payload in cases:
+        ms, body = time_render(render, payload, args.repeat)
+        gz = gzip.compress(body, compresslevel=6)
+        br = brotli.compress(body, quality=4) if brotli else None
+        wire = len(br) if br is not None else len(gz)
+        transfer_ms = wire * 8 / (args.mbps * 1_000_000) * 1000
+        print(
+            f"{name:<48} {ms:>12.1f} {len(body) / 1024:>9.1f} {len(gz) / 1024:>9.1f} "
+            f"{(len(br) / 1024 if br is not None else float('nan')):>9.1f} {transfer_ms:>12.1f}"
+        )
+
+    print(f"\nUncompressed transfer of the 'before' payload at {args.mbps} Mbit/s: "
+          f"{len(JSONResponse(jsonable_encoder(full)).body) * 8 / (args.mbps * 1_000_000) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
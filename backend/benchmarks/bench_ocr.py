@@ -0,0 +1,103 @@
+"""
+OCR Settings Benchmark
+Per-page Tesseract time versus characters recovered for each rasterization
+DPI, with and without preprocessing (crop, deskew, binarize), and for the
+adaptive DPI ladder used in production
+
+Needs tesseract and poppler installed. Corpus: a directory of sample
+reports (scanned PDFs and/or PNG/JPEG/WebP photos).
+
+Usage (from backend/):
+    python benchmarks/bench_ocr.py path/to/sample-reports --dpi 150 200 300
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import pytesseract
+from PIL import Image, ImageOps
+
+from services.ocr_service import (
+    OCR_DPI_LADDER, prepare_image, text_quality, ocr_pdf_page, pdf_page_count, render_pdf_page
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def ocr_timed(image) -> tuple:
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(image, lang="eng").strip()
+    return text, (time.perf_counter() - start) * 1000
+
+
+def bench_pdf_page(path: str, page_number: int, dpis: list, results: dict):
+    for dpi in dpis:
+        start = time.perf_counter()
+        image = render_pdf_page(path, page_number, dpi)
+        render_ms = (time.perf_counter() - start) * 1000
+
+        for preprocess in (False, True):
+            start = time.perf_counter()
+            prepared = prepare_image(image, scale=False) if preprocess else image
+            preprocess_ms = (time.perf_counter() - start) * 1000
+            text, ocr_ms = ocr_timed(prepared)
+            name = f"pdf {dpi} dpi" + (" + preprocess" if preprocess else "")
+            results.setdefault(name, []).append((render_ms + preprocess_ms + ocr_ms, len(text), text_quality(text)))
+
+    start = time.perf_counter()
+    best = ocr_pdf_page(path, page_number)
+    name = f"pdf ladder {'/'.join(str(d) for d in OCR_DPI_LADDER)}"
+    results.setdefault(name, []).append(((time.perf_counter() - start) * 1000, len(best["text"]), best["quality"]))
+
+
+def bench_image(path: str, results: dict):
+    image = ImageOps.exif_transpose(Image.open(path))
+    image.load()
+
+    settings = [
+        ("image raw", lambda img: img),
+        ("image scale + binarize", lambda img: prepare_image(img, crop=False, straighten=False)),
+        ("image full preprocess", lambda img: prepare_image(img)),
+    ]
+    for name, prepare in settings:
+        start = time.perf_counter()
+        prepared = prepare(image)
+        preprocess_ms = (time.perf_counter() - start) * 1000
+        text, ocr_ms = ocr_timed(prepared)
+        results.setdefault(name, []).append((preprocess_ms + ocr_ms, len(text), text_quality(text)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="directory of sample reports")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[150, 200, 300])
+    args = parser.parse_args()
+
+    results = {}
+    for file_name in sorted(os.listdir(args.corpus)):
+        path = os.path.join(args.corpus, file_name)
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension == ".pdf":
+            for page_number in range(1, pdf_page_count(path) + 1):
+                bench_pdf_page(path, page_number, args.dpi, results)
+        elif extension in IMAGE_EXTENSIONS:
+            bench_image(path, results)
+        else:
+            continue
+        print(f"✓ {file_name}")
+
+    print(f"\n{'setting':<34} {'pages':>6} {'ms/page':>9} {'chars/page':>11} {'quality':>8} {'chars/s':>9}")
+    for name, samples in results.items():
+        ms = statistics.mean(s[0] for s in samples)
+        chars = statistics.mean(s[1] for s in samples)
+        quality = statistics.mean(s[2] for s in samples)
+        print(f"{name:<34} {len(samples):>6} {ms:>9.0f} {chars:>11.0f} {quality:>8.2f} {chars / (ms / 1000):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
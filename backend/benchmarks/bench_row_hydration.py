@@ -0,0 +1,120 @@
+"""
+Row Hydration Benchmark
+Rows per second when reading test results as ORM objects copied into dicts
+versus plain column tuples serialized straight into dicts (select_rows)
+
+Usage (from backend/):
+    python benchmarks/bench_row_hydration.py --reports 100 --tests 100
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+# Use a throwaway SQLite database
+_db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file.name}"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from database import SessionLocal, ensure_schema
+from models.db_models import Report, TestResult
+from services.supabase_service import select_rows, TEST_RESULT_FIELDS
+
+EXPLANATION = "This test measures how much of this substance is in your blood. " * 3
+
+
+def seed(reports: int, tests: int) -> list:
+    db = SessionLocal()
+    report_ids = []
+    for r in range(reports):
+        report = Report(user_id="bench-user", file_name=f"report-{r}.pdf", status="completed")
+        db.add(report)
+        db.flush()
+        report_ids.append(report.id)
+        db.add_all([
+            TestResult(
+                report_id=report.id,
+                test_name=f"Test parameter {t}",
+                observed_value=f"{t * 1.37:.2f}",
+                unit="mg/dL",
+                reference_min=1.0,
+                reference_max=40.0,
+                status="HIGH" if t % 5 == 0 else "NORMAL",
+                severity="yellow" if t % 5 == 0 else "green",
+                explanation=EXPLANATION if t % 5 == 0 else None
+            )
+            for t in range(tests)
+        ])
+    db.commit()
+    db.close()
+    return report_ids
+
+
+def orm_to_dicts(report_ids: list) -> list:
+    """Previous read path: full ORM objects, copied field by field"""
+    db = SessionLocal()
+    try:
+        results = db.query(TestResult).filter(TestResult.report_id.in_(report_ids)).all()
+        return [
+            {
+                "id": r.id,
+                "report_id": r.report_id,
+                "test_name": r.test_name,
+                "observed_value": r.observed_value,
+                "unit": r.unit,
+                "reference_min": r.reference_min,
+                "reference_max": r.reference_max,
+                "status": r.status,
+                "severity": r.severity,
+                "explanation": r.explanation,
+                "alert_message": r.alert_message
+            }
+            for r in results
+        ]
+    finally:
+        db.close()
+
+
+def tuples_to_dicts(report_ids: list) -> list:
+    """Current read path: column tuples serialized straight into dicts"""
+    db = SessionLocal()
+    try:
+        return select_rows(db, TestResult, TEST_RESULT_FIELDS, TestResult.report_id.in_(report_ids))
+    finally:
+        db.close()
+
+
+def measure(read, report_ids: list, repeat: int) -> tuple:
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(read(report_ids))
+        timings.append(time.perf_counter() - start)
+    return rows, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=100)
+    parser.add_argument("--tests", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        ensure_schema()
+        report_ids = seed(args.reports, args.tests)
+
+        print(f"\n{'read path':<36} {'rows':>7} {'median ms':>10} {'rows/s':>12}")
+        for name, read in [("ORM objects -> dicts (before)", orm_to_dicts), ("column tuples -> dicts (after)", tuples_to_dicts)]:
+            rows, seconds = measure(read, report_ids, args.repeat)
+            print(f"{name:<36} {rows:>7} {seconds * 1000:>10.1f} {rows / seconds:>12,.0f}")
+    finally:
+        os.unlink(_db_file.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Re-analyze Reports
+Re-run the analysis of saved reports from their stored extraction artifacts
+(cleaned text / raw LLM JSON), without PDF parsing or OCR
+
+Usage (from backend/):
+    python scripts/reanalyze_reports.py --report-id <id> [--report-id <id> ...]
+    python scripts/reanalyze_reports.py --stale --limit 100
+    python scripts/reanalyze_reports.py --stale --dry-run
+
+--stale selects every report whose stored extraction was made with an older
+extraction prompt version. --reuse-extraction skips the LLM extraction and
+only redoes classification, explanations and summary.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from prompts.medical_prompts import EXTRACT_PROMPT_VERSION
+from services.supabase_service import supabase_service
+from services.pipeline_service import reanalyze_report
+from services.admission_service import BULK, set_llm_caller
+from services.llm_ledger import llm_ledger
+
+
+async def run(report_ids: list, reuse_extraction: bool) -> int:
+    set_llm_caller("reanalysis", BULK)
+    failures = 0
+    for index, report_id in enumerate(report_ids, start=1):
+        started = time.perf_counter()
+        try:
+            result = await reanalyze_report(report_id, reuse_extraction=reuse_extraction)
+            if result is None:
+                failures += 1
+                print(f"[{index}/{len(report_ids)}] ✗ {report_id}: no stored extraction")
+                continue
+            print(
+                f"[{index}/{len(report_ids)}] ✓ {report_id}: {len(result.tests)} tests, "
+                f"health score {result.health_score} ({time.perf_counter() - started:.1f}s)"
+            )
+        except Exception as e:
+            failures += 1
+            print(f"[{index}/{len(report_ids)}] ✗ {report_id}: {e}")
+    await llm_ledger.flush()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--report-id", action="append", default=[], help="report to re-analyze (repeatable)")
+    parser.add_argument("--stale", action="store_true",
+                        help=f"re-analyze reports not yet extracted with prompt version {EXTRACT_PROMPT_VERSION}")
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of stale reports")
+    parser.add_argument("--reuse-extraction", action="store_true", help="reuse the stored LLM extraction JSON")
+    parser.add_argument("--dry-run", action="store_true", help="list the selected reports and exit")
+    args = parser.parse_args()
+
+    report_ids = list(args.report_id)
+    if args.stale:
+        stale = asyncio.run(supabase_service.get_stale_artifact_report_ids(EXTRACT_PROMPT_VERSION, args.limit))
+        report_ids += [r for r in stale if r not in report_ids]
+
+    if not report_ids:
+        parser.error("no reports selected (use --report-id or --stale)")
+
+    if args.dry_run:
+        print("\n".join(report_ids))
+        print(f"{len(report_ids)} reports selected")
+        return
+
+    failures = asyncio.run(run(report_ids, args.reuse_extraction))
+    print(f"\nRe-analyzed {len(report_ids) - failures}/{len(report_ids)} reports")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import asyncio
+import types
+
+import httpx
+import openai
+import pytest
+
+from services.llm_service import ResilientLLM, LLMUnavailable
+from services.llm_ledger import llm_ledger
+
+
+class RejectingCompletions:
+    """Fake chat.completions endpoint that answers every call with an HTTP error"""
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+        response = httpx.Response(self.status_code, request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+        raise openai.APIStatusError("rejected", response=response, body=None)
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 404, 422])
+def test_rejected_request_raises_llm_unavailable(monkeypatch, status_code):
+    monkeypatch.setattr(llm_ledger, "enabled", False)
+    completions = RejectingCompletions(status_code)
+    llm = ResilientLLM(types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)))
+
+    with pytest.raises(LLMUnavailable, match=f"explain call rejected: {status_code}") as raised:
+        asyncio.run(llm.chat("explain", messages=[{"role": "user", "content": "What is LDL?"}]))
+
+    assert isinstance(raised.value.__cause__, openai.APIStatusError)
+    # Not retried, counted as an error and kept away from the circuit breaker
+    assert completions.calls == 1
+    counters = llm.stats()["stages"]["explain"]
+    assert counters["errors"] == 1
+    assert "retries" not in counters and "upstream_errors" not in counters
+    assert not llm.breaker.is_open()
+    assert llm.breaker.stats()["consecutive_failures"] == 0
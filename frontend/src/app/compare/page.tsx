@@ -10,7 +10,7 @@ import Link from 'next/link';
 import { useAuth } from '@/contexts/AuthContext';
 import Header from '@/components/ui/Header';
 import Footer from '@/components/ui/Footer';
-import { getUserReports, getTestResults } from '@/lib/api';
+import { getUserReports, compareReports as fetchComparison } from '@/lib/api';
 
 interface Report {
     id: string;
@@ -20,20 +20,12 @@ interface Report {
     patient_name?: string;
 }
 
-interface TestResult {
-    test_name: string;
-    observed_value: string;
-    unit: string;
-    status: string;
-    severity: string;
-}
-
 interface ComparisonResult {
     test_name: string;
     unit: string;
     before: { value: string; status: string };
     after: { value: string; status: string };
-    change: 'improved' | 'worsened' | 'stable' | 'new';
+    change: 'improved' | 'worsened' | 'stable' | 'new' | 'removed';
     percentChange: number;
 }
 
@@ -75,66 +67,17 @@ export default function ComparePage() {
         setComparing(true);
 
         try {
-            // Fetch test results for both reports from API
-            const [beforeTests, afterTests] = await Promise.all([
-                getTestResults(selectedBefore),
-                getTestResults(selectedAfter),
-            ]);
-
-            // Create comparison
-            const comparisonMap = new Map<string, ComparisonResult>();
-
-            // Add before tests
-            beforeTests.forEach((test: TestResult) => {
-                comparisonMap.set(test.test_name, {
-                    test_name: test.test_name,
-                    unit: test.unit,
-                    before: { value: test.observed_value, status: test.status },
-                    after: { value: '-', status: '' },
-                    change: 'stable',
-                    percentChange: 0,
-                });
-            });
-
-            // Add/update after tests
-            afterTests.forEach((test: TestResult) => {
-                const existing = comparisonMap.get(test.test_name);
-                if (existing) {
-                    existing.after = { value: test.observed_value, status: test.status };
-
-                    // Calculate percent change
-                    const beforeVal = parseFloat(existing.before.value);
-                    const afterVal = parseFloat(test.observed_value);
-
-                    if (!isNaN(beforeVal) && !isNaN(afterVal) && beforeVal !== 0) {
-                        existing.percentChange = ((afterVal - beforeVal) / beforeVal) * 100;
-
-                        // Determine if improved or worsened (simplified: assume lower is better for abnormal)
-                        if (Math.abs(existing.percentChange) < 5) {
-                            existing.change = 'stable';
-                        } else if (test.status === 'NORMAL' && existing.before.status !== 'NORMAL') {
-                            existing.change = 'improved';
-                        } else if (test.status !== 'NORMAL' && existing.before.status === 'NORMAL') {
-                            existing.change = 'worsened';
-                        } else if (existing.percentChange < 0 && existing.before.status !== 'NORMAL') {
-                            existing.change = 'improved';
-                        } else if (existing.percentChange > 0 && existing.before.status !== 'NORMAL') {
-                            existing.change = 'worsened';
-                        }
-                    }
-                } else {
-                    comparisonMap.set(test.test_name, {
-                        test_name: test.test_name,
-                        unit: test.unit,
-                        before: { value: '-', status: '' },
-                        after: { value: test.observed_value, status: test.status },
-                        change: 'new',
-                        percentChange: 0,
-                    });
-                }
-            });
+            // The server joins both reports on test name and computes the changes
+            const data = await fetchComparison([selectedBefore, selectedAfter]);
 
-            setComparison(Array.from(comparisonMap.values()));
+            setComparison(data.comparison.map((item) => ({
+                test_name: item.test_name,
+                unit: item.unit || '',
+                before: item.before,
+                after: item.after,
+                change: item.change,
+                percentChange: item.percent_change,
+            })));
         } catch (err) {
             console.error('Comparison error:', err);
         } finally {
@@ -304,6 +247,7 @@ function ChangeIndicator({ change, percent }: { change: string; percent: number
         worsened: { icon: ArrowUp, color: 'text-red-400', bg: 'bg-red-500/20', label: 'Worsened' },
         stable: { icon: Minus, color: 'text-zinc-400', bg: 'bg-zinc-500/20', label: 'Stable' },
         new: { icon: ArrowRight, color: 'text-blue-400', bg: 'bg-blue-500/20', label: 'New' },
+        removed: { icon: Minus, color: 'text-zinc-500', bg: 'bg-zinc-500/10', label: 'Removed' },
     }[change] || { icon: Minus, color: 'text-zinc-400', bg: 'bg-zinc-500/20', label: '' };
 
     const Icon = config.icon;
@@ -311,7 +255,7 @@ function ChangeIndicator({ change, percent }: { change: string; percent: number
     return (
         <span className={`inline-flex items-center gap-1 px-2 py-1 rounded-full text-sm ${config.bg} ${config.color}`}>
             <Icon className="w-4 h-4" />
-            {percent !== 0 && change !== 'new' && `${percent > 0 ? '+' : ''}${percent.toFixed(1)}%`}
+            {percent !== 0 && change !== 'new' && change !== 'removed' && `${percent > 0 ? '+' : ''}${percent.toFixed(1)}%`}
         </span>
     );
 }
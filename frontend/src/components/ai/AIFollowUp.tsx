@@ -3,6 +3,8 @@
 import React, { useState } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { MessageCircle, Send, Loader2, X, Bot, User } from 'lucide-react';
+import { askQuestionStream } from '@/lib/api';
+import { useAuth } from '@/contexts/AuthContext';
 
 interface Message {
     role: 'user' | 'assistant';
@@ -16,6 +18,7 @@ interface AIFollowUpProps {
 }
 
 export default function AIFollowUp({ reportId, testName, onClose }: AIFollowUpProps) {
+    const { user } = useAuth();
     const [isOpen, setIsOpen] = useState(false);
     const [messages, setMessages] = useState<Message[]>([]);
     const [input, setInput] = useState(testName ? `Why is my ${testName} abnormal?` : '');
@@ -33,27 +36,32 @@ export default function AIFollowUp({ reportId, testName, onClose }: AIFollowUpPr
 
         const userMessage = input.trim();
         setInput('');
-        setMessages(prev => [...prev, { role: 'user', content: userMessage }]);
+        // The assistant's bubble fills in as the answer streams
+        setMessages(prev => [...prev, { role: 'user', content: userMessage }, { role: 'assistant', content: '' }]);
         setLoading(true);
 
+        const updateAnswer = (update: (content: string) => string) => {
+            setMessages(prev => [
+                ...prev.slice(0, -1),
+                { role: 'assistant', content: update(prev[prev.length - 1].content) },
+            ]);
+        };
+
+        let received = false;
         try {
-            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/api/insights/ask`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    report_id: reportId,
-                    question: userMessage,
-                }),
-            });
-
-            if (!response.ok) throw new Error('Failed to get response');
-
-            const data = await response.json();
-            setMessages(prev => [...prev, { role: 'assistant', content: data.answer }]);
+            await askQuestionStream(userMessage, (text) => {
+                received = true;
+                setLoading(false);
+                updateAnswer(content => content + text);
+            }, reportId, user?.id);
         } catch (err) {
-            // Fallback response for demo
-            const fallbackResponse = getFallbackResponse(userMessage);
-            setMessages(prev => [...prev, { role: 'assistant', content: fallbackResponse }]);
+            if (received) {
+                updateAnswer(content => `${content}\n\n(The answer was interrupted. Please try again.)`);
+            } else {
+                // Fallback response for demo
+                const fallbackResponse = getFallbackResponse(userMessage);
+                updateAnswer(() => fallbackResponse);
+            }
         } finally {
             setLoading(false);
         }
@@ -120,7 +128,7 @@ export default function AIFollowUp({ reportId, testName, onClose }: AIFollowUpPr
                     </div>
                 )}
 
-                {messages.map((msg, i) => (
+                {messages.filter(msg => msg.content).map((msg, i) => (
                     <motion.div
                         key={i}
                         initial={{ opacity: 0, y: 10 }}
@@ -133,7 +141,7 @@ export default function AIFollowUp({ reportId, testName, onClose }: AIFollowUpPr
                             </div>
                         )}
                         <div
-                            className={`max-w-[80%] p-3 rounded-xl text-sm ${msg.role === 'user'
+                            className={`max-w-[80%] p-3 rounded-xl text-sm whitespace-pre-wrap ${msg.role === 'user'
                                     ? 'bg-indigo-500 text-white'
                                     : 'bg-white/10 text-zinc-200'
                                 }`}
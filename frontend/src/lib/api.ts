@@ -27,6 +27,7 @@ export interface AnalysisResponse {
     health_score?: number;
     summary?: string;
     overall_status: string;
+    enrichment_pending?: boolean;
 }
 
 export interface ChartData {
@@ -130,6 +131,28 @@ export async function getChartData(reportId: string): Promise<ChartData> {
     return response.json();
 }
 
+export interface ReportBundle {
+    report_id: string;
+    analysis?: AnalysisResponse;
+    insights?: InsightsData | null;
+    chart_data?: ChartData | null;
+}
+
+// Get report analysis, insights and chart data in one request
+export async function getReportBundle(
+    reportId: string,
+    fields?: Array<'analysis' | 'insights' | 'chart_data'>
+): Promise<ReportBundle> {
+    const query = fields && fields.length > 0 ? `?fields=${fields.join(',')}` : '';
+    const response = await fetch(`${API_BASE_URL}/api/reports/${reportId}/bundle${query}`);
+
+    if (!response.ok) {
+        throw new Error('Failed to fetch report');
+    }
+
+    return response.json();
+}
+
 // Get explanation for a specific test
 export async function getExplanation(
     testName: string,
@@ -157,6 +180,69 @@ export async function getExplanation(
     return response.json();
 }
 
+export interface AskAnswer {
+    question: string;
+    answer: string;
+    conversation_id?: string | null;
+}
+
+// Ask a follow-up question; the answer streams in as server-sent events.
+// onDelta receives each piece of text as it arrives. With userId the Q&A is saved.
+export async function askQuestionStream(
+    question: string,
+    onDelta: (text: string) => void,
+    reportId?: string,
+    userId?: string
+): Promise<AskAnswer> {
+    const response = await fetch(`${API_BASE_URL}/api/insights/ask/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            report_id: reportId,
+            question,
+            user_id: userId,
+        }),
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error('Failed to get response');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary: number;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (event === 'delta') onDelta(payload.text);
+            else if (event === 'done') return payload;
+            else if (event === 'error') throw new Error(payload.detail || 'The answer was interrupted');
+        }
+    }
+
+    throw new Error('The answer was interrupted');
+}
+
 // Get all reports for a user
 export async function getUserReports(userId: string): Promise<any[]> {
     const response = await fetch(`${API_BASE_URL}/api/reports/user/${userId}`);
@@ -194,3 +280,41 @@ export async function getTestResults(reportId: string): Promise<any[]> {
     return data.tests || [];
 }
 
+
+export interface ReportComparison {
+    reports: Array<{
+        id: string;
+        file_name?: string;
+        health_score?: number;
+        created_at: string;
+    }>;
+    comparison: Array<{
+        test_name: string;
+        unit?: string;
+        before: { value: string; status: string };
+        after: { value: string; status: string };
+        change: 'improved' | 'worsened' | 'stable' | 'new' | 'removed';
+        percent_change: number;
+        values: Array<{ value: string; status?: string } | null>;
+        deltas: Array<{
+            from_report_id: string;
+            to_report_id: string;
+            change: 'improved' | 'worsened' | 'stable' | 'new' | 'removed';
+            percent_change: number;
+        }>;
+    }>;
+}
+
+// Compare test results across reports (joined and diffed on the server)
+export async function compareReports(reportIds: string[]): Promise<ReportComparison> {
+    const params = new URLSearchParams();
+    reportIds.forEach((id) => params.append('report_ids', id));
+
+    const response = await fetch(`${API_BASE_URL}/api/reports/compare?${params.toString()}`);
+
+    if (!response.ok) {
+        throw new Error('Failed to compare reports');
+    }
+
+    return response.json();
+}
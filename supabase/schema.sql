@@ -9,6 +9,10 @@ DROP TRIGGER IF EXISTS on_auth_user_created ON auth.users;
 DROP FUNCTION IF EXISTS handle_new_user() CASCADE;
 
 -- STEP 2: Drop old tables (in correct order due to foreign keys)
+DROP TABLE IF EXISTS llm_calls CASCADE;
+DROP TABLE IF EXISTS extraction_artifacts CASCADE;
+DROP TABLE IF EXISTS stored_blobs CASCADE;
+DROP TABLE IF EXISTS deleted_records CASCADE;
 DROP TABLE IF EXISTS ai_conversations CASCADE;
 DROP TABLE IF EXISTS reminders CASCADE;
 DROP TABLE IF EXISTS test_results CASCADE;
@@ -79,7 +83,14 @@ CREATE TABLE reports (
     summary TEXT,
     status TEXT DEFAULT 'pending',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    -- Aggregates written when test results are saved
+    total_tests INTEGER,
+    normal_count INTEGER,
+    abnormal_count INTEGER,
+    critical_count INTEGER,
+    status_counts TEXT,
+    severity_counts TEXT
 );
 
 -- =====================================================
@@ -97,6 +108,43 @@ CREATE TABLE test_results (
     severity TEXT,
     explanation TEXT,
     alert_message TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- EXTRACTION ARTIFACTS (text and raw LLM JSON for re-analysis)
+-- =====================================================
+CREATE TABLE extraction_artifacts (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    report_id UUID REFERENCES reports(id) ON DELETE CASCADE NOT NULL,
+    extractor TEXT,
+    extractor_version TEXT,
+    prompt_version TEXT,
+    model TEXT,
+    pages TEXT,
+    cleaned_text TEXT,
+    raw_llm_json TEXT,
+    repaired BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- LLM CALLS (ledger of every LLM call: latency, tokens, retries)
+-- =====================================================
+CREATE TABLE llm_calls (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    report_id UUID REFERENCES reports(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    model TEXT,
+    endpoint TEXT,
+    outcome TEXT,
+    latency_ms REAL,
+    first_token_ms REAL,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    retries INTEGER DEFAULT 0,
+    cache_hit BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
@@ -128,6 +176,30 @@ CREATE TABLE reminders (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- =====================================================
+-- DELETED RECORDS (tombstones for delta sync)
+-- =====================================================
+CREATE TABLE deleted_records (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID,
+    entity_type TEXT NOT NULL,
+    entity_id UUID NOT NULL,
+    report_id UUID,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- =====================================================
+-- STORED BLOBS (content-addressed uploads, reference counted)
+-- =====================================================
+CREATE TABLE stored_blobs (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- =====================================================
 -- INDEXES
 -- =====================================================
@@ -136,7 +208,15 @@ CREATE INDEX idx_family_owner ON family_members(owner_id);
 CREATE INDEX idx_reports_user_id ON reports(user_id);
 CREATE INDEX idx_reports_family ON reports(family_member_id);
 CREATE INDEX idx_reports_created ON reports(created_at DESC);
+CREATE INDEX idx_reports_updated ON reports(updated_at);
 CREATE INDEX idx_test_results_report ON test_results(report_id);
+CREATE INDEX idx_test_results_updated ON test_results(updated_at);
+CREATE INDEX idx_artifacts_report ON extraction_artifacts(report_id);
+CREATE INDEX idx_artifacts_prompt_version ON extraction_artifacts(prompt_version);
+CREATE INDEX idx_llm_calls_report ON llm_calls(report_id);
+CREATE INDEX idx_llm_calls_created ON llm_calls(created_at);
+CREATE INDEX idx_deleted_records_user ON deleted_records(user_id);
+CREATE INDEX idx_deleted_records_deleted ON deleted_records(deleted_at);
 CREATE INDEX idx_conversations_user ON ai_conversations(user_id);
 CREATE INDEX idx_reminders_user ON reminders(user_id);
 
@@ -149,3 +229,7 @@ ALTER TABLE reports DISABLE ROW LEVEL SECURITY;
 ALTER TABLE test_results DISABLE ROW LEVEL SECURITY;
 ALTER TABLE ai_conversations DISABLE ROW LEVEL SECURITY;
 ALTER TABLE reminders DISABLE ROW LEVEL SECURITY;
+ALTER TABLE deleted_records DISABLE ROW LEVEL SECURITY;
+ALTER TABLE stored_blobs DISABLE ROW LEVEL SECURITY;
+ALTER TABLE extraction_artifacts DISABLE ROW LEVEL SECURITY;
+ALTER TABLE llm_calls DISABLE ROW LEVEL SECURITY;